@@ -1,7 +1,20 @@
 import streamlit as st
-from PIL import Image
 from datetime import datetime
-import requests
+import os
+import sys
+
+# Módulo compartido de preprocesamiento del backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from image_preprocessing import to_jpeg_bytes
+from quality_gate import check_quality
+from dentiscan_client import DentiScanClient, DentiScanError, idempotency_key_for
+
+
+@st.cache_resource
+def cliente_api():
+    # Un cliente por proceso: todas las sesiones y reejecuciones comparten sus conexiones keep-alive
+    return DentiScanClient()
+
 
 st.title("🦷 DentiScan IA - Demo Web")
 
@@ -11,33 +24,40 @@ fecha_nacimiento = st.text_input("📅 Fecha de nacimiento (dd/mm/aaaa):")
 uploaded_file = st.file_uploader("📷 Sube una imagen de tu boca", type=["jpg", "jpeg", "png", "webp"])
 
 if uploaded_file and usuario and correo and fecha_nacimiento:
-    imagen = Image.open(uploaded_file)
-    imagen.save("temp.jpg")
+    # Mismo control de calidad que la API, en local: una foto inservible no se sube
+    calidad = check_quality(uploaded_file.getvalue())
+    if not calidad.ok:
+        st.image(uploaded_file.getvalue(), caption="⚠️ Imagen rechazada", use_column_width=True)
+        st.markdown("**🩺 La foto no sirve para el análisis:**")
+        for motivo in calidad.reasons:
+            st.markdown(f"- {motivo['message']}")
+        st.stop()
+
+    # Convertir a JPG en memoria: nada se escribe en el directorio de trabajo
+    jpeg_bytes = to_jpeg_bytes(uploaded_file.getvalue())
     # Separar nombre y apellido si es posible
     partes_nombre = usuario.strip().split()
     nombre = partes_nombre[0] if len(partes_nombre) > 0 else ""
     apellido = " ".join(partes_nombre[1:]) if len(partes_nombre) > 1 else ""
-    with open("temp.jpg", "rb") as img_file:
-        files = {"imagen": img_file}
-        data = {
-            "nombre": nombre,
-            "apellido": apellido,
-            "email": correo,
-            "fecha_nacimiento": fecha_nacimiento
-        }
-        try:
-            response = requests.post("http://localhost:8000/registro", data=data, files=files)
-            if response.status_code == 200:
-                res = response.json()
-                diagnostico = "Registro exitoso"
-                recomendacion = f"Usuario guardado: {res.get('nombre', '')} {res.get('apellido', '')}"
-            else:
-                diagnostico = "Error al registrar usuario"
-                recomendacion = "Intenta nuevamente más tarde."
-        except Exception as e:
-            diagnostico = "No se pudo conectar con la API"
-            recomendacion = str(e)
-
-    st.image(imagen, caption="✅ Imagen cargada", use_column_width=True)
+    # Streamlit vuelve a ejecutar el script con cada interacción: con la misma
+    # clave la API devuelve el registro ya hecho en lugar de duplicarlo
+    clave = idempotency_key_for(correo, nombre, apellido, fecha_nacimiento, jpeg_bytes)
+    try:
+        res = cliente_api().register(nombre, apellido, correo, fecha_nacimiento, jpeg_bytes,
+                                     filename="imagen.jpg", mime_type="image/jpeg", idempotency_key=clave)
+        diagnostico = "Registro exitoso"
+        recomendacion = f"Usuario guardado: {res.get('nombre', '')} {res.get('apellido', '')}"
+    except DentiScanError as e:
+        if e.status_code == 422:
+            diagnostico = "La foto no sirve para el análisis"
+            recomendacion = " ".join(m["message"] for m in e.reasons) or "Vuelve a tomar la foto."
+        else:
+            diagnostico = "Error al registrar usuario"
+            recomendacion = "Intenta nuevamente más tarde."
+    except Exception as e:
+        diagnostico = "No se pudo conectar con la API"
+        recomendacion = str(e)
+
+    st.image(jpeg_bytes, caption="✅ Imagen cargada", use_column_width=True)
     st.markdown(f"**🩺 Diagnóstico:** {diagnostico}")
     st.markdown(f"**📌 Recomendación:** {recomendacion}")
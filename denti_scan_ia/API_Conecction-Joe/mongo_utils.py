@@ -1,35 +1,35 @@
-from pymongo import MongoClient
-from datetime import datetime, timezone
-import base64
-from PIL import Image
 import os
+import sys
+
+# Módulos compartidos del backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from image_preprocessing import to_jpeg_bytes
+from mongo_image_storage import MongoImageStorage
+from database_config import MONGO_DB_NAME, MONGO_URI, SCANS_COLLECTION, ScanRecord, get_db, insert_scan
 
 def guardar_imagen_dentiscan_local(ruta_imagen, nombre_imagen, usuario, diagnostico, recomendacion,
-                                    uri='mongodb://localhost:27017/',
-                                    db_name='DentiScan-AI--Proyect',
-                                    coleccion_nombre='imagenes'):
-    cliente = MongoClient(uri)
-    db = cliente[db_name]
+                                    uri=MONGO_URI,
+                                    db_name=MONGO_DB_NAME,
+                                    coleccion_nombre=SCANS_COLLECTION):
+    # Cliente compartido del proceso: no se abre una conexión nueva por llamada
+    db = get_db(db_name, uri)
     coleccion = db[coleccion_nombre]
 
-    with Image.open(ruta_imagen) as im:
-        im = im.convert("RGB")
-        temp_path = "temp_convertida.jpg"
-        im.save(temp_path, format="JPEG")
-
-    with open(temp_path, 'rb') as img_file:
-        encoded_string = base64.b64encode(img_file.read()).decode('utf-8')
-
-    os.remove(temp_path)
+    # Convertimos cualquier imagen a JPG en memoria, sin archivo temporal
+    jpeg_bytes = to_jpeg_bytes(ruta_imagen)
 
-    documento = {
-        "nombre": nombre_imagen,
-        "imagen": encoded_string,
-        "usuario": usuario,
-        "diagnostico": diagnostico,
-        "recomendacion": recomendacion,
-        "fecha_subida": datetime.now(timezone.utc)
-    }
+    registro = ScanRecord(
+        name=usuario,
+        image_filename=nombre_imagen,
+        diagnosis=diagnostico,
+        recommendations=[recomendacion],
+        mime_type="image/jpeg",
+        size_bytes=len(jpeg_bytes),
+        status="processed",
+        source="script",
+        # Bytes como BSON Binary (o GridFS si es grande), sin base64
+        image_storage=MongoImageStorage(db).put(jpeg_bytes, nombre_imagen),
+    )
 
-    coleccion.insert_one(documento)
+    insert_scan(registro, coleccion)
     print("✅ Imagen convertida a JPG y guardada en MongoDB local.")
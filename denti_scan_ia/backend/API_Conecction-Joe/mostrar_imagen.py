@@ -1,27 +1,35 @@
-from pymongo import MongoClient
 from PIL import Image
-from io import BytesIO
-import base64
+import os
+import sys
+
+# Módulos compartidos del backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mongo_image_storage import MongoImageStorage
+from database_config import MONGO_DB_NAME, MONGO_URI, SCANS_COLLECTION, find_scan_by_filename, get_db
 
 def mostrar_imagen(nombre_imagen,
-                   uri='mongodb://localhost:27017/',
-                   db_name='DentiScan-AI--Proyect',
-                   coleccion_nombre='imagenes'):
-    client = MongoClient(uri)
-    db = client[db_name]
+                   uri=MONGO_URI,
+                   db_name=MONGO_DB_NAME,
+                   coleccion_nombre=SCANS_COLLECTION):
+    db = get_db(db_name, uri)
     coleccion = db[coleccion_nombre]
 
-    documento = coleccion.find_one({"nombre": nombre_imagen})
+    # Consulta por el índice image_filename
+    documento = find_scan_by_filename(nombre_imagen, coleccion)
+    if documento is None:
+        # Documentos anteriores al esquema unificado guardaban el nombre en 'nombre'
+        documento = coleccion.find_one({"nombre": nombre_imagen})
 
     if documento:
-        print(f"👤 Usuario: {documento.get('usuario')}")
-        print(f"🩺 Diagnóstico: {documento.get('diagnostico')}")
-        print(f"📌 Recomendación: {documento.get('recomendacion')}")
-        print(f"📅 Fecha: {documento.get('fecha_subida')}")
+        print(f"👤 Usuario: {documento.get('name', documento.get('usuario'))}")
+        print(f"🩺 Diagnóstico: {documento.get('diagnosis', documento.get('diagnostico'))}")
+        print(f"📌 Recomendación: {', '.join(documento.get('recommendations') or [documento.get('recomendacion', '')])}")
+        print(f"📅 Fecha: {documento.get('upload_date', documento.get('fecha_subida'))}")
 
-        imagen_base64 = documento['imagen']
-        imagen_bytes = base64.b64decode(imagen_base64)
-        imagen = Image.open(BytesIO(imagen_bytes))
+        # Lectura por bloques desde GridFS o el Binary del documento
+        with MongoImageStorage(db).open(documento) as archivo:
+            imagen = Image.open(archivo)
+            imagen.load()
         imagen.save('imagen_recuperada.jpg')
         imagen.show()
         print("✅ Imagen recuperada y mostrada.")
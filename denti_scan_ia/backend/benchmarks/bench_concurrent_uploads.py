@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark de subidas concurrentes contra /analyze_dental_image.
+
+Sustituye la colección de MongoDB por una que simula latencia de red y mide
+el throughput con distintos niveles de concurrencia. Si la E/S bloqueara el
+event loop, el throughput se mantendría plano; con la E/S en los pools debe
+escalar con la concurrencia. Con el diario de escaneos (scan_journal) la
+petición ya no espera a MongoDB: la latencia simulada solo la paga el flusher.
+
+Uso:
+    python benchmarks/bench_concurrent_uploads.py --requests 64 --latency-ms 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+class ColeccionLenta:
+    """Colección falsa cuyos inserts tardan lo mismo que un Mongo remoto"""
+
+    def __init__(self, latency_s):
+        self.latency_s = latency_s
+        self.count = 0
+
+    def insert_one(self, documento):
+        time.sleep(self.latency_s)
+        self.count += 1
+
+        class _Result:
+            inserted_id = f"bench-{self.count}"
+
+        return _Result()
+
+    def insert_many(self, documentos, ordered=True):
+        # Lo que usa el flusher del diario: un viaje de red por lote
+        time.sleep(self.latency_s)
+        self.count += len(documentos)
+
+
+def jpeg_de_prueba(size_kb):
+    """JPEG de ruido con un tamaño aproximado de size_kb"""
+    from io import BytesIO
+
+    import numpy as np
+    from PIL import Image
+
+    lado = int((size_kb * 1024 / 1.5) ** 0.5)
+    pixels = np.random.default_rng(0).integers(0, 256, (lado, lado, 3), dtype=np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+async def medir(app, total, concurrencia, payload):
+    import httpx
+
+    semaforo = asyncio.Semaphore(concurrencia)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+
+        async def una_subida(i):
+            async with semaforo:
+                r = await http.post(
+                    "/analyze_dental_image",
+                    data={"name": f"bench {i}", "email": "bench@example.com", "birthDate": "2000-01-01"},
+                    files={"dentalImage": (f"img_{i}.jpg", payload, "image/jpeg")},
+                )
+                r.raise_for_status()
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(una_subida(i) for i in range(total)))
+        return time.perf_counter() - inicio
+
+
+async def medir_todo(backend, args, payload):
+    """Una sola pasada por el lifespan: crea los almacenes y apaga los pools al salir"""
+    tiempos = []
+    async with backend.app.router.lifespan_context(backend.app):
+        for c in args.concurrency:
+            tiempos.append((c, await medir(backend.app, args.requests, c, payload)))
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--size-kb", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    # Los archivos subidos van a un directorio temporal, no al uploads/ real
+    workdir = tempfile.mkdtemp(prefix="dentiscan-bench-")
+    os.chdir(workdir)
+
+    import main as backend
+
+    backend.client = object()
+    backend.dental_scans_collection = ColeccionLenta(args.latency_ms / 1000)
+    backend.db_monitor.check = lambda timeout_s: True
+    payload = jpeg_de_prueba(args.size_kb)
+
+    print(f"📊 {args.requests} subidas de {args.size_kb} KB, latencia Mongo simulada {args.latency_ms} ms")
+    base = None
+    for c, elapsed in asyncio.run(medir_todo(backend, args, payload)):
+        rps = args.requests / elapsed
+        base = base or rps
+        print(f"   concurrencia={c:<4} {rps:8.1f} req/s   x{rps / base:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark del micro-batching del motor de inferencia.
+
+Lanza N análisis concurrentes con distintos max_batch_size y compara el
+throughput y el tamaño medio de lote. Con --workers N el modelo corre en un
+pool de N procesos.
+
+Uso:
+    python benchmarks/bench_inference_batching.py --images 256 --side 1024
+    python benchmarks/bench_inference_batching.py --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import numpy as np
+from PIL import Image
+
+from ia_integration import InferenceEngine
+from inference_workers import InferenceWorkerPool
+
+
+def jpeg_de_prueba(lado, seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, (lado, lado, 3), dtype=np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+async def medir(imagenes, max_batch_size, max_wait_ms, workers):
+    pool = None
+    if workers > 0:
+        pool = InferenceWorkerPool(size=workers)
+        await pool.warm_up()
+    engine = InferenceEngine(pool=pool, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    inicio = time.perf_counter()
+    await asyncio.gather(*(engine.analyze(img) for img in imagenes))
+    elapsed = time.perf_counter() - inicio
+    await engine.close()
+    return elapsed, engine.images / max(engine.batches, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--side", type=int, default=1024)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=0, help="procesos de inferencia (0 = en este proceso)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    imagenes = [jpeg_de_prueba(args.side, i % 8) for i in range(args.images)]
+    print(
+        f"📊 {args.images} imágenes de {args.side}x{args.side}, espera máxima {args.max_wait_ms} ms, "
+        f"workers={args.workers}"
+    )
+    for size in args.batch_sizes:
+        elapsed, lote_medio = asyncio.run(medir(imagenes, size, args.max_wait_ms, args.workers))
+        print(f"   max_batch_size={size:<4} {args.images / elapsed:8.1f} img/s   lote medio {lote_medio:.1f}")
+
+
+if __name__ == "__main__":
+    main()
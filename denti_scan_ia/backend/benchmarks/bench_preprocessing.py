@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark del preprocesamiento en memoria contra el flujo anterior.
+
+Compara dos cosas por imagen:
+  - conversión a JPG: temp_convertida.jpg en disco + relectura (antes)
+    contra to_jpeg_bytes en memoria (ahora)
+  - tensor del modelo + miniatura: dos decodificaciones completas (antes)
+    contra una decodificación en modo draft (ahora)
+
+Uso:
+    python benchmarks/bench_preprocessing.py --repeat 10
+    python benchmarks/bench_preprocessing.py --images uploads/*.jpg
+"""
+
+import argparse
+import base64
+import glob
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import numpy as np
+from PIL import Image
+
+from image_preprocessing import preprocess, to_jpeg_bytes
+
+SIZE = (224, 224)
+
+
+def jpeg_guardado_antes(ruta, workdir):
+    with Image.open(ruta) as im:
+        im = im.convert("RGB")
+        temp_path = os.path.join(workdir, "temp_convertida.jpg")
+        im.save(temp_path, format="JPEG")
+    with open(temp_path, "rb") as img_file:
+        encoded = base64.b64encode(img_file.read()).decode("utf-8")
+    os.remove(temp_path)
+    return encoded
+
+
+def jpeg_guardado_ahora(ruta, workdir):
+    return base64.b64encode(to_jpeg_bytes(ruta)).decode("utf-8")
+
+
+def tensor_y_miniatura_antes(ruta):
+    with Image.open(ruta) as im:
+        tensor = np.asarray(im.convert("RGB").resize(SIZE), dtype=np.float32) / 255.0
+    with Image.open(ruta) as im:
+        thumb = im.convert("RGB")
+        thumb.thumbnail((256, 256))
+        buf = BytesIO()
+        thumb.save(buf, format="JPEG", quality=80)
+    return tensor, buf.getvalue()
+
+
+def tensor_y_miniatura_ahora(ruta):
+    result = preprocess(ruta, SIZE)
+    return result.tensor, result.thumbnail
+
+
+def cronometrar(func, rutas, repeat, *args):
+    inicio = time.perf_counter()
+    for _ in range(repeat):
+        for ruta in rutas:
+            func(ruta, *args)
+    return (time.perf_counter() - inicio) * 1000 / (repeat * len(rutas))
+
+
+def foto_sintetica(workdir, ancho=4032, alto=3024):
+    """Foto de 12 MP como las de un teléfono"""
+    rng = np.random.default_rng(0)
+    base = rng.integers(80, 200, (alto // 8, ancho // 8, 3), dtype=np.uint8)
+    im = Image.fromarray(base).resize((ancho, alto), Image.BILINEAR)
+    ruta = os.path.join(workdir, "sintetica_12mp.jpg")
+    im.save(ruta, format="JPEG", quality=92)
+    return ruta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="*", help="imágenes a usar (por defecto uploads/ y una foto sintética)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dentiscan-bench-")
+    rutas = args.images or sorted(glob.glob(os.path.join(BACKEND_DIR, "uploads", "*.jp*g")))
+    rutas = list(rutas) + [foto_sintetica(workdir)]
+
+    print(f"📊 {len(rutas)} imágenes x {args.repeat} repeticiones (ms por imagen)")
+    filas = [
+        ("conversión a JPG", jpeg_guardado_antes, jpeg_guardado_ahora, (workdir,)),
+        ("tensor + miniatura", tensor_y_miniatura_antes, tensor_y_miniatura_ahora, ()),
+    ]
+    for nombre, antes, ahora, extra in filas:
+        t_antes = cronometrar(antes, rutas, args.repeat, *extra)
+        t_ahora = cronometrar(ahora, rutas, args.repeat, *extra)
+        print(f"   {nombre:<20} antes {t_antes:8.1f}   ahora {t_ahora:8.1f}   x{t_antes / t_ahora:.1f}")
+
+
+if __name__ == "__main__":
+    main()
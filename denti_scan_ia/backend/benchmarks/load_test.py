@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga reproducible de la API: /analyze_dental_image, /registro y /health.
+
+Por defecto levanta la app en el mismo proceso (httpx + ASGITransport) con una
+base de datos simulada en memoria que añade la latencia indicada a cada
+operación, así que no hace falta MongoDB. Con --url se mide un servidor ya
+arrancado (uvicorn, con su MongoDB real).
+
+Las imágenes son JPEG sintéticos de tamaños de cámara reales (VGA hasta 12 MP)
+generados con semilla fija. Con --unique (por defecto) cada subida cambia unos
+bytes al final del archivo para que ni el almacén ni la caché de resultados la
+reconozcan como repetida.
+
+Reporta throughput, percentiles de latencia y RSS máximo, y guarda todo en
+JSON junto con el commit, para comparar con --compare contra una ejecución
+anterior.
+
+Uso:
+    python benchmarks/load_test.py --requests 200 --concurrency 16
+    python benchmarks/load_test.py --scenarios health --requests 5000 --concurrency 64
+    python benchmarks/load_test.py --output bench.json --compare bench_anterior.json
+    python benchmarks/load_test.py --url http://localhost:8000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import numpy as np
+from PIL import Image
+
+# Ancho x alto de fotos típicas: webcam, teléfono básico, teléfono actual
+TAMANOS_IMAGEN = ((640, 480), (1280, 960), (2048, 1536), (4032, 3024))
+ESCENARIOS = ("analyze", "registro", "health")
+
+
+class _Resultado:
+    def __init__(self, **campos):
+        self.__dict__.update(campos)
+
+
+class _CursorVacio(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return self
+
+
+class ColeccionSimulada:
+    """Colección en memoria con latencia fija por operación (lo que usa la app)"""
+
+    def __init__(self, latency_s):
+        self.latency_s = latency_s
+        self.docs = {}
+
+    def _esperar(self):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def insert_one(self, documento):
+        self._esperar()
+        self.docs[documento.setdefault("_id", len(self.docs))] = documento
+        return _Resultado(inserted_id=documento["_id"])
+
+    def insert_many(self, documentos, ordered=True):
+        self._esperar()
+        for documento in documentos:
+            self.docs[documento.setdefault("_id", len(self.docs))] = documento
+        return _Resultado(inserted_ids=[d["_id"] for d in documentos])
+
+    def find(self, *args, **kwargs):
+        # Ningún escenario lee escaneos: las cargas en segundo plano (índice de similitud) quedan vacías
+        self._esperar()
+        return _CursorVacio()
+
+    def find_one(self, filtro, *args, **kwargs):
+        self._esperar()
+        return self.docs.get(filtro.get("_id")) if isinstance(filtro, dict) else None
+
+    def replace_one(self, filtro, documento, upsert=False):
+        self._esperar()
+        self.docs[filtro["_id"]] = documento
+
+    def delete_many(self, filtro):
+        self._esperar()
+        return _Resultado(deleted_count=0)
+
+    def create_index(self, *args, **kwargs):
+        return "simulado"
+
+    def create_indexes(self, indexes):
+        return ["simulado"] * len(indexes)
+
+
+class BaseSimulada(dict):
+    def __init__(self, latency_s):
+        super().__init__()
+        self.latency_s = latency_s
+
+    def __missing__(self, nombre):
+        self[nombre] = ColeccionSimulada(self.latency_s)
+        return self[nombre]
+
+
+def usar_mongo_simulado(backend, latency_s):
+    """Conectar la app a la base simulada y dar por sano el monitor de MongoDB"""
+    db = BaseSimulada(latency_s)
+    backend.client = object()
+    backend.db = db
+    backend.dental_scans_collection = db["imagenes"]
+    backend.db_monitor.check = lambda timeout_s: True
+    return db
+
+
+def generar_imagenes(semilla=0):
+    """Un JPEG por tamaño: gradiente suave + ruido, comprime como una foto real"""
+    rng = np.random.default_rng(semilla)
+    imagenes = []
+    for ancho, alto in TAMANOS_IMAGEN:
+        base = rng.integers(60, 220, (alto // 16, ancho // 16, 3), dtype=np.uint8)
+        im = Image.fromarray(base).resize((ancho, alto), Image.BICUBIC)
+        ruido = rng.integers(-12, 12, (alto, ancho, 3), dtype=np.int16)
+        im = Image.fromarray(np.clip(np.asarray(im, dtype=np.int16) + ruido, 0, 255).astype(np.uint8))
+        buf = BytesIO()
+        im.save(buf, format="JPEG", quality=88)
+        imagenes.append(buf.getvalue())
+    return imagenes
+
+
+def percentiles(latencias):
+    if not latencias:
+        return {}
+    ms = np.asarray(latencias) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p90": round(float(np.percentile(ms, 90)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "max": round(float(ms.max()), 2),
+        "mean": round(float(ms.mean()), 2),
+    }
+
+
+def peticion(escenario, i, imagenes, unique):
+    """(método, ruta, kwargs de httpx) para la petición i del escenario"""
+    if escenario == "health":
+        return "GET", "/health", {}
+    data = imagenes[i % len(imagenes)]
+    if unique:
+        # Bytes tras el marcador EOI: el JPEG decodifica igual pero el hash cambia
+        data = data + i.to_bytes(8, "little")
+    if escenario == "analyze":
+        return "POST", "/analyze_dental_image", {
+            "data": {"name": f"carga {i}", "email": f"carga{i % 50}@example.com", "birthDate": "2000-01-01"},
+            "files": {"dentalImage": (f"carga_{i}.jpg", data, "image/jpeg")},
+        }
+    return "POST", "/registro", {
+        "data": {"nombre": "Carga", "apellido": str(i), "email": f"carga{i % 50}@example.com",
+                 "fecha_nacimiento": "01/01/2000"},
+        "files": {"imagen": (f"carga_{i}.jpg", data, "image/jpeg")},
+    }
+
+
+async def correr_escenario(http, escenario, total, concurrencia, imagenes, unique, warmup):
+    # Índices fuera del rango medido: el calentamiento no repite bytes de la medición
+    for i in range(total, total + warmup):
+        metodo, ruta, kwargs = peticion(escenario, i, imagenes, unique)
+        await http.request(metodo, ruta, **kwargs)
+
+    latencias = []
+    codigos = {}
+    errores = 0
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def una(i):
+        nonlocal errores
+        metodo, ruta, kwargs = peticion(escenario, i, imagenes, unique)
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                r = await http.request(metodo, ruta, **kwargs)
+                codigo = r.status_code
+            except Exception:
+                codigo = "exception"
+            latencias.append(time.perf_counter() - inicio)
+        codigos[str(codigo)] = codigos.get(str(codigo), 0) + 1
+        if codigo != 200:
+            errores += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una(i) for i in range(total)))
+    transcurrido = time.perf_counter() - inicio
+    return {
+        "requests": total,
+        "concurrency": concurrencia,
+        "errors": errores,
+        "status_codes": codigos,
+        "elapsed_s": round(transcurrido, 3),
+        "throughput_rps": round(total / transcurrido, 2),
+        "latency_ms": percentiles(latencias),
+    }
+
+
+async def ejecutar(args, imagenes):
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    limites = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    if args.url:
+        cliente = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limites)
+        contexto = None
+    else:
+        import main as backend
+
+        usar_mongo_simulado(backend, args.db_latency_ms / 1000)
+        contexto = backend.app.router.lifespan_context(backend.app)
+        await contexto.__aenter__()
+        cliente = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=backend.app), base_url="http://bench", timeout=args.timeout
+        )
+
+    resultados = {}
+    try:
+        async with cliente:
+            for escenario in args.scenarios:
+                for c in args.concurrency:
+                    r = await correr_escenario(cliente, escenario, args.requests, c, imagenes, args.unique, args.warmup)
+                    resultados[f"{escenario}@c{c}"] = r
+                    lat = r["latency_ms"]
+                    print(f"   {escenario:<9} c={c:<4} {r['throughput_rps']:8.1f} req/s   "
+                          f"p50 {lat.get('p50', 0):7.1f}  p95 {lat.get('p95', 0):7.1f}  p99 {lat.get('p99', 0):7.1f} ms"
+                          f"   errores {r['errors']}")
+    finally:
+        if contexto is not None:
+            await contexto.__aexit__(None, None, None)
+    return resultados
+
+
+def rss_maximo_mb():
+    """RSS máximo de este proceso y de sus hijos ya terminados (ru_maxrss está en KB en Linux)"""
+    escala = 1 / 1024 if sys.platform != "darwin" else 1 / (1024 * 1024)
+    propio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * escala
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * escala
+    return {"self": round(propio, 1), "children": round(hijos, 1)}
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def comparar(actual, anterior_path):
+    with open(anterior_path, encoding="utf-8") as f:
+        anterior = json.load(f)
+    print(f"\n📈 Comparación con {anterior_path} (commit {anterior.get('commit')})")
+    for clave, r in actual["results"].items():
+        previo = anterior.get("results", {}).get(clave)
+        if not previo:
+            continue
+        d_rps = (r["throughput_rps"] / previo["throughput_rps"] - 1) * 100 if previo["throughput_rps"] else 0
+        p95, p95_previo = r["latency_ms"].get("p95", 0), previo["latency_ms"].get("p95", 0)
+        d_p95 = (p95 / p95_previo - 1) * 100 if p95_previo else 0
+        print(f"   {clave:<16} throughput {d_rps:+6.1f}%   p95 {d_p95:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=ESCENARIOS, default=list(ESCENARIOS))
+    parser.add_argument("--requests", type=int, default=100, help="peticiones por escenario y concurrencia")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="latencia de la base simulada")
+    parser.add_argument("--unique", action=argparse.BooleanOptionalAction, default=True,
+                        help="cambiar los bytes de cada subida para evitar la caché (por defecto sí)")
+    parser.add_argument("--url", help="medir un servidor ya arrancado en lugar de la app en proceso")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="guardar los resultados en este JSON")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    commit = commit_actual()
+    # Resolver las rutas del usuario antes de cambiar de directorio
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    if not args.url:
+        # Almacén, diario y miniaturas en un directorio temporal, no en uploads/ real
+        os.chdir(tempfile.mkdtemp(prefix="dentiscan-load-"))
+
+    imagenes = generar_imagenes()
+    tamanos = ", ".join(f"{len(b) // 1024} KB" for b in imagenes)
+    destino = args.url or "app en proceso"
+    print(f"📊 {destino}: {args.requests} peticiones por escenario, imágenes de {tamanos}")
+    resultados = asyncio.run(ejecutar(args, imagenes))
+
+    informe = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "target": destino,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "db_latency_ms": None if args.url else args.db_latency_ms,
+            "unique": args.unique,
+            "image_sizes": [list(t) for t in TAMANOS_IMAGEN],
+            "inference_workers": os.getenv("INFERENCE_WORKERS"),
+        },
+        "peak_rss_mb": rss_maximo_mb(),
+        "results": resultados,
+    }
+    print(f"   RSS máximo: {informe['peak_rss_mb']['self']} MB (hijos terminados: {informe['peak_rss_mb']['children']} MB)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {args.output}")
+    if args.compare:
+        comparar(informe, args.compare)
+
+
+if __name__ == "__main__":
+    main()
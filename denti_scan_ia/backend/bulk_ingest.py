@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Importa un directorio de imágenes dentales históricas (p. ej. al dar de alta
+una clínica) al almacén de imágenes y a la colección 'imagenes'.
+
+Cada archivo se hashea, se copia al almacén por contenido, se decodifica una
+vez y se le genera la miniatura, todo en un pool de procesos. Los documentos
+se insertan en MongoDB con insert_many por lotes.
+
+El progreso se guarda en un checkpoint SQLite: si se interrumpe, volver a
+lanzar el mismo comando continúa donde quedó. Los workers dejan cada imagen en
+un temporal del almacén; el proceso principal anota el lote en el checkpoint
+(con sus _id y temporales) y solo entonces hace el commit al almacén, así que
+reenviarlo tras un corte no duplica documentos ni referencias.
+
+Los nombres con el formato que usaba la API (nombre_AAAAMMDD_HHMMSS_archivo)
+se separan en paciente, fecha y nombre original.
+
+Uso:
+    python bulk_ingest.py uploads/ --workers 4 --batch-size 200
+    python bulk_ingest.py /mnt/clinica --email clinica@example.com
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import bson
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from database_config import (
+    MONGO_DB_NAME, MONGO_URI, SCANS_COLLECTION, ScanRecord, ensure_indexes, get_client, stamp_ingested
+)
+from image_store import IMAGE_STORE_DIR, ImageStore
+from image_preprocessing import THUMBNAIL_SIZE, open_normalized
+from perceptual_hash import hashes_from_image, to_fields
+from thumbnails import ThumbnailCache, pick_width
+from upload_stream import sniff_mime
+
+EXTENSIONES = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+# Directorios que gestiona el propio almacén cuando se importa desde uploads/
+DIRECTORIOS_IGNORADOS = {"tmp", "thumbs", "compact"}
+NOMBRE_API = re.compile(r"^(?P<nombre>.+?)_(?P<fecha>\d{8}_\d{6})_(?P<archivo>.+)$")
+DUPLICATE_KEY = 11000
+CHECKPOINT_PATH = "bulk_ingest_checkpoint.sqlite3"
+# Prefijo de los temporales de esta herramienta en uploads/tmp (los de la API no lo llevan)
+TEMP_PREFIX = "bulk-"
+
+
+class Checkpoint:
+    """Estado de cada archivo: pending (en un lote sin confirmar), done o error"""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                   path TEXT PRIMARY KEY,
+                   size INTEGER,
+                   mtime_ns INTEGER,
+                   state TEXT NOT NULL,
+                   doc_id TEXT,
+                   payload BLOB,
+                   error TEXT
+               )"""
+        )
+        columnas = {fila[1] for fila in self.conn.execute("PRAGMA table_info(files)")}
+        if "tmp_path" not in columnas:
+            # Checkpoints creados antes de que el commit al almacén pasara al proceso principal
+            self.conn.execute("ALTER TABLE files ADD COLUMN tmp_path TEXT")
+
+    def pendientes(self):
+        """(ruta, documento, temporal) de un lote que quedó sin confirmar en la ejecución anterior"""
+        rows = self.conn.execute("SELECT path, payload, tmp_path FROM files WHERE state = 'pending'").fetchall()
+        return [(path, bson.decode(payload), tmp_path) for path, payload, tmp_path in rows]
+
+    def ya_importado(self, path, size, mtime_ns):
+        row = self.conn.execute("SELECT size, mtime_ns, state FROM files WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[2] != "error" and row[0] == size and row[1] == mtime_ns
+
+    def anotar_lote(self, lote):
+        with self.conn:
+            self.conn.executemany(
+                """INSERT OR REPLACE INTO files (path, size, mtime_ns, state, doc_id, payload, tmp_path)
+                   VALUES (?, ?, ?, 'pending', ?, ?, ?)""",
+                [(r["path"], r["size"], r["mtime_ns"], str(doc["_id"]), bson.encode(doc), r["tmp_path"])
+                 for r, doc in lote],
+            )
+
+    def confirmar(self, paths):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE files SET state = 'done', payload = NULL, tmp_path = NULL WHERE path = ?",
+                [(p,) for p in paths],
+            )
+
+    def anotar_error(self, r):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, state, error) VALUES (?, ?, ?, 'error', ?)",
+                (r["path"], r["size"], r["mtime_ns"], r["error"]),
+            )
+
+
+def recorrer(raiz):
+    """Archivos de imagen bajo raiz, en orden estable"""
+    for actual, dirs, archivos in os.walk(raiz):
+        dirs[:] = sorted(d for d in dirs if d not in DIRECTORIOS_IGNORADOS)
+        for nombre in sorted(archivos):
+            if nombre.lower().endswith(EXTENSIONES):
+                yield os.path.join(actual, nombre)
+
+
+# Estado de cada proceso del pool
+_store = None
+_thumbs = None
+_thumb_width = None
+
+
+def _init_worker(store_root):
+    global _store, _thumbs, _thumb_width
+    _store = ImageStore(store_root)
+    _thumbs = ThumbnailCache(_store)
+    _thumb_width = pick_width(THUMBNAIL_SIZE)
+
+
+def _procesar(args):
+    """
+    Hash + copia a un temporal del almacén + una decodificación + miniatura y
+    hash perceptual de un archivo. El commit (la referencia en el almacén) lo
+    hace el proceso principal después de anotar el lote en el checkpoint.
+    """
+    path, size, mtime_ns = args
+    r = {"path": path, "size": size, "mtime_ns": mtime_ns}
+    tmp_path = None
+    try:
+        with open(path, "rb") as f:
+            mime_type = sniff_mime(f.read(64))
+        if mime_type is None:
+            raise ValueError("no es una imagen reconocida")
+        # Decodificar antes de copiar: un archivo corrupto no entra al almacén
+        im, original_size, _ = open_normalized(path, min_size=(_thumb_width, _thumb_width))
+        tmp_path, sha256, copiados = _store.stage_file(path, TEMP_PREFIX)
+        if not os.path.exists(_thumbs.path(sha256, _thumb_width)):
+            _thumbs.generate(sha256, _thumb_width, im)
+        r.update(sha256=sha256, tmp_path=tmp_path, blob_path=_store.blob_path(sha256), mime_type=mime_type,
+                 bytes=copiados, width=original_size[0], height=original_size[1],
+                 **to_fields(*hashes_from_image(im)))
+    except Exception as e:
+        r["error"] = f"{type(e).__name__}: {e}"
+        if tmp_path is not None:
+            _store.discard_temp(tmp_path)
+    return r
+
+
+def guardar_blob(store, documento, tmp_path):
+    """
+    Commit al almacén del temporal de un documento ya anotado en el checkpoint.
+    Si el temporal ya no existe, el commit se hizo antes de un corte y no se repite.
+    """
+    if tmp_path and os.path.exists(tmp_path):
+        blob = store.commit(tmp_path, documento["content_hash"], documento["size_bytes"], documento["mime_type"])
+        documento["file_path"] = blob.path
+
+
+def limpiar_temporales(store, checkpoint):
+    """Borrar temporales de una ejecución interrumpida que no llegaron a anotarse en el checkpoint"""
+    anotados = {tmp for _, _, tmp in checkpoint.pendientes()}
+    borrados = 0
+    for nombre in os.listdir(store.tmp_dir):
+        ruta = os.path.join(store.tmp_dir, nombre)
+        if nombre.startswith(TEMP_PREFIX) and ruta not in anotados:
+            store.discard_temp(ruta)
+            borrados += 1
+    return borrados
+
+
+def documento_para(r, email=None):
+    """ScanRecord a partir del nombre del archivo y el resultado del worker"""
+    nombre_archivo = os.path.basename(r["path"])
+    paciente, fecha = os.path.splitext(nombre_archivo)[0], None
+    m = NOMBRE_API.match(nombre_archivo)
+    if m:
+        paciente, nombre_archivo = m["nombre"], m["archivo"]
+        fecha = datetime.strptime(m["fecha"], "%Y%m%d_%H%M%S").replace(tzinfo=timezone.utc)
+    record = ScanRecord(
+        name=paciente.replace("_", " "),
+        email=email,
+        image_filename=nombre_archivo,
+        file_path=r["blob_path"],
+        content_hash=r["sha256"],
+        mime_type=r["mime_type"],
+        size_bytes=r["bytes"],
+        phash=r.get("phash"),
+        dhash=r.get("dhash"),
+        status="imported",
+        source="bulk_ingest",
+        upload_date=fecha or datetime.fromtimestamp(r["mtime_ns"] / 1e9, timezone.utc),
+    )
+    documento = record.to_document()
+    documento["_id"] = ObjectId()
+    return documento
+
+
+def insertar_lote(coleccion, documentos):
+    """insert_many idempotente: los _id ya insertados en un intento anterior se ignoran"""
+    if not documentos:
+        return 0
+    try:
+        return len(coleccion.insert_many(stamp_ingested(documentos), ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errores = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+        if errores:
+            raise
+        return e.details.get("nInserted", 0)
+
+
+def ingestar(raiz, coleccion, store_root=IMAGE_STORE_DIR, workers=None, batch_size=200,
+             checkpoint_path=CHECKPOINT_PATH, email=None):
+    checkpoint = Checkpoint(checkpoint_path)
+    store = ImageStore(store_root)
+    stats = {"importados": 0, "omitidos": 0, "errores": 0, "bytes": 0}
+
+    # Primero el lote que quedó a medias en la ejecución anterior
+    pendientes = checkpoint.pendientes()
+    if pendientes:
+        for _, doc, tmp_path in pendientes:
+            guardar_blob(store, doc, tmp_path)
+        insertar_lote(coleccion, [doc for _, doc, _ in pendientes])
+        checkpoint.confirmar([path for path, _, _ in pendientes])
+        stats["importados"] += len(pendientes)
+        print(f"🔄 {len(pendientes)} documentos del lote interrumpido reenviados")
+    descartados = limpiar_temporales(store, checkpoint)
+    if descartados:
+        print(f"🧹 {descartados} temporales de la ejecución interrumpida descartados")
+
+    tareas = []
+    for path in recorrer(raiz):
+        st = os.stat(path)
+        if checkpoint.ya_importado(path, st.st_size, st.st_mtime_ns):
+            stats["omitidos"] += 1
+        else:
+            tareas.append((path, st.st_size, st.st_mtime_ns))
+    print(f"🔍 {len(tareas)} imágenes por importar ({stats['omitidos']} ya importadas)")
+    if not tareas:
+        return stats
+
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    inicio = time.perf_counter()
+    lote = []
+    ronda = {"importados": 0, "errores": 0}
+
+    def enviar():
+        # Anotar antes del commit: tras un corte, el temporal que falte indica que su commit ya se hizo
+        checkpoint.anotar_lote(lote)
+        for r, doc in lote:
+            guardar_blob(store, doc, r["tmp_path"])
+        insertar_lote(coleccion, [doc for _, doc in lote])
+        checkpoint.confirmar([r["path"] for r, _ in lote])
+        stats["importados"] += len(lote)
+        ronda["importados"] += len(lote)
+        lote.clear()
+        transcurrido = max(time.perf_counter() - inicio, 1e-6)
+        hechos = ronda["importados"] + ronda["errores"]
+        print(f"   {hechos}/{len(tareas)}  {ronda['importados'] / transcurrido:.1f} img/s  "
+              f"{stats['bytes'] / transcurrido / 1e6:.1f} MB/s")
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(store_root,),
+    ) as pool:
+        for r in pool.map(_procesar, tareas, chunksize=max(1, min(32, len(tareas) // (workers * 4)))):
+            if "error" in r:
+                stats["errores"] += 1
+                ronda["errores"] += 1
+                checkpoint.anotar_error(r)
+                print(f"⚠️ {r['path']}: {r['error']}")
+                continue
+            stats["bytes"] += r["bytes"]
+            lote.append((r, documento_para(r, email)))
+            if len(lote) >= batch_size:
+                enviar()
+        if lote:
+            enviar()
+
+    transcurrido = time.perf_counter() - inicio
+    print(f"✅ {ronda['importados']} importadas, {ronda['errores']} con error, {stats['omitidos']} omitidas "
+          f"en {transcurrido:.1f}s ({ronda['importados'] / max(transcurrido, 1e-6):.1f} img/s)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directorio", help="raíz del árbol de imágenes a importar")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=MONGO_DB_NAME)
+    parser.add_argument("--collection", default=SCANS_COLLECTION)
+    parser.add_argument("--store", default=IMAGE_STORE_DIR, help="raíz del almacén de imágenes")
+    parser.add_argument("--workers", type=int, default=None, help="procesos (por defecto CPUs - 1)")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--email", default=None, help="email a asignar a todos los escaneos")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    try:
+        coleccion = client[args.db][args.collection]
+        ensure_indexes(coleccion)
+        ingestar(args.directorio, coleccion, args.store, args.workers, args.batch_size, args.checkpoint, args.email)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
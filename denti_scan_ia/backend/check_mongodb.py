@@ -1,21 +1,65 @@
 #!/usr/bin/env python3
 """
-Script para verificar el estado de MongoDB
+Script para verificar el estado de MongoDB y diagnosticar su rendimiento
+
+Además de comprobar la instalación y la conexión, mide:
+- latencia de ping (percentiles p50/p95/p99)
+- rendimiento de escritura y lectura en una colección temporal que se borra al terminar
+- los planes de las consultas que hace la API (explain), avisando de COLLSCAN y SORT en memoria
+- tamaño de la colección y de sus documentos, avisando de imágenes embebidas (base64 o Binary)
+- uso del pool de conexiones del cliente y del servidor
+
+Con --json el informe sale en JSON por stdout (los mensajes van a stderr) y
+con --history se añade como una línea a un archivo JSONL, para comparar
+ejecuciones a lo largo del tiempo. Termina con código 1 si no hay conexión,
+si alguna sección falla o si hay avisos.
+
+Uso:
+    python check_mongodb.py
+    python check_mongodb.py --json --history diagnostico.jsonl
+    python check_mongodb.py --skip-bench --sample 5000
 """
 
+import argparse
+import contextlib
+import json
+import os
+import re
+import statistics
 import subprocess
 import sys
-import os
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError, ServerSelectionTimeoutError
+from pymongo.monitoring import ConnectionPoolListener
+
+from database_config import (
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_DB_NAME, MONGO_MAX_IDLE_TIME_MS, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+    MONGO_SOCKET_TIMEOUT_MS, MONGO_URI, MONGO_WAIT_QUEUE_TIMEOUT_MS, SCAN_INDEXES, SCAN_LIST_PROJECTION,
+    SCANS_COLLECTION, ScanRecord
+)
+
+# Un documento de escaneo sin imagen ocupa ~1 KB: por encima de esto lleva la imagen dentro
+OVERSIZED_DOC_KB = int(os.getenv("OVERSIZED_DOC_KB", "64"))
+PING_P99_WARN_MS = float(os.getenv("PING_P99_WARN_MS", "20"))
+POOL_WAIT_WARN_MS = float(os.getenv("POOL_WAIT_WARN_MS", "5"))
+# Por debajo de este número de documentos un COLLSCAN no es un problema todavía
+COLLSCAN_MIN_DOCS = int(os.getenv("COLLSCAN_MIN_DOCS", "1000"))
 
 def check_mongodb_installation():
     """Verificar si MongoDB está instalado"""
     print("🔍 Verificando instalación de MongoDB...")
-    
+
     # Verificar si mongod está en el PATH
     try:
-        result = subprocess.run(['mongod', '--version'], 
+        result = subprocess.run(['mongod', '--version'],
                               capture_output=True, text=True, timeout=10)
         if result.returncode == 0:
             print("✅ MongoDB está instalado")
@@ -34,11 +78,11 @@ def check_mongodb_installation():
 def check_mongodb_service():
     """Verificar si el servicio de MongoDB está ejecutándose"""
     print("\n🔍 Verificando si MongoDB está ejecutándose...")
-    
+
     # En Windows, verificar el servicio
     if os.name == 'nt':  # Windows
         try:
-            result = subprocess.run(['sc', 'query', 'MongoDB'], 
+            result = subprocess.run(['sc', 'query', 'MongoDB'],
                                   capture_output=True, text=True, timeout=10)
             if 'RUNNING' in result.stdout:
                 print("✅ Servicio de MongoDB está ejecutándose")
@@ -54,7 +98,7 @@ def check_mongodb_service():
             return False
     else:  # Linux/Mac
         try:
-            result = subprocess.run(['systemctl', 'is-active', 'mongod'], 
+            result = subprocess.run(['systemctl', 'is-active', 'mongod'],
                                   capture_output=True, text=True, timeout=10)
             if result.stdout.strip() == 'active':
                 print("✅ Servicio de MongoDB está ejecutándose")
@@ -68,21 +112,19 @@ def check_mongodb_service():
             print("⚠️ No se pudo verificar el servicio de MongoDB")
             return False
 
-def check_mongodb_connection():
+def check_mongodb_connection(client, db_name=MONGO_DB_NAME):
     """Verificar conexión a MongoDB"""
     print("\n🔍 Verificando conexión a MongoDB...")
-    
+
     try:
-        client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
         client.admin.command('ping')
         print("✅ Conexión exitosa a MongoDB")
-        
+
         # Listar bases de datos
         databases = client.list_database_names()
         print(f"   Bases de datos disponibles: {databases}")
-        
+
         # Verificar si existe nuestra base de datos
-        db_name = "DentiScan-AI--Proyect"
         if db_name in databases:
             print(f"✅ Base de datos '{db_name}' existe")
             db = client[db_name]
@@ -90,10 +132,9 @@ def check_mongodb_connection():
             print(f"   Colecciones: {collections}")
         else:
             print(f"⚠️ Base de datos '{db_name}' no existe (se creará automáticamente)")
-        
-        client.close()
+
         return True
-        
+
     except (ConnectionFailure, ServerSelectionTimeoutError) as e:
         print(f"❌ No se pudo conectar a MongoDB: {e}")
         return False
@@ -101,39 +142,446 @@ def check_mongodb_connection():
         print(f"❌ Error inesperado: {e}")
         return False
 
+def percentiles(valores_ms):
+    """p50/p95/p99/max/media de una lista de tiempos en ms"""
+    if not valores_ms:
+        return {}
+    orden = sorted(valores_ms)
+
+    def p(q):
+        return round(orden[min(len(orden) - 1, int(q * len(orden)))], 3)
+
+    return {"n": len(orden), "p50": p(0.50), "p95": p(0.95), "p99": p(0.99),
+            "max": round(orden[-1], 3), "mean": round(statistics.fmean(orden), 3)}
+
+def tiene_errores(valor):
+    """True si alguna sección (o subsección) del informe terminó con {"error": ...}"""
+    if isinstance(valor, dict):
+        return "error" in valor or any(tiene_errores(v) for v in valor.values())
+    if isinstance(valor, list):
+        return any(tiene_errores(v) for v in valor)
+    return False
+
+def cronometrar(funcion, n):
+    """Ejecutar funcion(i) n veces; (tiempos en ms, segundos totales)"""
+    tiempos = []
+    inicio = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        funcion(i)
+        tiempos.append((time.perf_counter() - t) * 1000)
+    return tiempos, time.perf_counter() - inicio
+
+class PoolMonitor(ConnectionPoolListener):
+    """Conexiones en uso y espera para obtener una del pool, desde los eventos de pymongo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.in_use = 0
+            self.max_in_use = 0
+            self.created = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.waits_ms = []
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            # duration existe desde pymongo 4.7
+            duracion = getattr(event, "duration", None)
+            if duracion is not None:
+                self.waits_ms.append(duracion * 1000)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "max_in_use": self.max_in_use,
+                "connections_created": self.created,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checkout_wait_ms": percentiles(self.waits_ms),
+            }
+
+class Diagnostico:
+    def __init__(self, client, db_name, collection, monitor):
+        self.client = client
+        self.db = client[db_name]
+        self.coleccion = self.db[collection]
+        self.monitor = monitor
+        self.warnings = []
+
+    def avisar(self, code, message):
+        self.warnings.append({"code": code, "message": message})
+        print(f"   ⚠️ {message}")
+
+    def ping(self, n):
+        print(f"\n🔍 Latencia de ping ({n} veces)...")
+        tiempos, _ = cronometrar(lambda i: self.client.admin.command("ping"), n)
+        resultado = percentiles(tiempos)
+        print(f"   p50 {resultado['p50']} ms  p95 {resultado['p95']} ms  p99 {resultado['p99']} ms  máx {resultado['max']} ms")
+        if resultado["p99"] > PING_P99_WARN_MS:
+            self.avisar("ping_slow", f"p99 de ping {resultado['p99']} ms (> {PING_P99_WARN_MS} ms): red o servidor cargado")
+        return resultado
+
+    def rendimiento(self, n, batch, concurrency):
+        """Escrituras y lecturas con documentos como los de la API, en una colección temporal"""
+        nombre = f"diagnostico_{uuid.uuid4().hex[:8]}"
+        print(f"\n🔍 Rendimiento en la colección temporal '{nombre}' ({n} operaciones)...")
+        scratch = self.db[nombre]
+
+        def documento(i):
+            registro = ScanRecord(
+                name=f"Paciente {i}", email=f"paciente{i % 50}@diagnostico.local", birth_date="1990-01-01",
+                image_filename=f"foto_{i}.jpg", content_hash=uuid.uuid4().hex * 2, mime_type="image/jpeg",
+                size_bytes=2_500_000, status="processed", diagnosis="Sano", confidence=0.93,
+                recommendations=["Cepillado dos veces al día", "Uso de hilo dental", "Control en 6 meses"],
+                model_version="diagnostico", source="check_mongodb",
+            )
+            return registro.to_document()
+
+        resultado = {}
+        try:
+            tiempos, total = cronometrar(lambda i: scratch.insert_one(documento(i)), n)
+            resultado["insert_one"] = {"ops_per_s": round(n / total, 1), "latency_ms": percentiles(tiempos)}
+
+            lotes = max(1, n * 5 // batch)
+            tiempos, total = cronometrar(lambda i: scratch.insert_many([documento(i * batch + j) for j in range(batch)]), lotes)
+            resultado["insert_many"] = {"batch": batch, "docs_per_s": round(lotes * batch / total, 1),
+                                        "latency_ms": percentiles(tiempos)}
+
+            ids = [d["_id"] for d in scratch.find({}, {"_id": 1}).limit(n)]
+            tiempos, total = cronometrar(lambda i: scratch.find_one({"_id": ids[i % len(ids)]}), n)
+            resultado["find_by_id"] = {"ops_per_s": round(n / total, 1), "latency_ms": percentiles(tiempos)}
+
+            scratch.create_index([("email", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)])
+            tiempos, total = cronometrar(
+                lambda i: list(scratch.find({"email": f"paciente{i % 50}@diagnostico.local"}, SCAN_LIST_PROJECTION)
+                               .sort([("upload_date", DESCENDING), ("_id", DESCENDING)]).limit(50)),
+                n,
+            )
+            resultado["list_by_email"] = {"ops_per_s": round(n / total, 1), "latency_ms": percentiles(tiempos)}
+
+            # Lecturas concurrentes: cuántas conexiones abre el pool y cuánto se espera por una
+            def leer(i):
+                t = time.perf_counter()
+                scratch.find_one({"_id": ids[i % len(ids)]})
+                return (time.perf_counter() - t) * 1000
+
+            self.monitor.reset()
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                tiempos = list(pool.map(leer, range(n * 2)))
+            total = time.perf_counter() - inicio
+            resultado["concurrent_find"] = {"concurrency": concurrency, "ops_per_s": round(n * 2 / total, 1),
+                                            "latency_ms": percentiles(tiempos), "pool": self.monitor.snapshot()}
+        finally:
+            scratch.drop()
+
+        for operacion, datos in resultado.items():
+            tasa = datos.get("ops_per_s") or datos.get("docs_per_s")
+            unidad = "docs/s" if "docs_per_s" in datos else "ops/s"
+            print(f"   {operacion:16} {tasa:>10} {unidad}  p50 {datos['latency_ms']['p50']} ms  p99 {datos['latency_ms']['p99']} ms")
+        espera = resultado["concurrent_find"]["pool"]["checkout_wait_ms"]
+        if espera and espera["p99"] > POOL_WAIT_WARN_MS:
+            self.avisar("pool_wait", f"p99 de espera por una conexión {espera['p99']} ms con {concurrency} hilos: "
+                                     f"subir MONGO_MAX_POOL_SIZE ({MONGO_MAX_POOL_SIZE})")
+        return resultado
+
+    def _ejemplos(self):
+        """Valores reales para las consultas de explain (o inventados si la colección está vacía)"""
+        muestra = self.coleccion.find_one(
+            {"email": {"$exists": True}}, {"email": 1, "content_hash": 1, "image_filename": 1}
+        ) or {}
+        return {
+            "email": muestra.get("email", "paciente@diagnostico.local"),
+            "content_hash": muestra.get("content_hash", "0" * 64),
+            "image_filename": muestra.get("image_filename", "foto.jpg"),
+            "_id": muestra.get("_id", ObjectId()),
+        }
+
+    def patrones(self):
+        """(nombre, filtro, orden, límite) de las consultas que hace la API, en el orden de main.py"""
+        e = self._ejemplos()
+        por_fecha = [("upload_date", DESCENDING), ("_id", DESCENDING)]
+        fechas = {"$type": "date"}
+        return [
+            ("GET /scans", {"upload_date": fechas}, por_fecha, 51),
+            ("GET /patients/{email}/scans", {"upload_date": fechas, "email": e["email"]}, por_fecha, 51),
+            ("GET /scans?status=", {"upload_date": fechas, "status": "processed"}, por_fecha, 51),
+            ("find_scans_by_email", {"email": e["email"]}, por_fecha, 50),
+            ("find_scan_by_hash", {"content_hash": e["content_hash"]}, [("upload_date", DESCENDING)], 1),
+            ("find_scan_by_filename", {"image_filename": e["image_filename"]}, [("upload_date", DESCENDING)], 1),
+            ("escaneos similares (por _id)", {"_id": {"$in": [e["_id"]]}}, None, 0),
+            ("carga del índice de similitud", {"phash": {"$exists": True}}, [("_id", ASCENDING)], 2000),
+            ("exportación incremental",
+             {"ingested_at": {"$gt": datetime.now(timezone.utc) - timedelta(days=1)}}, None, 0),
+        ]
+
+    def indices(self):
+        print("\n🔍 Índices y planes de las consultas de la API...")
+        existentes = self.coleccion.index_information()
+        faltan = [modelo.document["name"] for modelo in SCAN_INDEXES if modelo.document["name"] not in existentes]
+        if faltan:
+            self.avisar("missing_index", f"Faltan índices de database_config.SCAN_INDEXES: {', '.join(faltan)} "
+                                         f"(la API los crea al conectar)")
+        total = self.coleccion.estimated_document_count()
+
+        planes = []
+        for nombre, filtro, orden, limite in self.patrones():
+            cursor = self.coleccion.find(filtro, SCAN_LIST_PROJECTION)
+            if orden:
+                cursor = cursor.sort(orden)
+            if limite:
+                cursor = cursor.limit(limite)
+            try:
+                plan = resumir_plan(cursor.explain())
+            except (OperationFailure, NotImplementedError, AttributeError) as e:
+                planes.append({"query": nombre, "error": str(e)})
+                continue
+            plan["query"] = nombre
+            planes.append(plan)
+            indice = plan["index"] or "ninguno"
+            print(f"   {nombre:32} {'/'.join(plan['stages']):28} índice={indice}  "
+                  f"docs={plan['docs_examined']} claves={plan['keys_examined']} devueltos={plan['returned']}")
+            if "COLLSCAN" in plan["stages"] and total >= COLLSCAN_MIN_DOCS:
+                self.avisar("collscan", f"'{nombre}' recorre la colección entera ({total} documentos)")
+            if "SORT" in plan["stages"]:
+                self.avisar("in_memory_sort", f"'{nombre}' ordena en memoria: ningún índice cubre el orden")
+        return {"existing": sorted(existentes), "missing": faltan, "plans": planes}
+
+    def tamanos(self, sample):
+        print("\n🔍 Tamaño de la colección y de sus documentos...")
+        try:
+            stats = next(self.coleccion.aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+        except (OperationFailure, StopIteration):
+            stats = self.db.command("collStats", self.coleccion.name)
+        resultado = {
+            "count": stats.get("count", 0),
+            "size_mb": round(stats.get("size", 0) / 1e6, 2),
+            "avg_doc_bytes": round(stats.get("avgObjSize", 0)),
+            "storage_mb": round(stats.get("storageSize", 0) / 1e6, 2),
+            "index_mb": round(stats.get("totalIndexSize", 0) / 1e6, 2),
+            "index_sizes_mb": {k: round(v / 1e6, 2) for k, v in stats.get("indexSizes", {}).items()},
+        }
+        print(f"   {resultado['count']} documentos, {resultado['size_mb']} MB de datos "
+              f"(media {resultado['avg_doc_bytes']} B), {resultado['index_mb']} MB de índices")
+
+        # Muestra aleatoria: medir todos los documentos leería la colección entera
+        muestra = []
+        if resultado["count"]:
+            muestra = list(self.coleccion.aggregate([
+                {"$sample": {"size": sample}},
+                {"$project": {
+                    "_id": 0,
+                    "bytes": {"$bsonSize": "$$ROOT"},
+                    "base64": {"$eq": [{"$type": "$imagen"}, "string"]},
+                    "binary": {"$eq": [{"$type": "$imagen_bin"}, "binData"]},
+                }},
+            ]))
+        if muestra:
+            tamanos = [m["bytes"] for m in muestra]
+            grandes = [m for m in muestra if m["bytes"] >= OVERSIZED_DOC_KB * 1024]
+            resultado["sample"] = {
+                "size": len(muestra),
+                "doc_kb": percentiles([t / 1024 for t in tamanos]),
+                "oversized_fraction": round(len(grandes) / len(muestra), 4),
+                "base64_fraction": round(sum(m["base64"] for m in muestra) / len(muestra), 4),
+                "inline_binary_fraction": round(sum(m["binary"] for m in muestra) / len(muestra), 4),
+            }
+            print(f"   Muestra de {len(muestra)}: p50 {resultado['sample']['doc_kb']['p50']} KB, "
+                  f"máx {resultado['sample']['doc_kb']['max']} KB, {len(grandes)} de más de {OVERSIZED_DOC_KB} KB")
+            if resultado["sample"]["base64_fraction"]:
+                estimados = round(resultado["sample"]["base64_fraction"] * resultado["count"])
+                self.avisar("base64_images", f"~{estimados} documentos con la imagen en base64: "
+                                             f"ejecutar migrate_base64_images.py")
+            elif grandes:
+                self.avisar("oversized_documents", f"{resultado['sample']['oversized_fraction']:.1%} de la muestra "
+                                                   f"pesa más de {OVERSIZED_DOC_KB} KB: cada lectura trae la imagen")
+        return resultado
+
+    def pool(self):
+        print("\n🔍 Pool de conexiones...")
+        resultado = {
+            "client": {
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+                "min_pool_size": MONGO_MIN_POOL_SIZE,
+                "wait_queue_timeout_ms": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                **self.monitor.snapshot(),
+            },
+        }
+        try:
+            conexiones = self.client.admin.command("serverStatus").get("connections", {})
+            resultado["server"] = {k: conexiones.get(k) for k in ("current", "available", "active", "totalCreated")}
+            print(f"   Servidor: {conexiones.get('current')} conexiones abiertas, "
+                  f"{conexiones.get('available')} disponibles, {conexiones.get('active')} activas")
+            if conexiones.get("available") is not None and conexiones["available"] < MONGO_MAX_POOL_SIZE:
+                self.avisar("server_connections", f"El servidor solo admite {conexiones['available']} conexiones más: "
+                                                  f"menos que MONGO_MAX_POOL_SIZE de un solo proceso")
+        except OperationFailure as e:
+            resultado["server"] = {"error": str(e)}
+        print(f"   Cliente: pool máx {MONGO_MAX_POOL_SIZE}, hasta {resultado['client']['max_in_use']} en uso, "
+              f"{resultado['client']['connections_created']} conexiones creadas")
+        return resultado
+
+def _etapas(plan):
+    """Recorrer el árbol de un plan: (etapas, índices)"""
+    etapas, indices = [], []
+    pendientes = [plan]
+    while pendientes:
+        nodo = pendientes.pop()
+        if "queryPlan" in nodo:
+            # Motor SBE (MongoDB 7+): el plan clásico va en queryPlan
+            nodo = nodo["queryPlan"]
+        etapas.append(nodo.get("stage", "?"))
+        if nodo.get("indexName"):
+            indices.append(nodo["indexName"])
+        pendientes.extend(nodo.get("inputStages", []))
+        if "inputStage" in nodo:
+            pendientes.append(nodo["inputStage"])
+    return etapas, indices
+
+def resumir_plan(explain):
+    etapas, indices = _etapas(explain["queryPlanner"]["winningPlan"])
+    ejecucion = explain.get("executionStats", {})
+    return {
+        "stages": etapas,
+        "index": indices[0] if indices else None,
+        "docs_examined": ejecucion.get("totalDocsExamined"),
+        "keys_examined": ejecucion.get("totalKeysExamined"),
+        "returned": ejecucion.get("nReturned"),
+        "time_ms": ejecucion.get("executionTimeMillis"),
+    }
+
+def uri_sin_credenciales(uri):
+    return re.sub(r"//[^@/]*@", "//***@", uri)
+
+def es_local(uri):
+    host = urlparse(uri).hostname or ""
+    return host in ("localhost", "127.0.0.1", "::1")
+
 def main():
-    print("=" * 50)
-    print("DIAGNÓSTICO DE MONGODB")
-    print("=" * 50)
-    
-    # Verificar instalación
-    installed = check_mongodb_installation()
-    
-    if installed:
-        # Verificar servicio
-        running = check_mongodb_service()
-        
-        if running:
-            # Verificar conexión
-            connected = check_mongodb_connection()
-            
-            if connected:
-                print("\n🎉 MongoDB está funcionando correctamente!")
-                print("   Tu aplicación debería poder guardar datos sin problemas.")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=MONGO_DB_NAME)
+    parser.add_argument("--collection", default=SCANS_COLLECTION)
+    parser.add_argument("--pings", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=200, help="operaciones por prueba de rendimiento")
+    parser.add_argument("--batch", type=int, default=500, help="documentos por insert_many")
+    parser.add_argument("--concurrency", type=int, default=8, help="hilos de la prueba de lecturas concurrentes")
+    parser.add_argument("--sample", type=int, default=1000, help="documentos de la muestra de tamaños")
+    parser.add_argument("--skip-bench", action="store_true", help="no escribir en la colección temporal")
+    parser.add_argument("--json", action="store_true", help="informe en JSON por stdout")
+    parser.add_argument("--output", help="guardar el informe JSON en este archivo")
+    parser.add_argument("--history", help="añadir el informe como una línea a este archivo JSONL")
+    args = parser.parse_args()
+
+    # En modo JSON los mensajes van a stderr para no mezclarse con el informe
+    salida = contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext()
+    informe = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "uri": uri_sin_credenciales(args.uri),
+        "database": args.db,
+        "collection": args.collection,
+    }
+    with salida:
+        print("=" * 50)
+        print("DIAGNÓSTICO DE MONGODB")
+        print("=" * 50)
+
+        if es_local(args.uri):
+            # Con MongoDB en Docker o remoto estas comprobaciones no aplican
+            informe["local"] = {"installed": check_mongodb_installation(), "service": check_mongodb_service()}
+
+        monitor = PoolMonitor()
+        # Mismo pool que la API (database_config), con el monitor de eventos
+        client = MongoClient(
+            args.uri,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=5000,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            appname="dentiscan-diagnostico",
+            event_listeners=[monitor],
+        )
+        try:
+            informe["connected"] = check_mongodb_connection(client, args.db)
+            if not informe["connected"]:
+                print("\n⚠️ No hay conexión: verifica que MongoDB esté ejecutándose y que la URI sea correcta.")
+                print("   Para instalar MongoDB:")
+                print("   - Windows: Descarga desde https://www.mongodb.com/try/download/community")
+                print("   - Linux: sudo apt-get install mongodb-org")
+                print("   - Mac: brew install mongodb-community")
             else:
-                print("\n⚠️ MongoDB está instalado y ejecutándose, pero hay problemas de conexión.")
-                print("   Verifica que el puerto 27017 esté disponible.")
-        else:
-            print("\n⚠️ MongoDB está instalado pero no está ejecutándose.")
-            print("   Inicia el servicio de MongoDB antes de usar la aplicación.")
-    else:
-        print("\n❌ MongoDB no está instalado.")
-        print("   Para instalar MongoDB:")
-        print("   - Windows: Descarga desde https://www.mongodb.com/try/download/community")
-        print("   - Linux: sudo apt-get install mongodb-org")
-        print("   - Mac: brew install mongodb-community")
-    
-    print("\n" + "=" * 50)
+                informe["server"] = {"version": client.server_info().get("version")}
+                diagnostico = Diagnostico(client, args.db, args.collection, monitor)
+                secciones = [
+                    ("ping", lambda: diagnostico.ping(args.pings)),
+                    ("throughput", None if args.skip_bench
+                     else lambda: diagnostico.rendimiento(args.ops, args.batch, args.concurrency)),
+                    ("indexes", diagnostico.indices),
+                    ("storage", lambda: diagnostico.tamanos(args.sample)),
+                    ("pool", diagnostico.pool),
+                ]
+                for nombre, funcion in secciones:
+                    if funcion is None:
+                        continue
+                    try:
+                        informe[nombre] = funcion()
+                    except PyMongoError as e:
+                        print(f"   ❌ {nombre}: {e}")
+                        informe[nombre] = {"error": str(e)}
+                informe["warnings"] = diagnostico.warnings
+
+                if diagnostico.warnings:
+                    print(f"\n⚠️ {len(diagnostico.warnings)} avisos:")
+                    for aviso in diagnostico.warnings:
+                        print(f"   - [{aviso['code']}] {aviso['message']}")
+                else:
+                    print("\n🎉 MongoDB está funcionando correctamente!")
+                    print("   Tu aplicación debería poder guardar datos sin problemas.")
+        finally:
+            client.close()
+        print("\n" + "=" * 50)
+
+    texto = json.dumps(informe, ensure_ascii=False, default=str)
+    if args.json:
+        print(json.dumps(informe, ensure_ascii=False, indent=2, default=str))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(texto + "\n")
+    if args.history:
+        with open(args.history, "a") as f:
+            f.write(texto + "\n")
+    return 0 if informe.get("connected") and not informe.get("warnings") and not tiene_errores(informe) else 1
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Compactación y niveles de almacenamiento para las imágenes antiguas.
+
+Las imágenes con más de COMPACT_AFTER_DAYS días en el almacén se recodifican
+a WebP: sin pérdida para PNG/BMP/TIFF/GIF y con calidad alta (visualmente sin
+pérdida) para JPEG. La versión nueva solo reemplaza al original si ahorra al
+menos COMPACT_MIN_SAVING; si no, se conserva el original y no se reintenta.
+El original reemplazado se borra en una pasada posterior, cuando han pasado
+COMPACT_ORIGINAL_GRACE_S segundos: una petición que ya lo había localizado
+todavía puede leerlo.
+Antes de compactar se genera la miniatura por defecto, para que las listas de
+escaneos no tengan que decodificar la versión compactada.
+
+Con STORAGE_QUOTA_MB, si el almacén supera la cuota se borran las miniaturas
+usadas hace más tiempo (se regeneran al pedirlas). Las imágenes en uso nunca
+se borran por la cuota.
+
+La nueva ubicación se anota en los documentos de 'imagenes' (file_path,
+storage_tier, stored_mime_type, stored_size_bytes). Si MongoDB no está
+disponible, queda pendiente y se anota en la siguiente pasada.
+
+La API lo ejecuta cada COMPACTION_INTERVAL_S segundos; también se puede
+lanzar a mano:
+
+Uso:
+    python compaction.py --older-than-days 30
+    python compaction.py --quota-mb 50000 --no-mongo
+    python compaction.py --dry-run
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from io import BytesIO
+
+from PIL import Image
+from pymongo import UpdateMany
+
+from database_config import MONGO_DB_NAME, MONGO_URI, SCANS_COLLECTION, get_client
+from db_health import guarded
+from image_preprocessing import THUMBNAIL_SIZE
+from image_store import IMAGE_STORE_DIR, ImageStore
+from metrics import span
+from persistence import run_disk
+from thumbnails import ThumbnailCache, pick_width
+
+logger = logging.getLogger(__name__)
+
+COMPACT_AFTER_DAYS = float(os.getenv("COMPACT_AFTER_DAYS", "30"))
+COMPACT_WEBP_QUALITY = int(os.getenv("COMPACT_WEBP_QUALITY", "90"))
+# 0 (rápido) a 6 (más lento, archivos algo menores)
+COMPACT_WEBP_METHOD = int(os.getenv("COMPACT_WEBP_METHOD", "4"))
+COMPACT_MIN_SAVING = float(os.getenv("COMPACT_MIN_SAVING", "0.10"))
+COMPACT_BATCH = int(os.getenv("COMPACT_BATCH", "200"))
+# Margen entre pasar un blob a WebP y borrar su original
+COMPACT_ORIGINAL_GRACE_S = float(os.getenv("COMPACT_ORIGINAL_GRACE_S", "600"))
+# 0 desactiva la compactación programada dentro de la API
+COMPACTION_INTERVAL_S = float(os.getenv("COMPACTION_INTERVAL_S", str(6 * 3600)))
+# 0 = sin cuota
+STORAGE_QUOTA_MB = float(os.getenv("STORAGE_QUOTA_MB", "0"))
+
+FORMATOS_SIN_PERDIDA = {"PNG", "BMP", "TIFF", "GIF"}
+# WebP no guarda 16 bits por canal ni CMYK: esas imágenes se dejan como están
+MODOS_JPEG = {"RGB", "L"}
+MODOS_SIN_PERDIDA = {"RGB", "RGBA", "L", "LA", "P"}
+
+
+def recodificar(path, quality=COMPACT_WEBP_QUALITY, method=COMPACT_WEBP_METHOD):
+    """
+    Bytes WebP de la imagen, verificados al volver a decodificarlos (píxel a
+    píxel si es sin pérdida). None si el formato o el modo de color no se
+    pueden convertir sin perder información.
+    """
+    with Image.open(path) as im:
+        if getattr(im, "n_frames", 1) > 1:
+            return None
+        if im.format == "JPEG" and im.mode in MODOS_JPEG:
+            opciones = {"quality": quality}
+        elif im.format in FORMATOS_SIN_PERDIDA and im.mode in MODOS_SIN_PERDIDA:
+            opciones = {"lossless": True, "quality": 100}
+        else:
+            return None
+        im.load()
+        # EXIF (orientación incluida) y perfil de color se conservan
+        for clave in ("exif", "icc_profile"):
+            if im.info.get(clave):
+                opciones[clave] = im.info[clave]
+        buf = BytesIO()
+        im.save(buf, format="WEBP", method=method, **opciones)
+        data = buf.getvalue()
+
+        with Image.open(BytesIO(data)) as nueva:
+            nueva.load()
+            if nueva.size != im.size:
+                raise ValueError(f"la versión WebP mide {nueva.size}, el original {im.size}")
+            if opciones.get("lossless"):
+                modo = "RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB"
+                if nueva.convert(modo).tobytes() != im.convert(modo).tobytes():
+                    raise ValueError("la versión sin pérdida no coincide con el original")
+    return data
+
+
+class StorageCompactor:
+    """Las tres tareas de la compactación, bloqueantes (la API las pasa a los pools)"""
+
+    def __init__(self, image_store, thumbs=None, older_than_days=COMPACT_AFTER_DAYS,
+                 min_saving=COMPACT_MIN_SAVING, quota_mb=STORAGE_QUOTA_MB, original_grace_s=COMPACT_ORIGINAL_GRACE_S):
+        self.image_store = image_store
+        self.thumbs = thumbs or ThumbnailCache(image_store)
+        self.older_than_days = older_than_days
+        self.min_saving = min_saving
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.original_grace_s = original_grace_s
+        self.thumb_width = pick_width(THUMBNAIL_SIZE)
+
+    def compact_one(self, sha256, size):
+        """Devuelve 'compact', 'kept' o 'gone' (el blob se liberó mientras tanto) y los bytes ahorrados"""
+        original = self.image_store.blob_path(sha256)
+        if not os.path.exists(original):
+            # Sin archivo no hay nada que compactar; no se vuelve a intentar
+            self.image_store.mark_kept(sha256)
+            return "kept", 0
+        # Miniatura caliente antes de que el original pase a WebP
+        if not os.path.exists(self.thumbs.path(sha256, self.thumb_width)):
+            self.thumbs.generate(sha256, self.thumb_width)
+
+        data = recodificar(original)
+        if data is None or len(data) > size * (1 - self.min_saving):
+            self.image_store.mark_kept(sha256)
+            return "kept", 0
+
+        destino = self.image_store.compact_path(sha256, ".webp")
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        tmp = f"{destino}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, destino)
+        if not self.image_store.replace_with_compacted(sha256, destino, "image/webp", len(data)):
+            return "gone", 0
+        return "compact", size - len(data)
+
+    def compact_once(self, limit=COMPACT_BATCH):
+        """Borrar los originales ya reemplazados y compactar hasta limit imágenes antiguas"""
+        stats = {"compacted": 0, "kept": 0, "errors": 0, "bytes_saved": 0}
+        stats["originals_removed"] = self.image_store.remove_replaced_originals(self.original_grace_s)
+        for sha256, size, _ in self.image_store.compaction_candidates(self.older_than_days, limit):
+            try:
+                resultado, ahorro = self.compact_one(sha256, size)
+            except Exception as e:
+                # Un error al decodificar o codificar no se arregla reintentando
+                logger.warning(f"⚠️ No se pudo compactar {sha256}: {e}")
+                self.image_store.mark_kept(sha256)
+                stats["errors"] += 1
+                continue
+            if resultado == "compact":
+                stats["compacted"] += 1
+                stats["bytes_saved"] += ahorro
+            elif resultado == "kept":
+                stats["kept"] += 1
+        return stats
+
+    def enforce_quota(self):
+        """Borrar miniaturas (LRU) mientras el almacén supere la cuota"""
+        stats = {"usage_bytes": 0, "thumbs_evicted": 0, "thumb_bytes_freed": 0}
+        miniaturas = self.thumbs.disk_usage()
+        imagenes = sum(nivel["bytes"] for nivel in self.image_store.usage().values())
+        stats["usage_bytes"] = imagenes + sum(size for _, size, _ in miniaturas)
+        if not self.quota_bytes or stats["usage_bytes"] <= self.quota_bytes:
+            return stats
+        borrados, liberados = self.thumbs.evict_lru(stats["usage_bytes"] - self.quota_bytes, miniaturas)
+        stats.update(usage_bytes=stats["usage_bytes"] - liberados, thumbs_evicted=borrados, thumb_bytes_freed=liberados)
+        if stats["usage_bytes"] > self.quota_bytes:
+            logger.warning(
+                f"⚠️ El almacén de imágenes ocupa {stats['usage_bytes'] / 1e6:.0f} MB, más que la cuota "
+                f"de {self.quota_bytes / 1e6:.0f} MB, aun sin miniaturas"
+            )
+        return stats
+
+    def sync_documents(self, coleccion, limit=500):
+        """Anotar en MongoDB la nueva ubicación de los blobs compactados; devuelve cuántos"""
+        pendientes = self.image_store.unsynced(limit)
+        if not pendientes:
+            return 0
+        ahora = datetime.now(timezone.utc)
+        coleccion.bulk_write(
+            [
+                UpdateMany(
+                    {"content_hash": sha256},
+                    {"$set": {
+                        "file_path": path,
+                        "storage_tier": "compact",
+                        "stored_mime_type": mime_type,
+                        "stored_size_bytes": size,
+                        "compacted_at": ahora,
+                    }},
+                )
+                for sha256, path, mime_type, size in pendientes
+            ],
+            ordered=False,
+        )
+        self.image_store.mark_synced([p[0] for p in pendientes])
+        return len(pendientes)
+
+
+class CompactionJob:
+    """
+    Ejecuta el compactador cada interval_s en los pools de E/S. get_collection
+    devuelve la colección o None si MongoDB no está disponible; la
+    actualización de documentos pasa por breaker si se indicó.
+    """
+
+    def __init__(self, compactor, get_collection=lambda: None, interval_s=COMPACTION_INTERVAL_S, breaker=None):
+        self.compactor = compactor
+        self.get_collection = get_collection
+        self.breaker = breaker
+        self.interval_s = interval_s
+        self.last_run = None
+        self.counters = {"compacted": 0, "kept": 0, "errors": 0, "bytes_saved": 0, "thumbs_evicted": 0}
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.interval_s > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # Primero se espera: la compactación no compite con el arranque
+            await asyncio.sleep(self.interval_s)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en la compactación del almacén: {e}")
+
+    async def run_once(self):
+        inicio = time.perf_counter()
+        with span("compaction"):
+            stats = await run_disk(self.compactor.compact_once)
+            stats.update(await run_disk(self.compactor.enforce_quota))
+            coleccion = self.get_collection()
+            stats["docs_synced"] = await guarded(self.breaker, self.compactor.sync_documents, coleccion) if coleccion is not None else 0
+        for clave in self.counters:
+            self.counters[clave] += stats.get(clave, 0)
+        stats["duration_s"] = round(time.perf_counter() - inicio, 2)
+        self.last_run = {**stats, "at": time.time()}
+        if stats["compacted"] or stats["thumbs_evicted"]:
+            logger.info(
+                f"🗜️ Compactación: {stats['compacted']} imágenes ({stats['bytes_saved'] / 1e6:.1f} MB ahorrados), "
+                f"{stats['thumbs_evicted']} miniaturas liberadas en {stats['duration_s']}s"
+            )
+        return stats
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=IMAGE_STORE_DIR, help="raíz del almacén de imágenes")
+    parser.add_argument("--older-than-days", type=float, default=COMPACT_AFTER_DAYS)
+    parser.add_argument("--min-saving", type=float, default=COMPACT_MIN_SAVING)
+    parser.add_argument("--quota-mb", type=float, default=STORAGE_QUOTA_MB, help="0 = sin cuota")
+    parser.add_argument("--limit", type=int, default=None, help="máximo de imágenes (por defecto todas)")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=MONGO_DB_NAME)
+    parser.add_argument("--collection", default=SCANS_COLLECTION)
+    parser.add_argument("--no-mongo", action="store_true", help="no anotar la nueva ubicación en MongoDB")
+    parser.add_argument("--dry-run", action="store_true", help="solo contar las imágenes a compactar")
+    args = parser.parse_args()
+
+    store = ImageStore(args.store)
+    compactor = StorageCompactor(store, older_than_days=args.older_than_days,
+                                 min_saving=args.min_saving, quota_mb=args.quota_mb)
+    if args.dry_run:
+        candidatos = store.compaction_candidates(args.older_than_days, args.limit or -1)
+        print(f"🔍 {len(candidatos)} imágenes por compactar ({sum(c[1] for c in candidatos) / 1e6:.1f} MB)")
+        print(f"   Almacén: {store.usage()}")
+        return
+
+    inicio = time.perf_counter()
+    total = {"compacted": 0, "kept": 0, "errors": 0, "bytes_saved": 0}
+    pendientes = args.limit
+    while pendientes is None or pendientes > 0:
+        lote = COMPACT_BATCH if pendientes is None else min(COMPACT_BATCH, pendientes)
+        stats = compactor.compact_once(lote)
+        procesados = stats["compacted"] + stats["kept"] + stats["errors"]
+        for clave in total:
+            total[clave] += stats[clave]
+        print(f"   {total['compacted']} compactadas, {total['kept']} sin cambios, "
+              f"{total['bytes_saved'] / 1e6:.1f} MB ahorrados")
+        if procesados < lote:
+            break
+        if pendientes is not None:
+            pendientes -= procesados
+
+    cuota = compactor.enforce_quota()
+    if cuota["thumbs_evicted"]:
+        print(f"🧹 {cuota['thumbs_evicted']} miniaturas liberadas ({cuota['thumb_bytes_freed'] / 1e6:.1f} MB)")
+
+    if not args.no_mongo:
+        client = get_client(args.uri)
+        try:
+            coleccion = client[args.db][args.collection]
+            anotados = 0
+            while True:
+                n = compactor.sync_documents(coleccion)
+                anotados += n
+                if n == 0:
+                    break
+            print(f"📝 Ubicación actualizada en MongoDB para {anotados} imágenes")
+        finally:
+            client.close()
+
+    print(f"✅ {total['compacted']} compactadas, {total['kept']} sin cambios, {total['errors']} con error en "
+          f"{time.perf_counter() - inicio:.1f}s; almacén: {cuota['usage_bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
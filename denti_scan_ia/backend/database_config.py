@@ -1,2 +1,255 @@
 # database_config.py
-# Configuración de base de datos (mock, para extender en el futuro)
+# Conexión a MongoDB compartida por proceso, esquema único de escaneos e índices
+#
+# Todo el código (API, scripts de Joe, herramientas de línea de comandos) pide
+# el cliente con get_client(): un solo MongoClient por proceso y URI, con su
+# propio pool de conexiones, en lugar de abrir uno nuevo en cada llamada.
+import base64
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+import pymongo
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "DentiScan-AI--Proyect")
+SCANS_COLLECTION = os.getenv("SCANS_COLLECTION", "imagenes")
+
+# Pool de conexiones: debe cubrir los hilos de persistence.DB_MAX_WORKERS
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "32"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+# Tiempo máximo esperando una conexión libre del pool antes de fallar
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+# Versión del esquema de los documentos de 'imagenes'. Los documentos sin este
+# campo son anteriores a la unificación (nombre/fecha, usuario/fecha_subida...)
+SCHEMA_VERSION = 2
+
+# Los listados ordenan por (upload_date, _id): el _id al final del índice evita
+# un SORT en memoria cuando hay varias fechas iguales
+SCAN_INDEXES = [
+    IndexModel([("email", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)], name="email_upload_date_id"),
+    IndexModel([("upload_date", DESCENDING), ("_id", DESCENDING)], name="upload_date_id"),
+    IndexModel([("content_hash", ASCENDING)], name="content_hash"),
+    IndexModel([("status", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)], name="status_upload_date_id"),
+    IndexModel([("image_filename", ASCENDING)], name="image_filename"),
+    IndexModel([("ingested_at", ASCENDING)], name="ingested_at"),
+]
+
+# Campos que devuelven los listados: nunca los bytes de la imagen
+SCAN_LIST_PROJECTION = {
+    "name": 1,
+    "email": 1,
+    "birth_date": 1,
+    "image_filename": 1,
+    "content_hash": 1,
+    "mime_type": 1,
+    "size_bytes": 1,
+    "status": 1,
+    "diagnosis": 1,
+    "confidence": 1,
+    "model_version": 1,
+    "checkup_id": 1,
+    "phash": 1,
+    "dhash": 1,
+    "upload_date": 1,
+    "schema_version": 1,
+}
+SCAN_LIST_MAX_LIMIT = int(os.getenv("SCAN_LIST_MAX_LIMIT", "200"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(uri=MONGO_URI):
+    """Cliente compartido para la URI; se crea la primera vez que se pide"""
+    client = _clients.get(uri)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(uri)
+        if client is None:
+            client = MongoClient(
+                uri,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                appname="dentiscan",
+            )
+            _clients[uri] = client
+    return client
+
+
+def get_db(db_name=MONGO_DB_NAME, uri=MONGO_URI):
+    return get_client(uri)[db_name]
+
+
+def scans_collection(db=None, collection_name=SCANS_COLLECTION):
+    return (db if db is not None else get_db())[collection_name]
+
+
+def ping(uri=MONGO_URI, timeout_s=None):
+    """Ping al servidor; con timeout_s no se espera el serverSelectionTimeout completo"""
+    if timeout_s is None:
+        get_client(uri).admin.command("ping")
+        return
+    with pymongo.timeout(timeout_s):
+        get_client(uri).admin.command("ping")
+
+
+def ensure_indexes(coleccion=None):
+    """Crear los índices de la colección de escaneos (no hace nada si ya existen)"""
+    coleccion = coleccion if coleccion is not None else scans_collection()
+    return coleccion.create_indexes(SCAN_INDEXES)
+
+
+def close_clients():
+    """Cerrar los clientes al apagar el proceso"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+@dataclass
+class ScanRecord:
+    """Documento de la colección 'imagenes'; lo escriben la API y los scripts"""
+    name: str
+    email: Optional[str] = None
+    birth_date: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    image_filename: Optional[str] = None
+    file_path: Optional[str] = None
+    content_hash: Optional[str] = None
+    mime_type: Optional[str] = None
+    size_bytes: Optional[int] = None
+    status: str = "registered"
+    diagnosis: Optional[str] = None
+    confidence: Optional[float] = None
+    recommendations: Optional[list] = None
+    model_version: Optional[str] = None
+    # Agrupa las imágenes subidas juntas en un mismo control
+    checkup_id: Optional[str] = None
+    # Hashes perceptuales de 64 bits en hexadecimal (perceptual_hash.py)
+    phash: Optional[str] = None
+    dhash: Optional[str] = None
+    source: str = "api"
+    upload_date: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    # Campos de MongoImageStorage.put cuando los bytes van en MongoDB
+    image_storage: dict = field(default_factory=dict)
+
+    def to_document(self):
+        documento = asdict(self)
+        documento.update(documento.pop("image_storage"))
+        documento = {k: v for k, v in documento.items() if v is not None}
+        documento["schema_version"] = SCHEMA_VERSION
+        return documento
+
+
+def stamp_ingested(documentos):
+    """
+    Hora de llegada a MongoDB (no la de la subida): las exportaciones
+    incrementales filtran por este campo, así que un escaneo que esperó en el
+    diario no queda fuera de la exportación siguiente
+    """
+    ahora = datetime.now(timezone.utc)
+    for documento in documentos:
+        documento["ingested_at"] = ahora
+    return documentos
+
+
+def insert_scan(record: ScanRecord, coleccion=None) -> str:
+    coleccion = coleccion if coleccion is not None else scans_collection()
+    return str(coleccion.insert_one(stamp_ingested([record.to_document()])[0]).inserted_id)
+
+
+def find_scans_by_email(email: str, limit: int = 50, coleccion=None) -> list:
+    """Escaneos de un paciente, del más reciente al más antiguo (índice email_upload_date_id)"""
+    coleccion = coleccion if coleccion is not None else scans_collection()
+    return list(coleccion.find({"email": email}).sort([("upload_date", DESCENDING), ("_id", DESCENDING)]).limit(limit))
+
+
+def find_scan_by_filename(image_filename: str, coleccion=None) -> Optional[dict]:
+    coleccion = coleccion if coleccion is not None else scans_collection()
+    return coleccion.find_one({"image_filename": image_filename}, sort=[("upload_date", DESCENDING)])
+
+
+def find_scan_by_hash(content_hash: str, coleccion=None) -> Optional[dict]:
+    coleccion = coleccion if coleccion is not None else scans_collection()
+    return coleccion.find_one({"content_hash": content_hash}, sort=[("upload_date", DESCENDING)])
+
+
+def find_scans_by_ids(ids, coleccion=None) -> dict:
+    """{id: documento} con los campos de los listados; los ids inexistentes no aparecen"""
+    coleccion = coleccion if coleccion is not None else scans_collection()
+    object_ids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+    return {str(doc["_id"]): doc for doc in coleccion.find({"_id": {"$in": object_ids}}, SCAN_LIST_PROJECTION)}
+
+
+def encode_cursor(documento):
+    """Cursor opaco con la posición (upload_date, _id) del último documento devuelto"""
+    fecha = documento["upload_date"]
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    posicion = {"d": round(fecha.timestamp() * 1000), "id": str(documento["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(posicion).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        posicion = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromtimestamp(posicion["d"] / 1000, timezone.utc), ObjectId(posicion["id"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
+
+def list_scans(coleccion=None, email=None, status=None, date_from=None, date_to=None, cursor=None, limit=50):
+    """
+    Una página de escaneos, del más reciente al más antiguo, y el cursor de la
+    siguiente (None si no hay más). Paginación por clave (upload_date, _id):
+    cada página cuesta lo mismo sin importar cuántas se hayan recorrido antes.
+    """
+    coleccion = coleccion if coleccion is not None else scans_collection()
+    limit = max(1, min(limit, SCAN_LIST_MAX_LIMIT))
+
+    # $type deja fuera los documentos anteriores al esquema sin upload_date
+    fechas = {"$type": "date"}
+    if date_from is not None:
+        fechas["$gte"] = date_from
+    if date_to is not None:
+        fechas["$lt"] = date_to
+    filtro = {"upload_date": fechas}
+    if email is not None:
+        filtro["email"] = email
+    if status is not None:
+        filtro["status"] = status
+    if cursor is not None:
+        fecha, ultimo_id = decode_cursor(cursor)
+        filtro = {"$and": [filtro, {"$or": [
+            {"upload_date": {"$lt": fecha}},
+            {"upload_date": fecha, "_id": {"$lt": ultimo_id}},
+        ]}]}
+
+    # Se pide uno de más para saber si existe otra página
+    documentos = list(
+        coleccion.find(filtro, SCAN_LIST_PROJECTION)
+        .sort([("upload_date", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+    )
+    siguiente = encode_cursor(documentos[limit - 1]) if len(documentos) > limit else None
+    return documentos[:limit], siguiente
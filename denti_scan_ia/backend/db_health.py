@@ -0,0 +1,193 @@
+# db_health.py
+# Estado de MongoDB vigilado en segundo plano y circuit breaker
+#
+# Un monitor hace ping cada MONGO_HEALTH_INTERVAL_S y alimenta el breaker. Con
+# el breaker abierto las operaciones fallan al instante (o van al diario) en
+# lugar de esperar el serverSelectionTimeout de pymongo en cada petición.
+import asyncio
+import logging
+import os
+import time
+
+from pymongo.errors import (
+    AutoReconnect, ConnectionFailure, ExecutionTimeout, NetworkTimeout, PyMongoError, ServerSelectionTimeoutError
+)
+
+from metrics import DB_ERRORS, span
+from persistence import run_db
+
+logger = logging.getLogger(__name__)
+
+MONGO_HEALTH_INTERVAL_S = float(os.getenv("MONGO_HEALTH_INTERVAL_S", "5"))
+MONGO_PING_TIMEOUT_S = float(os.getenv("MONGO_PING_TIMEOUT_S", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RESET_TIMEOUT_S = float(os.getenv("BREAKER_RESET_TIMEOUT_S", "10"))
+
+# Errores que indican que la base de datos no está disponible (no un error del documento)
+CONNECTION_ERRORS = (AutoReconnect, ConnectionFailure, ServerSelectionTimeoutError, NetworkTimeout,
+                     ExecutionTimeout, ConnectionError, asyncio.TimeoutError)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("MongoDB no está disponible")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    closed    -> todo pasa; BREAKER_FAILURE_THRESHOLD fallos seguidos lo abren
+    open      -> todo falla al instante durante BREAKER_RESET_TIMEOUT_S
+    half_open -> deja pasar una prueba; si sale bien se cierra, si no se reabre
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout_s=BREAKER_RESET_TIMEOUT_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None
+        self.counters = {"opened": 0, "rejected": 0}
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout_s:
+            self.state = "half_open"
+            self._trial_at = None
+        if self.state == "half_open":
+            # Una sola prueba a la vez; si no informó resultado, se permite otra tras el timeout
+            if self._trial_at is None or now - self._trial_at >= self.reset_timeout_s:
+                self._trial_at = now
+                return True
+        self.counters["rejected"] += 1
+        return False
+
+    def available(self):
+        """Si allow() dejaría pasar una operación, sin gastar la prueba de half_open ni contar rechazos"""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open":
+            return now - self.opened_at >= self.reset_timeout_s
+        return self._trial_at is None or now - self._trial_at >= self.reset_timeout_s
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("✅ MongoDB respondió: circuit breaker cerrado")
+        self.state = "closed"
+        self.failures = 0
+        self._trial_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.counters["opened"] += 1
+            logger.warning(f"🔌 MongoDB no responde ({self.failures} fallos): circuit breaker abierto")
+
+    def retry_after(self):
+        if self.state != "open":
+            return 1
+        return max(1, int(self.reset_timeout_s - (time.monotonic() - self.opened_at)) + 1)
+
+    def snapshot(self):
+        return {"state": self.state, "consecutive_failures": self.failures, **self.counters}
+
+
+async def guarded(breaker, func, *args, **kwargs):
+    """run_db a través del breaker: CircuitOpenError si está abierto. Sin breaker es run_db sin más"""
+    if breaker is None:
+        return await run_db(func, *args, **kwargs)
+    if not breaker.allow():
+        raise CircuitOpenError(breaker.retry_after())
+    try:
+        result = await run_db(func, *args, **kwargs)
+    except CONNECTION_ERRORS:
+        DB_ERRORS.inc(operation=getattr(func, "__name__", "db"))
+        breaker.record_failure()
+        raise
+    except PyMongoError:
+        # MongoDB respondió (p. ej. clave duplicada): la conexión funciona
+        breaker.record_success()
+        raise
+    breaker.record_success()
+    return result
+
+
+class MongoHealthMonitor:
+    """
+    Llama a check() (bloqueante: ping o reconexión) en el pool de E/S cada
+    interval_s y registra latencia, último éxito y último error.
+    """
+
+    def __init__(self, check, breaker, interval_s=MONGO_HEALTH_INTERVAL_S, timeout_s=MONGO_PING_TIMEOUT_S):
+        self.check = check
+        self.breaker = breaker
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.healthy = None
+        self.latency_ms = None
+        self.last_ok_at = None
+        self.last_error = None
+        self.checks = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval_s)
+
+    async def probe(self):
+        self.checks += 1
+        inicio = time.perf_counter()
+        try:
+            with span("mongo_ping"):
+                ok = await asyncio.wait_for(run_db(self.check, self.timeout_s), self.timeout_s + 1)
+            if ok is False:
+                raise ConnectionError("MongoDB no está disponible")
+        except Exception as e:
+            DB_ERRORS.inc(operation="ping")
+            if self.healthy is not False:
+                logger.warning(f"⚠️ MongoDB no responde: {e}")
+            self.healthy = False
+            self.last_error = str(e)
+            self.breaker.record_failure()
+            return False
+        if self.healthy is False:
+            logger.info("✅ MongoDB vuelve a responder")
+        self.healthy = True
+        self.latency_ms = round((time.perf_counter() - inicio) * 1000, 2)
+        self.last_ok_at = time.time()
+        self.breaker.record_success()
+        return True
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self):
+        if self.healthy is None:
+            estado = "unknown"
+        else:
+            estado = "up" if self.healthy else "down"
+        return {
+            "state": estado,
+            "breaker": self.breaker.snapshot(),
+            "latency_ms": self.latency_ms,
+            "last_ok_at": self.last_ok_at,
+            "last_error": self.last_error,
+            "checks": self.checks,
+        }
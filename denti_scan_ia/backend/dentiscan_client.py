@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Cliente de la API de DentiScan, síncrono (DentiScanClient) y asíncrono
+(AsyncDentiScanClient), sobre httpx.
+
+- Un pool de conexiones keep-alive por cliente: crear un cliente por proceso
+  y reutilizarlo, no uno por petición.
+- Las imágenes se suben desde bytes, archivos abiertos o rutas; el multipart
+  se envía por bloques sin copiar la imagen.
+- Los POST llevan Idempotency-Key: un reintento tras un timeout o un 503 no
+  registra el escaneo dos veces.
+- register_many / analyze_many envían lotes con concurrencia limitada.
+
+Ejecutado como script, registra todas las imágenes de una carpeta:
+
+Uso:
+    python dentiscan_client.py fotos/ --email paciente@correo.com --name "Ana Pérez" --birth-date 1990-05-01
+    python dentiscan_client.py fotos/ --email paciente@correo.com --analyze --concurrency 8
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+DENTISCAN_API_URL = os.getenv("DENTISCAN_API_URL", "http://localhost:8000")
+DENTISCAN_API_TIMEOUT_S = float(os.getenv("DENTISCAN_API_TIMEOUT_S", "60"))
+DENTISCAN_API_RETRIES = int(os.getenv("DENTISCAN_API_RETRIES", "3"))
+DENTISCAN_API_MAX_CONNECTIONS = int(os.getenv("DENTISCAN_API_MAX_CONNECTIONS", "10"))
+
+# 409: otra petición con la misma clave sigue en curso
+ESTADOS_REINTENTABLES = {409, 429, 502, 503, 504}
+ERRORES_REINTENTABLES = (httpx.TransportError,)
+EXTENSIONES = (".jpg", ".jpeg", ".png", ".webp")
+
+
+class DentiScanError(Exception):
+    """Respuesta de error de la API"""
+
+    def __init__(self, status_code, detail):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(f"{status_code}: {detail}")
+
+    @property
+    def reasons(self):
+        """Motivos del control de calidad cuando la foto se rechaza con 422"""
+        return self.detail.get("reasons", []) if isinstance(self.detail, dict) else []
+
+
+def idempotency_key_for(*partes):
+    """Clave estable a partir del contenido: la misma subida repetida usa la misma clave"""
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(parte if isinstance(parte, (bytes, bytearray, memoryview)) else str(parte).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class _Imagen:
+    """Imagen a subir: se vuelve a leer desde el principio en cada intento"""
+
+    def __init__(self, imagen, filename=None, mime_type=None):
+        self._abierto = None
+        if isinstance(imagen, (str, os.PathLike)):
+            self.path, self.data, self.file = os.fspath(imagen), None, None
+            filename = filename or os.path.basename(self.path)
+        elif isinstance(imagen, (bytes, bytearray, memoryview)):
+            self.path, self.data, self.file = None, imagen, None
+        else:
+            self.path, self.data, self.file = None, None, imagen
+            self.inicio = imagen.tell()
+        self.filename = filename or "imagen.jpg"
+        self.mime_type = mime_type or _mime_por_extension(self.filename)
+
+    def abrir(self):
+        self.cerrar()
+        if self.path is not None:
+            self._abierto = open(self.path, "rb")
+            contenido = self._abierto
+        elif self.data is not None:
+            contenido = io.BytesIO(self.data)
+        else:
+            self.file.seek(self.inicio)
+            contenido = self.file
+        return (self.filename, contenido, self.mime_type)
+
+    def cerrar(self):
+        if self._abierto is not None:
+            self._abierto.close()
+            self._abierto = None
+
+
+def _mime_por_extension(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return {".png": "image/png", ".webp": "image/webp", ".bmp": "image/bmp"}.get(ext, "image/jpeg")
+
+
+class _ClienteBase:
+    def __init__(self, base_url, timeout, retries, backoff_s, max_connections):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self._opciones = {
+            "base_url": self.base_url,
+            "timeout": httpx.Timeout(timeout, connect=min(timeout, 10)),
+            "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            "headers": {"User-Agent": "dentiscan-client"},
+        }
+
+    def _espera(self, intento, response=None):
+        """Backoff exponencial con jitter; respeta Retry-After si la API lo envía"""
+        if response is not None:
+            try:
+                return min(float(response.headers["Retry-After"]), 60.0)
+            except (KeyError, ValueError):
+                pass
+        return self.backoff_s * (2 ** intento) * (0.5 + random.random() / 2)
+
+    def _reintentar(self, intento, response=None, error=None):
+        if intento >= self.retries:
+            return False
+        if error is not None:
+            return isinstance(error, ERRORES_REINTENTABLES)
+        return response.status_code in ESTADOS_REINTENTABLES
+
+    @staticmethod
+    def _resultado(response):
+        if response.is_success:
+            return response.json()
+        try:
+            detail = response.json().get("detail")
+        except ValueError:
+            detail = response.text
+        raise DentiScanError(response.status_code, detail)
+
+    @staticmethod
+    def _registro(nombre, apellido, email, fecha_nacimiento):
+        return {"nombre": nombre, "apellido": apellido, "email": email, "fecha_nacimiento": fecha_nacimiento}
+
+    @staticmethod
+    def _paciente(name, email, birth_date):
+        return {"name": name, "email": email, "birthDate": birth_date}
+
+
+class DentiScanClient(_ClienteBase):
+    """
+    Cliente síncrono. httpx.Client es seguro entre hilos: un mismo cliente
+    puede atender varias sesiones de Streamlit o los hilos de register_many.
+    """
+
+    def __init__(self, base_url=DENTISCAN_API_URL, timeout=DENTISCAN_API_TIMEOUT_S, retries=DENTISCAN_API_RETRIES,
+                 backoff_s=0.5, max_connections=DENTISCAN_API_MAX_CONNECTIONS, transport=None):
+        super().__init__(base_url, timeout, retries, backoff_s, max_connections)
+        self.max_connections = max_connections
+        self._http = httpx.Client(transport=transport, **self._opciones)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._http.close()
+
+    def _request(self, method, path, imagenes=(), campo="dentalImage", idempotency_key=None, **kwargs):
+        headers = {}
+        if method == "POST":
+            # Sin clave explícita cada llamada es una subida distinta, pero sus reintentos comparten clave
+            headers["Idempotency-Key"] = idempotency_key or uuid.uuid4().hex
+        intento = 0
+        try:
+            while True:
+                if imagenes:
+                    kwargs["files"] = [(campo, imagen.abrir()) for imagen in imagenes]
+                try:
+                    response = self._http.request(method, path, headers=headers, **kwargs)
+                except Exception as e:
+                    if not self._reintentar(intento, error=e):
+                        raise
+                    time.sleep(self._espera(intento))
+                else:
+                    if not self._reintentar(intento, response):
+                        return self._resultado(response)
+                    time.sleep(self._espera(intento, response))
+                intento += 1
+        finally:
+            for imagen in imagenes:
+                imagen.cerrar()
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def ready(self):
+        """True si /readyz responde 200"""
+        try:
+            return self._http.get("/readyz").status_code == 200
+        except httpx.TransportError:
+            return False
+
+    def register(self, nombre, apellido, email, fecha_nacimiento, imagen, filename=None, mime_type=None,
+                 idempotency_key=None):
+        """POST /registro: guarda la imagen y los datos del paciente sin analizarla"""
+        return self._request(
+            "POST", "/registro", [_Imagen(imagen, filename, mime_type)], campo="imagen",
+            data=self._registro(nombre, apellido, email, fecha_nacimiento), idempotency_key=idempotency_key,
+        )
+
+    def analyze(self, name, email, birth_date, imagen, filename=None, mime_type=None, idempotency_key=None):
+        """POST /analyze_dental_image: registra y analiza una imagen"""
+        return self._request(
+            "POST", "/analyze_dental_image", [_Imagen(imagen, filename, mime_type)],
+            data=self._paciente(name, email, birth_date), idempotency_key=idempotency_key,
+        )
+
+    def analyze_checkup(self, name, email, birth_date, imagenes, idempotency_key=None):
+        """POST /analyze_dental_images: varias imágenes de un mismo control en una petición"""
+        return self._request(
+            "POST", "/analyze_dental_images", [_Imagen(i) for i in imagenes], campo="dentalImages",
+            data=self._paciente(name, email, birth_date), idempotency_key=idempotency_key,
+        )
+
+    def submit_job(self, name, email, birth_date, imagen, filename=None, mime_type=None, idempotency_key=None):
+        """POST /jobs/analyze_dental_image: encola el análisis y devuelve el trabajo"""
+        return self._request(
+            "POST", "/jobs/analyze_dental_image", [_Imagen(imagen, filename, mime_type)],
+            data=self._paciente(name, email, birth_date), idempotency_key=idempotency_key,
+        )
+
+    def wait_job(self, job_id, poll_s=0.5, timeout_s=300):
+        """Consultar el trabajo hasta que termina; devuelve su resultado o lanza DentiScanError"""
+        limite = time.monotonic() + timeout_s
+        while True:
+            job = self._request("GET", f"/jobs/{job_id}")
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] == "failed":
+                raise DentiScanError(500, job.get("error"))
+            if time.monotonic() > limite:
+                raise TimeoutError(f"El trabajo {job_id} no terminó en {timeout_s}s")
+            time.sleep(poll_s)
+
+    def similar(self, scan_id, max_distance=None, same_patient=False, limit=20):
+        params = {"same_patient": same_patient, "limit": limit}
+        if max_distance is not None:
+            params["max_distance"] = max_distance
+        return self._request("GET", f"/scans/{scan_id}/similar", params=params)
+
+    def _lote(self, funcion, items, concurrency):
+        """Resultados en el orden de items; los errores se devuelven en su posición, no se lanzan"""
+        def uno(item):
+            try:
+                return funcion(**item)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=concurrency or self.max_connections) as pool:
+            return list(pool.map(uno, items))
+
+    def register_many(self, registros, concurrency=None):
+        """register para cada dict de argumentos, con hasta 'concurrency' peticiones a la vez"""
+        return self._lote(self.register, registros, concurrency)
+
+    def analyze_many(self, analisis, concurrency=None):
+        """analyze para cada dict de argumentos, con hasta 'concurrency' peticiones a la vez"""
+        return self._lote(self.analyze, analisis, concurrency)
+
+
+class AsyncDentiScanClient(_ClienteBase):
+    """Cliente asíncrono, para usar desde otro servicio asyncio o scripts con mucha concurrencia"""
+
+    def __init__(self, base_url=DENTISCAN_API_URL, timeout=DENTISCAN_API_TIMEOUT_S, retries=DENTISCAN_API_RETRIES,
+                 backoff_s=0.5, max_connections=DENTISCAN_API_MAX_CONNECTIONS, transport=None):
+        super().__init__(base_url, timeout, retries, backoff_s, max_connections)
+        self.max_connections = max_connections
+        self._http = httpx.AsyncClient(transport=transport, **self._opciones)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def _request(self, method, path, imagenes=(), campo="dentalImage", idempotency_key=None, **kwargs):
+        headers = {}
+        if method == "POST":
+            # Sin clave explícita cada llamada es una subida distinta, pero sus reintentos comparten clave
+            headers["Idempotency-Key"] = idempotency_key or uuid.uuid4().hex
+        intento = 0
+        try:
+            while True:
+                if imagenes:
+                    kwargs["files"] = [(campo, imagen.abrir()) for imagen in imagenes]
+                try:
+                    response = await self._http.request(method, path, headers=headers, **kwargs)
+                except Exception as e:
+                    if not self._reintentar(intento, error=e):
+                        raise
+                    await asyncio.sleep(self._espera(intento))
+                else:
+                    if not self._reintentar(intento, response):
+                        return self._resultado(response)
+                    await asyncio.sleep(self._espera(intento, response))
+                intento += 1
+        finally:
+            for imagen in imagenes:
+                imagen.cerrar()
+
+    async def health(self):
+        return await self._request("GET", "/health")
+
+    async def ready(self):
+        try:
+            return (await self._http.get("/readyz")).status_code == 200
+        except httpx.TransportError:
+            return False
+
+    async def register(self, nombre, apellido, email, fecha_nacimiento, imagen, filename=None, mime_type=None,
+                       idempotency_key=None):
+        return await self._request(
+            "POST", "/registro", [_Imagen(imagen, filename, mime_type)], campo="imagen",
+            data=self._registro(nombre, apellido, email, fecha_nacimiento), idempotency_key=idempotency_key,
+        )
+
+    async def analyze(self, name, email, birth_date, imagen, filename=None, mime_type=None, idempotency_key=None):
+        return await self._request(
+            "POST", "/analyze_dental_image", [_Imagen(imagen, filename, mime_type)],
+            data=self._paciente(name, email, birth_date), idempotency_key=idempotency_key,
+        )
+
+    async def analyze_checkup(self, name, email, birth_date, imagenes, idempotency_key=None):
+        return await self._request(
+            "POST", "/analyze_dental_images", [_Imagen(i) for i in imagenes], campo="dentalImages",
+            data=self._paciente(name, email, birth_date), idempotency_key=idempotency_key,
+        )
+
+    async def submit_job(self, name, email, birth_date, imagen, filename=None, mime_type=None, idempotency_key=None):
+        return await self._request(
+            "POST", "/jobs/analyze_dental_image", [_Imagen(imagen, filename, mime_type)],
+            data=self._paciente(name, email, birth_date), idempotency_key=idempotency_key,
+        )
+
+    async def wait_job(self, job_id, poll_s=0.5, timeout_s=300):
+        limite = time.monotonic() + timeout_s
+        while True:
+            job = await self._request("GET", f"/jobs/{job_id}")
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] == "failed":
+                raise DentiScanError(500, job.get("error"))
+            if time.monotonic() > limite:
+                raise TimeoutError(f"El trabajo {job_id} no terminó en {timeout_s}s")
+            await asyncio.sleep(poll_s)
+
+    async def similar(self, scan_id, max_distance=None, same_patient=False, limit=20):
+        params = {"same_patient": same_patient, "limit": limit}
+        if max_distance is not None:
+            params["max_distance"] = max_distance
+        return await self._request("GET", f"/scans/{scan_id}/similar", params=params)
+
+    async def _lote(self, funcion, items, concurrency):
+        semaforo = asyncio.Semaphore(concurrency or self.max_connections)
+
+        async def uno(item):
+            async with semaforo:
+                return await funcion(**item)
+
+        return await asyncio.gather(*(uno(item) for item in items), return_exceptions=True)
+
+    async def register_many(self, registros, concurrency=None):
+        return await self._lote(self.register, registros, concurrency)
+
+    async def analyze_many(self, analisis, concurrency=None):
+        return await self._lote(self.analyze, analisis, concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directorio", help="carpeta con las imágenes")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--name", required=True, help="nombre y apellido del paciente")
+    parser.add_argument("--birth-date", required=True)
+    parser.add_argument("--analyze", action="store_true", help="analizar con el modelo además de registrar")
+    parser.add_argument("--url", default=DENTISCAN_API_URL)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    archivos = sorted(
+        os.path.join(args.directorio, f) for f in os.listdir(args.directorio) if f.lower().endswith(EXTENSIONES)
+    )
+    print(f"📤 {len(archivos)} imágenes hacia {args.url}")
+
+    def clave(ruta):
+        # Volver a ejecutar el script no duplica las imágenes que ya se subieron
+        return idempotency_key_for(args.email, os.path.basename(ruta), os.path.getsize(ruta), os.path.getmtime(ruta))
+
+    inicio = time.perf_counter()
+    with DentiScanClient(args.url, max_connections=args.concurrency) as cliente:
+        if args.analyze:
+            resultados = cliente.analyze_many([
+                {"name": args.name, "email": args.email,
+                 "birth_date": args.birth_date, "imagen": r, "idempotency_key": clave(r)}
+                for r in archivos
+            ], args.concurrency)
+        else:
+            partes = args.name.split(maxsplit=1)
+            resultados = cliente.register_many([
+                {"nombre": partes[0], "apellido": partes[1] if len(partes) > 1 else "", "email": args.email,
+                 "fecha_nacimiento": args.birth_date, "imagen": r, "idempotency_key": clave(r)}
+                for r in archivos
+            ], args.concurrency)
+
+    errores = 0
+    for ruta, resultado in zip(archivos, resultados):
+        if isinstance(resultado, Exception):
+            errores += 1
+            print(f"❌ {os.path.basename(ruta)}: {resultado}")
+    duracion = time.perf_counter() - inicio
+    print(f"✅ {len(archivos) - errores} subidas, {errores} errores en {duracion:.1f}s "
+          f"({len(archivos) / max(duracion, 1e-6):.1f} img/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,421 @@
 # ia_integration.py
-# Módulo mock para integración futura de IA
+# Motor de inferencia en CPU con micro-lotes dinámicos
+#
+# Las peticiones que llegan con pocos milisegundos de diferencia se agrupan en
+# una cola asíncrona y se ejecutan en una sola pasada del modelo.
+import abc
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+
+from image_preprocessing import load_tensor
+from metrics import untraced
+
+logger = logging.getLogger(__name__)
+
+DENTAL_MODEL = os.getenv("DENTAL_MODEL", "reference")
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+PREPROCESS_THREADS = int(os.getenv("PREPROCESS_THREADS", str(os.cpu_count() or 2)))
+
+RECOMMENDATIONS = {
+    "Sin hallazgos": [
+        "Mantén tu rutina de cepillado dos veces al día",
+        "Realiza un control odontológico cada 6 meses",
+    ],
+    "Caries detectada": [
+        "Visita a un odontólogo en los próximos 7 días",
+        "Realiza una limpieza dental profesional",
+    ],
+    "Posible gingivitis": [
+        "Consulta con un periodoncista",
+        "Usa hilo dental y enjuague antiséptico a diario",
+    ],
+}
+
+HEALTHY_LABEL = "Sin hallazgos"
+
+
+@dataclass
+class AnalysisResult:
+    diagnosis: str
+    confidence: float
+    recommendations: list
+    model_version: str
+    probabilities: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class DentalModel(abc.ABC):
+    """
+    Interfaz de los modelos de análisis dental.
+
+    predict_batch recibe un tensor float32 (N, H, W, 3) con valores en [0, 1]
+    y devuelve probabilidades (N, len(labels)).
+    """
+
+    name = "base"
+    version = "0"
+    input_size = (224, 224)
+    labels = tuple(RECOMMENDATIONS)
+
+    @abc.abstractmethod
+    def predict_batch(self, batch):
+        """Probabilidades (N, len(labels)) para un tensor (N, H, W, 3)"""
+
+
+class ReferenceNumpyModel(DentalModel):
+    """Modelo de referencia en NumPy: rasgos de color y una capa lineal con pesos fijos"""
+
+    name = "reference"
+    version = "ref-numpy-1"
+
+    def __init__(self):
+        # Rasgos: [oscuro, marrón, rojo encía, brillo medio, sesgo]
+        self.weights = np.array(
+            [
+                [-4.0, 6.0, 0.5],
+                [-6.0, 9.0, 0.0],
+                [-3.0, 0.0, 8.0],
+                [2.0, -1.0, -0.5],
+                [1.5, -1.0, -1.2],
+            ],
+            dtype=np.float32,
+        )
+
+    def features(self, batch):
+        r, g, b = batch[..., 0], batch[..., 1], batch[..., 2]
+        brillo = batch.mean(axis=-1)
+        oscuro = (brillo < 0.2).mean(axis=(1, 2))
+        marron = ((r > g) & (g > b) & (brillo < 0.45) & (r - b > 0.12)).mean(axis=(1, 2))
+        rojo = ((r > 0.55) & (r - g > 0.25) & (r - b > 0.2)).mean(axis=(1, 2))
+        sesgo = np.ones(len(batch), dtype=np.float32)
+        return np.stack([oscuro, marron, rojo, brillo.mean(axis=(1, 2)), sesgo], axis=1).astype(np.float32)
+
+    def predict_batch(self, batch):
+        logits = self.features(batch) @ self.weights
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+class OnnxModel(DentalModel):
+    """Modelo exportado a ONNX (requiere onnxruntime instalado)"""
+
+    name = "onnx"
+
+    def __init__(self, path):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("onnxruntime no está instalado: pip install onnxruntime") from e
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.version = f"onnx-{os.path.basename(path)}-{int(os.path.getmtime(path))}"
+
+    def predict_batch(self, batch):
+        return self.session.run(None, {self.input_name: batch.astype(np.float32)})[0]
+
+
+def load_model(spec=DENTAL_MODEL):
+    """Crear el modelo indicado: 'reference' o la ruta de un archivo .onnx"""
+    if spec == "reference":
+        return ReferenceNumpyModel()
+    if spec.endswith(".onnx"):
+        return OnnxModel(spec)
+    raise ValueError(f"Modelo desconocido: {spec}")
+
+
+def load_warm_model(spec=DENTAL_MODEL):
+    """load_model + una pasada de calentamiento, para que la primera petición real no pague la carga"""
+    model = load_model(spec)
+    model.predict_batch(np.zeros((1, *model.input_size, 3), dtype=np.float32))
+    return model
+
+
+def analyze_sources(model, sources):
+    """
+    Preprocesar un lote y ejecutar una sola pasada del modelo.
+    Devuelve un AnalysisResult o la excepción correspondiente por imagen.
+    """
+    tensors = []
+    for source in sources:
+        if isinstance(source, BaseException):
+            tensors.append(source)
+            continue
+        try:
+            tensors.append(load_tensor(source, model.input_size))
+        except Exception as e:
+            tensors.append(e)
+    return merge_predictions(model, tensors)
+
+
+def merge_predictions(model, tensors):
+    ok = [i for i, t in enumerate(tensors) if not isinstance(t, BaseException)]
+    results = list(tensors)
+    if ok:
+        batch = np.stack([tensors[i] for i in ok])
+        for i, result in zip(ok, predict(model, batch)):
+            results[i] = result
+    return results
+
+
+def predict(model, batch):
+    return build_results(model, model.predict_batch(batch))
+
+
+def build_results(model, probs):
+    results = []
+    for row in probs:
+        idx = int(np.argmax(row))
+        label = model.labels[idx]
+        results.append(
+            AnalysisResult(
+                diagnosis=label,
+                confidence=round(float(row[idx]), 4),
+                recommendations=RECOMMENDATIONS.get(label, []),
+                model_version=model.version,
+                probabilities={l: round(float(p), 4) for l, p in zip(model.labels, row)},
+            )
+        )
+    return results
+
+
+def summarize_results(results):
+    """
+    Resumen a nivel paciente de las imágenes de un mismo control: el hallazgo
+    con mayor confianza define el diagnóstico global y se juntan las
+    recomendaciones de todos los hallazgos, sin repetir.
+    """
+    if not results:
+        return None
+    hallazgos = sorted((r for r in results if r.diagnosis != HEALTHY_LABEL), key=lambda r: r.confidence, reverse=True)
+    principal = hallazgos[0] if hallazgos else max(results, key=lambda r: r.confidence)
+    findings = {}
+    for r in results:
+        findings[r.diagnosis] = findings.get(r.diagnosis, 0) + 1
+    recomendaciones = [rec for r in (hallazgos or [principal]) for rec in r.recommendations]
+    return {
+        "diagnosis": principal.diagnosis,
+        "confidence": principal.confidence,
+        "findings": findings,
+        "recommendations": list(dict.fromkeys(recomendaciones)),
+    }
+
+
+class MicroBatcher:
+    """
+    Agrupa llamadas concurrentes a submit() en lotes.
+
+    run_batch recibe la lista de elementos y devuelve un resultado por
+    elemento; si un resultado es una excepción, se propaga solo a esa llamada.
+
+    Un lote se cierra al llegar a max_batch_size o al pasar max_wait_ms desde
+    la primera petición. Como mucho hay max_concurrent_batches lotes en curso;
+    mientras tanto las nuevas peticiones se acumulan, así que los lotes crecen
+    solos cuando sube la carga.
+    """
+
+    def __init__(
+        self,
+        run_batch,
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        max_concurrent_batches=1,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrent_batches = max_concurrent_batches
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._inflight = set()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._task = untraced(asyncio.get_running_loop().create_task, self._loop())
+
+    async def submit(self, item):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            try:
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                _cancel_pending(batch)
+                raise
+
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            results = await self.run_batch([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"❌ Error en el lote de inferencia ({len(batch)} imágenes): {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Si el lote se cancela a medias, nadie debe quedarse esperando su resultado
+            _cancel_pending(batch)
+            self._slots.release()
+
+    async def close(self):
+        for task in list(self._inflight):
+            task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _cancel_pending([self._queue.get_nowait()])
+
+
+def _cancel_pending(batch):
+    for _, future in batch:
+        if not future.done():
+            future.cancel()
+
+
+class InferenceEngine:
+    """
+    Punto de entrada del análisis: analyze() devuelve un AnalysisResult.
+
+    Sin pool, el modelo corre en este proceso (hilos para decodificar y un
+    hilo para la pasada del modelo). Con un InferenceWorkerPool, cada lote se
+    envía a un proceso worker y hay tantos lotes en curso como procesos.
+    """
+
+    def __init__(self, model=None, pool=None, max_batch_size=INFERENCE_MAX_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS,
+                 model_spec=DENTAL_MODEL):
+        self.pool = pool
+        self.model = model
+        self.model_spec = model_spec
+        if pool is None:
+            # La decodificación de Pillow libera el GIL, así que se reparte en hilos;
+            # la pasada del modelo va en un hilo propio, un lote a la vez
+            self._preprocess_executor = ThreadPoolExecutor(max_workers=PREPROCESS_THREADS, thread_name_prefix="preprocess")
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        concurrent_batches = pool.size if pool is not None else 1
+        self.batcher = MicroBatcher(self._run_batch, max_batch_size, max_wait_ms, concurrent_batches)
+        self._warm_up_task = None
+        self.batches = 0
+        self.images = 0
+
+    @property
+    def model_version(self):
+        """None mientras el modelo no esté cargado"""
+        if self.pool is not None:
+            return self.pool.model_version
+        return self.model.version if self.model is not None else None
+
+    @property
+    def ready(self):
+        return self.model_version is not None
+
+    async def warm_up(self):
+        """
+        Cargar el modelo (o arrancar los procesos del pool) sin bloquear el
+        event loop. Las llamadas concurrentes esperan la misma carga; si falla,
+        la siguiente llamada lo vuelve a intentar.
+        """
+        if self._warm_up_task is None or (self._warm_up_task.done() and not self.ready):
+            self._warm_up_task = asyncio.ensure_future(self._warm_up())
+        await asyncio.shield(self._warm_up_task)
+
+    async def _warm_up(self):
+        if self.pool is not None:
+            await self.pool.warm_up()
+            return
+        if self.model is None:
+            inicio = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            self.model = await loop.run_in_executor(self._executor, load_warm_model, self.model_spec)
+            logger.info(f"🤖 Modelo de IA cargado: {self.model.version} ({time.perf_counter() - inicio:.1f}s)")
+
+    async def _run_batch(self, sources):
+        self.batches += 1
+        self.images += len(sources)
+        if self.pool is not None:
+            return await self.pool.run_batch(sources)
+
+        if self.model is None:
+            # Carga perezosa: el primer lote espera al modelo
+            await self.warm_up()
+        loop = asyncio.get_running_loop()
+        size = self.model.input_size
+        tensors = await asyncio.gather(
+            *(loop.run_in_executor(self._preprocess_executor, load_tensor, s, size) for s in sources),
+            return_exceptions=True,
+        )
+        # Una imagen ilegible no debe tumbar el resto del lote
+        return await loop.run_in_executor(self._executor, merge_predictions, self.model, tensors)
+
+    async def analyze(self, source):
+        """Analizar una imagen (ruta en disco o bytes)"""
+        return await self.batcher.submit(source)
+
+    async def health(self):
+        if self.pool is not None:
+            estado = await self.pool.health()
+        else:
+            if self.model is not None:
+                status = "ok"
+            elif self._warm_up_task is not None and not self._warm_up_task.done():
+                status = "loading"
+            else:
+                status = "not_loaded"
+            estado = {"mode": "thread", "status": status, "model_version": self.model_version}
+        estado["pending"] = self.batcher.pending
+        return estado
+
+    async def close(self):
+        if self._warm_up_task is not None and not self._warm_up_task.done():
+            self._warm_up_task.cancel()
+        await self.batcher.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+        else:
+            self._preprocess_executor.shutdown(wait=False)
+            self._executor.shutdown(wait=False)
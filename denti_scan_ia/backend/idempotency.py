@@ -0,0 +1,112 @@
+# idempotency.py
+# Claves de idempotencia (cabecera Idempotency-Key) para los POST que registran escaneos
+#
+# Un cliente que reintenta tras un timeout no sabe si la primera petición llegó
+# a registrarse. Con la misma clave, la API devuelve la respuesta guardada en
+# lugar de registrar el escaneo otra vez. Las claves viven en SQLite junto al
+# diario, así que valen para todos los workers de uvicorn de la máquina.
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", os.path.join("uploads", "idempotency.sqlite3"))
+# Cuánto se recuerda una respuesta
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", str(24 * 3600)))
+# Una clave reservada por un proceso que murió a mitad de la petición se libera pasado este tiempo
+IDEMPOTENCY_LOCK_S = float(os.getenv("IDEMPOTENCY_LOCK_S", "300"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: bytes
+    media_type: str
+
+
+class IdempotencyStore:
+    def __init__(self, path=IDEMPOTENCY_PATH, ttl_s=IDEMPOTENCY_TTL_S, lock_s=IDEMPOTENCY_LOCK_S):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.lock_s = lock_s
+        self._local = threading.local()
+        self._ultima_purga = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS idempotency (
+                       key TEXT PRIMARY KEY,
+                       scope TEXT NOT NULL,
+                       status_code INTEGER,
+                       body BLOB,
+                       media_type TEXT,
+                       created_at REAL NOT NULL
+                   )"""
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, key, scope):
+        """
+        Reservar la clave para una petición a 'scope' (método y ruta). Devuelve
+        ("new", None) si hay que procesarla, ("replay", StoredResponse) si ya se
+        respondió, ("in_progress", None) si otra petición la está procesando o
+        ("conflict", None) si la clave se usó en otra ruta.
+        """
+        ahora = time.time()
+        self._purgar(ahora)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conn.execute(
+                "SELECT scope, status_code, body, media_type, created_at FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+            if fila is not None:
+                guardado_scope, status_code, body, media_type, creada = fila
+                if status_code is None and ahora - creada > self.lock_s:
+                    fila = None
+                elif ahora - creada > self.ttl_s:
+                    fila = None
+            if fila is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, scope, created_at) VALUES (?, ?, ?)",
+                    (key, scope, ahora),
+                )
+                conn.execute("COMMIT")
+                return "new", None
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if guardado_scope != scope:
+            return "conflict", None
+        if status_code is None:
+            return "in_progress", None
+        return "replay", StoredResponse(status_code, body, media_type)
+
+    def complete(self, key, status_code, body, media_type):
+        self._conn().execute(
+            "UPDATE idempotency SET status_code = ?, body = ?, media_type = ? WHERE key = ?",
+            (status_code, body, media_type, key),
+        )
+
+    def abandon(self, key):
+        """Liberar la clave sin respuesta: el reintento procesará la petición desde cero"""
+        self._conn().execute("DELETE FROM idempotency WHERE key = ? AND status_code IS NULL", (key,))
+
+    def _purgar(self, ahora):
+        if ahora - self._ultima_purga < 60:
+            return
+        self._ultima_purga = ahora
+        self._conn().execute(
+            "DELETE FROM idempotency WHERE created_at < ?", (ahora - max(self.ttl_s, self.lock_s),)
+        )
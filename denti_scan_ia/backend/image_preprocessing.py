@@ -0,0 +1,101 @@
+# image_preprocessing.py
+# Preprocesamiento en memoria: una sola decodificación por imagen y sin archivos temporales
+#
+# Para JPEG se usa el modo draft de Pillow, que decodifica directamente a 1/2,
+# 1/4 u 1/8 de la resolución (escalado en el dominio DCT), así que una foto de
+# 12 MP nunca se descomprime completa si solo necesitamos 224x224 y una miniatura.
+import os
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+
+@dataclass
+class PreprocessedImage:
+    tensor: np.ndarray
+    thumbnail: bytes
+    original_size: tuple
+    format: str
+
+
+def _as_file(source):
+    """Aceptar ruta, bytes o un objeto tipo archivo"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BytesIO(source)
+    return source
+
+
+def open_normalized(source, min_size=None):
+    """
+    Abrir y decodificar la imagen una vez, en RGB y con la orientación EXIF aplicada.
+    Si se indica min_size, los JPEG se decodifican a la menor escala que lo cubra.
+    """
+    with Image.open(_as_file(source)) as im:
+        original_size = im.size
+        fmt = im.format
+        if min_size is not None:
+            # La rotación EXIF puede intercambiar ancho y alto: pedir el lado mayor en ambos
+            lado = max(min_size)
+            im.draft("RGB", (lado, lado))
+        im.load()
+        ImageOps.exif_transpose(im, in_place=True)
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+    return im, original_size, fmt
+
+
+def to_tensor(im, size):
+    """Tensor float32 (H, W, 3) contiguo con valores en [0, 1]"""
+    resized = im.resize(size, Image.BILINEAR) if im.size != tuple(size) else im
+    tensor = np.asarray(resized, dtype=np.float32)
+    tensor *= 1.0 / 255.0
+    return np.ascontiguousarray(tensor)
+
+
+def _jpeg_bytes(im, quality):
+    buf = BytesIO()
+    im.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def make_thumbnail(im, max_side=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    thumb = im.copy()
+    thumb.thumbnail((max_side, max_side), Image.BILINEAR)
+    return _jpeg_bytes(thumb, quality)
+
+
+def make_width_thumbnail(im, width, quality=THUMBNAIL_QUALITY):
+    """Miniatura de 'width' píxeles de ancho con el alto proporcional (sin ampliar)"""
+    if im.width > width:
+        im = im.resize((width, max(1, round(im.height * width / im.width))), Image.BILINEAR)
+    return _jpeg_bytes(im, quality)
+
+
+def load_tensor(source, size):
+    """Solo el tensor para el modelo"""
+    im, _, _ = open_normalized(source, min_size=size)
+    return to_tensor(im, size)
+
+
+def preprocess(source, size, thumb_side=THUMBNAIL_SIZE):
+    """Tensor del modelo y miniatura JPEG a partir de una sola decodificación"""
+    im, original_size, fmt = open_normalized(source, min_size=(max(size[0], thumb_side), max(size[1], thumb_side)))
+    return PreprocessedImage(
+        tensor=to_tensor(im, size),
+        thumbnail=make_thumbnail(im, thumb_side),
+        original_size=original_size,
+        format=fmt,
+    )
+
+
+def to_jpeg_bytes(source, quality=90):
+    """Convertir cualquier imagen a JPEG en memoria (reemplaza el temp_convertida.jpg)"""
+    im, _, _ = open_normalized(source)
+    buf = BytesIO()
+    im.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
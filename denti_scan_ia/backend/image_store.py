@@ -0,0 +1,264 @@
+# image_store.py
+# Almacén de imágenes direccionado por contenido (SHA-256) con deduplicación
+#
+# Estructura en disco:
+#   uploads/ab/cd/abcd1234...   -> bytes de la imagen (nombre = hash completo)
+#   uploads/compact/ab/cd/...   -> versión recodificada de las imágenes antiguas (compaction.py)
+#   uploads/thumbs/<ancho>/...  -> miniaturas (thumbnails.py); se borran con la última referencia
+#   uploads/tmp/                -> subidas en curso
+#   uploads/blobs.sqlite3       -> conteo de referencias por hash y dónde están los bytes
+#
+# El hash es siempre el del archivo original, aunque en disco quede su versión
+# compactada: locate() devuelve la ruta y el tipo MIME de lo que hay realmente.
+import hashlib
+import os
+import sqlite3
+import threading
+import uuid
+from dataclasses import dataclass
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "uploads")
+
+# Columnas añadidas después de la primera versión de la tabla
+_COLUMNAS_COMPACTACION = {
+    "tier": "TEXT NOT NULL DEFAULT 'hot'",
+    "stored_path": "TEXT",
+    "stored_mime": "TEXT",
+    "stored_size": "INTEGER",
+    "compacted_at": "TEXT",
+    "docs_synced": "INTEGER NOT NULL DEFAULT 1",
+    "original_pending": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+@dataclass
+class StoredBlob:
+    sha256: str
+    path: str
+    size: int
+    mime_type: str
+    is_new: bool
+
+
+class ImageStore:
+    def __init__(self, root=IMAGE_STORE_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.thumbs_dir = os.path.join(root, "thumbs")
+        self.db_path = os.path.join(root, "blobs.sqlite3")
+        self._local = threading.local()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS blobs (
+                       sha256 TEXT PRIMARY KEY,
+                       size INTEGER NOT NULL,
+                       mime_type TEXT,
+                       refcount INTEGER NOT NULL,
+                       created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                   )"""
+            )
+            existentes = {row[1] for row in conn.execute("PRAGMA table_info(blobs)")}
+            for columna, tipo in _COLUMNAS_COMPACTACION.items():
+                if columna not in existentes:
+                    conn.execute(f"ALTER TABLE blobs ADD COLUMN {columna} {tipo}")
+            conn.execute("CREATE INDEX IF NOT EXISTS blobs_tier_created ON blobs (tier, created_at)")
+
+    def _conn(self):
+        # Una conexión por hilo; SQLite se encarga del bloqueo entre procesos
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def blob_path(self, sha256):
+        """Ruta fragmentada en dos niveles para no saturar un solo directorio"""
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def thumb_path(self, sha256, width):
+        return os.path.join(self.thumbs_dir, str(width), sha256[:2], sha256[2:4], f"{sha256}.jpg")
+
+    def _remove_thumbs(self, sha256):
+        # Todos los anchos que haya en disco, también los que ya no están en THUMB_WIDTHS
+        try:
+            anchos = os.listdir(self.thumbs_dir)
+        except FileNotFoundError:
+            return
+        for ancho in anchos:
+            try:
+                os.remove(self.thumb_path(sha256, ancho))
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+
+    def new_temp_path(self, prefix=""):
+        return os.path.join(self.tmp_dir, f"{prefix}{uuid.uuid4().hex}.upload")
+
+    def discard_temp(self, tmp_path):
+        """Borrar una subida temporal que no llegó a commit (si aún existe)"""
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def locate(self, sha256):
+        """(ruta, tipo MIME) de los bytes en disco, original o compactado; None si no está"""
+        row = self._conn().execute(
+            "SELECT mime_type, stored_path, stored_mime FROM blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        if row is None:
+            return None
+        path, mime_type = (row[1], row[2]) if row[1] else (self.blob_path(sha256), row[0])
+        return (path, mime_type) if os.path.exists(path) else None
+
+    def exists(self, sha256):
+        return self.locate(sha256) is not None
+
+    def commit(self, tmp_path, sha256, size, mime_type):
+        """
+        Mover una subida temporal a su ruta definitiva e incrementar su referencia.
+        Si los mismos bytes ya existen (aunque estén compactados), se descarta el
+        temporal; el StoredBlob describe entonces lo que hay en disco.
+        """
+        final_path = self.blob_path(sha256)
+        stored_mime = mime_type
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT stored_path, stored_mime FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is not None and row[0] and os.path.exists(row[0]):
+                final_path, stored_mime = row
+                is_new = False
+            else:
+                is_new = row is None or not os.path.exists(final_path)
+            if is_new:
+                os.replace(tmp_path, final_path)
+            else:
+                os.remove(tmp_path)
+            conn.execute(
+                """INSERT INTO blobs (sha256, size, mime_type, refcount) VALUES (?, ?, ?, 1)
+                   ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1""",
+                (sha256, size, mime_type),
+            )
+        return StoredBlob(sha256=sha256, path=final_path, size=size, mime_type=stored_mime, is_new=is_new)
+
+    def stage_file(self, src_path, prefix=""):
+        """Copiar un archivo a un temporal del almacén sin hacer commit: (ruta temporal, sha256, tamaño)"""
+        hasher = hashlib.sha256()
+        tmp_path = self.new_temp_path(prefix)
+        size = 0
+        with open(src_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                hasher.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+        return tmp_path, hasher.hexdigest(), size
+
+    def import_file(self, src_path, mime_type=None):
+        """Copiar un archivo existente al almacén (importaciones y migraciones)"""
+        tmp_path, sha256, size = self.stage_file(src_path)
+        return self.commit(tmp_path, sha256, size, mime_type)
+
+    def info(self, sha256):
+        """(tamaño, tipo MIME) del blob, o None si no está en el almacén"""
+        return self._conn().execute("SELECT size, mime_type FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+
+    def refcount(self, sha256):
+        row = self._conn().execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return row[0] if row else 0
+
+    def release(self, sha256):
+        """Quitar una referencia; el archivo y sus miniaturas se borran cuando nadie lo usa"""
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?", (sha256,))
+            row = conn.execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row and row[0] <= 0:
+                stored = conn.execute("SELECT stored_path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                for path in (self.blob_path(sha256), stored[0]):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                self._remove_thumbs(sha256)
+                return 0
+        return row[0] if row else 0
+
+    # --- Compactación (ver compaction.py) ---
+
+    def compact_path(self, sha256, ext):
+        return os.path.join(self.root, "compact", sha256[:2], sha256[2:4], f"{sha256}{ext}")
+
+    def compaction_candidates(self, older_than_days, limit):
+        """Blobs aún sin evaluar creados hace más de older_than_days: [(sha256, size, mime_type)]"""
+        return self._conn().execute(
+            """SELECT sha256, size, mime_type FROM blobs
+               WHERE tier = 'hot' AND created_at <= datetime('now', ?)
+               ORDER BY created_at LIMIT ?""",
+            (f"-{older_than_days} days", limit),
+        ).fetchall()
+
+    def mark_kept(self, sha256):
+        """La versión compactada no ahorraba lo suficiente: se conserva el original y no se reintenta"""
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE blobs SET tier = 'kept', compacted_at = CURRENT_TIMESTAMP WHERE sha256 = ? AND tier = 'hot'",
+                (sha256,),
+            )
+
+    def replace_with_compacted(self, sha256, path, mime_type, size):
+        """
+        Pasar el blob a su versión compactada (ya escrita en path). El original
+        no se borra aquí: una petición puede haberlo localizado ya y aún no
+        haberlo abierto, así que lo borra remove_replaced_originals pasado un
+        margen. Devuelve False si el blob se liberó o ya se compactó mientras tanto.
+        """
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tier FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None or row[0] != "hot":
+                os.remove(path)
+                return False
+            conn.execute(
+                """UPDATE blobs SET tier = 'compact', stored_path = ?, stored_mime = ?, stored_size = ?,
+                          compacted_at = CURRENT_TIMESTAMP, docs_synced = 0, original_pending = 1
+                   WHERE sha256 = ?""",
+                (path, mime_type, size, sha256),
+            )
+        return True
+
+    def remove_replaced_originals(self, grace_s):
+        """Borrar los originales de blobs compactados hace más de grace_s segundos; devuelve cuántos"""
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            hashes = [
+                row[0] for row in conn.execute(
+                    """SELECT sha256 FROM blobs
+                       WHERE original_pending = 1 AND compacted_at <= datetime('now', ?)""",
+                    (f"-{int(grace_s)} seconds",),
+                )
+            ]
+            for sha256 in hashes:
+                try:
+                    os.remove(self.blob_path(sha256))
+                except FileNotFoundError:
+                    pass
+            conn.executemany("UPDATE blobs SET original_pending = 0 WHERE sha256 = ?", [(h,) for h in hashes])
+        return len(hashes)
+
+    def unsynced(self, limit=500):
+        """Blobs compactados cuya nueva ubicación aún no se anotó en MongoDB"""
+        return self._conn().execute(
+            "SELECT sha256, stored_path, stored_mime, stored_size FROM blobs WHERE docs_synced = 0 LIMIT ?", (limit,)
+        ).fetchall()
+
+    def mark_synced(self, hashes):
+        with self._conn() as conn:
+            conn.executemany("UPDATE blobs SET docs_synced = 1 WHERE sha256 = ?", [(h,) for h in hashes])
+
+    def usage(self):
+        """Bytes de imágenes en disco por nivel: {'hot': ..., 'compact': ..., 'kept': ...}"""
+        rows = self._conn().execute(
+            "SELECT tier, COUNT(*), COALESCE(SUM(COALESCE(stored_size, size)), 0) FROM blobs GROUP BY tier"
+        ).fetchall()
+        return {tier: {"count": count, "bytes": total} for tier, count, total in rows}
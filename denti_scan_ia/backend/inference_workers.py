@@ -0,0 +1,197 @@
+# inference_workers.py
+# Pool de procesos para la inferencia: cada proceso carga el modelo una sola vez
+#
+# Las imágenes que ya están en disco viajan como ruta; los bytes en memoria se
+# copian a memoria compartida y el worker los lee desde ahí, sin pasar la
+# imagen por pickle.
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+from ia_integration import DENTAL_MODEL, analyze_sources, load_warm_model
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+# Estado de cada proceso worker
+_model = None
+
+
+def _init_worker(model_spec):
+    global _model
+    _model = load_warm_model(model_spec)
+
+
+def _worker_ping():
+    return {"pid": os.getpid(), "model_version": _model.version}
+
+
+class _SharedMemoryReader(io.RawIOBase):
+    """Archivo de solo lectura sobre un segmento de memoria compartida, sin copias"""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def release(self):
+        self._view.release()
+
+
+def _worker_analyze(sources):
+    inputs = []
+    attached = []
+    try:
+        for kind, value, size in sources:
+            if kind == "path":
+                inputs.append(value)
+                continue
+            try:
+                shm = shared_memory.SharedMemory(name=value)
+            except Exception as e:
+                inputs.append(e)
+                continue
+            reader = _SharedMemoryReader(shm.buf[:size])
+            attached.append((shm, reader))
+            inputs.append(reader)
+        return analyze_sources(_model, inputs)
+    finally:
+        for shm, reader in attached:
+            reader.release()
+            shm.close()
+
+
+def _to_shared_memory(data):
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    shm.buf[: len(data)] = data
+    return shm
+
+
+class InferenceWorkerPool:
+    """Pool de procesos con el modelo precargado, reinicio automático y chequeo de salud"""
+
+    def __init__(self, model_spec=DENTAL_MODEL, size=INFERENCE_WORKERS):
+        self.model_spec = model_spec
+        self.size = size
+        self.restarts = 0
+        self.model_version = None
+        self._executor = self._create()
+
+    def _create(self):
+        return ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_spec,),
+        )
+
+    def _restart(self):
+        logger.warning("🔄 Reiniciando el pool de inferencia")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._create()
+        self.restarts += 1
+
+    async def warm_up(self):
+        """Arrancar todos los procesos y cargar el modelo antes de la primera petición"""
+        loop = asyncio.get_running_loop()
+        inicio = time.perf_counter()
+        pings = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _worker_ping) for _ in range(self.size))
+        )
+        self.model_version = pings[0]["model_version"]
+        logger.info(
+            f"🤖 Pool de inferencia listo: {self.size} procesos, modelo {self.model_version} "
+            f"({time.perf_counter() - inicio:.1f}s)"
+        )
+
+    async def run_batch(self, sources):
+        """Analizar un lote en un worker; devuelve un resultado o excepción por imagen"""
+        loop = asyncio.get_running_loop()
+        handles = []
+        payload = []
+        try:
+            for source in sources:
+                if isinstance(source, (bytes, bytearray, memoryview)):
+                    shm = _to_shared_memory(source)
+                    handles.append(shm)
+                    payload.append(("shm", shm.name, len(source)))
+                else:
+                    payload.append(("path", os.fspath(source), 0))
+
+            for intento in (1, 2):
+                try:
+                    results = await loop.run_in_executor(self._executor, _worker_analyze, payload)
+                    if self.model_version is None and results:
+                        self.model_version = getattr(results[0], "model_version", None)
+                    return results
+                except BrokenProcessPool:
+                    logger.error(f"❌ Un worker de inferencia murió (intento {intento})")
+                    self._restart()
+                    if intento == 2:
+                        raise
+        finally:
+            for shm in handles:
+                shm.close()
+                shm.unlink()
+
+    def alive_workers(self):
+        procesos = getattr(self._executor, "_processes", None) or {}
+        return sum(1 for p in procesos.values() if p.is_alive())
+
+    async def health(self):
+        """
+        Estado de los procesos sin encolar trabajo: un ping compartiría la cola
+        con los lotes y, con carga, tardaría tanto como ellos. El pool se
+        reinicia solo si algún proceso murió.
+        """
+        procesos = getattr(self._executor, "_processes", None) or {}
+        vivos = self.alive_workers()
+        estado = {
+            "mode": "process_pool",
+            "workers": self.size,
+            "alive": vivos,
+            "restarts": self.restarts,
+            "model_version": self.model_version,
+            "pending_batches": len(getattr(self._executor, "_pending_work_items", None) or {}),
+        }
+        if getattr(self._executor, "_broken", False) or vivos < len(procesos):
+            logger.error(f"❌ Pool de inferencia caído: {vivos}/{len(procesos)} procesos vivos")
+            self._restart()
+            estado.update(status="restarting", restarts=self.restarts, alive=0)
+        elif not procesos:
+            # Los procesos se crean con warm_up o con el primer lote
+            estado.update(status="not_loaded")
+        elif self.model_version is None:
+            estado.update(status="loading")
+        else:
+            estado.update(status="ok")
+        return estado
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
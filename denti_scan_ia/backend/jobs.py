@@ -0,0 +1,165 @@
+# jobs.py
+# Trabajos de análisis asíncronos: cola acotada, progreso y eventos para SSE
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from metrics import untraced
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL_S = int(os.getenv("JOB_TTL_S", "3600"))
+
+FINAL_STATES = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("La cola de análisis está llena")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Job:
+    id: str
+    payload: dict
+    status: str = "queued"
+    stage: str = "queued"
+    progress: int = 0
+    result: dict = None
+    error: str = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    listeners: list = field(default_factory=list, repr=False)
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Ejecuta handler(job, report) para cada trabajo con JOB_WORKERS tareas.
+
+    report(stage, progress) actualiza el trabajo y avisa a quien esté
+    escuchando sus eventos. Si la cola está llena, submit() lanza JobQueueFull
+    con una estimación de cuándo reintentar. Los trabajos que siguen en cola al
+    cerrar se marcan como fallidos y se pasan a on_discard(payload).
+    """
+
+    def __init__(self, handler, max_queue=JOB_QUEUE_SIZE, workers=JOB_WORKERS, on_discard=None):
+        self.handler = handler
+        self.on_discard = on_discard
+        self.max_queue = max_queue
+        self.workers = workers
+        self.jobs = {}
+        self._queue = None
+        self._tasks = []
+        self._avg_duration = 1.0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            loop = asyncio.get_running_loop()
+            # Los workers viven más que la petición que los arranca: sin su traza
+            self._tasks = [untraced(loop.create_task, self._worker()) for _ in range(self.workers)]
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def retry_after(self):
+        """Segundos estimados hasta que la cola tenga hueco"""
+        return max(1, int(self._avg_duration * max(self.depth, 1) / self.workers))
+
+    def is_full(self):
+        return self._queue is not None and self._queue.full()
+
+    def submit(self, payload):
+        self._ensure_started()
+        self._purge()
+        if self._queue.full():
+            raise JobQueueFull(self.retry_after())
+        job = Job(id=uuid.uuid4().hex, payload=payload)
+        self._queue.put_nowait(job)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _update(self, job, **fields):
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.updated_at = time.time()
+        snapshot = job.snapshot()
+        for listener in job.listeners:
+            listener.put_nowait(snapshot)
+
+    async def events(self, job):
+        """Generador de estados del trabajo hasta que termina"""
+        listener = asyncio.Queue()
+        job.listeners.append(listener)
+        try:
+            snapshot = job.snapshot()
+            yield snapshot
+            while snapshot["status"] not in FINAL_STATES:
+                snapshot = await listener.get()
+                yield snapshot
+        finally:
+            job.listeners.remove(listener)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            inicio = time.perf_counter()
+            self._update(job, status="running", stage="started", progress=5)
+
+            def report(stage, progress, job=job):
+                self._update(job, stage=stage, progress=progress)
+
+            try:
+                result = await self.handler(job, report)
+                self._update(job, status="done", stage="done", progress=100, result=result)
+            except Exception as e:
+                logger.error(f"❌ Error en el trabajo {job.id}: {e}")
+                detail = getattr(e, "detail", None) or str(e)
+                self._update(job, status="failed", stage="failed", error=detail)
+            finally:
+                job.payload = None
+                # Media móvil de la duración, para estimar Retry-After
+                self._avg_duration = 0.9 * self._avg_duration + 0.1 * (time.perf_counter() - inicio)
+                self._queue.task_done()
+
+    def _purge(self):
+        limite = time.time() - JOB_TTL_S
+        viejos = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.status in FINAL_STATES and job.updated_at < limite and not job.listeners
+        ]
+        for job_id in viejos:
+            del self.jobs[job_id]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            self._update(job, status="failed", stage="failed", error="El servidor se detuvo antes de procesar el trabajo")
+            if self.on_discard is not None:
+                await self.on_discard(job.payload)
+            job.payload = None
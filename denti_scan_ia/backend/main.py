@@ -1,16 +1,55 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import List, Optional
+import asyncio
+import json
 import os
+import re
+import uuid
 import logging
+import time
+
+import database_config
+from database_config import SCAN_LIST_MAX_LIMIT, ScanRecord, ensure_indexes, find_scans_by_ids, list_scans
+from scan_journal import JournalFlusher, ScanJournal
+from db_health import CONNECTION_ERRORS, CircuitBreaker, CircuitOpenError, MongoHealthMonitor, guarded
+from persistence import run_db, run_disk, shutdown_executors
+from upload_stream import MAX_UPLOAD_BYTES, UploadSizeLimitMiddleware, stream_upload_to_disk
+from idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyStore
+from image_store import ImageStore
+from ia_integration import AnalysisResult, InferenceEngine, summarize_results
+from inference_workers import INFERENCE_WORKERS, InferenceWorkerPool
+from jobs import JobManager, JobQueueFull
+from result_cache import RESULT_CACHE_COLLECTION, ResultCache, ensure_cache_indexes
+from thumbnails import ThumbnailCache, pick_width
+from compaction import CompactionJob, StorageCompactor
+from quality_gate import QUALITY_GATE, check_quality
+from scan_export import (
+    EXPORT_BATCH_SIZE, EXPORT_MAX_BATCH_SIZE, FORMATS as EXPORT_FORMATS, default_until, export_filter,
+    filename_for, make_writer, media_type_for, next_chunk, open_cursor, watermark
+)
+from perceptual_hash import (
+    SIMILAR_DEFAULT_DISTANCE, SIMILAR_MAX_DISTANCE, HammingIndex, SimilarityIndexSync, compute_hashes
+)
+import metrics
+from metrics import span
+from PIL import UnidentifiedImageError
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Importar main no conecta ni carga nada: todo arranca aquí, en segundo plano
+    await iniciar_recursos()
+    yield
+    await cerrar_recursos()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS configuration
 origins = [
@@ -29,23 +68,107 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
-# MongoDB connection
-MONGO_URI = "mongodb://localhost:27017/"
-MONGO_DB_NAME = "DentiScan-AI--Proyect"
+# Imágenes por petición en /analyze_dental_images (un control dental completo)
+MAX_IMAGES_PER_REQUEST = int(os.getenv("MAX_IMAGES_PER_REQUEST", "8"))
+
+# Cortar subidas demasiado grandes mientras se recibe el cuerpo, con o sin Content-Length.
+# Va por dentro de la idempotencia para que esta guarde el 413 y no el error de la app
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES,
+    limits_by_path={"/analyze_dental_images": MAX_UPLOAD_BYTES * MAX_IMAGES_PER_REQUEST},
+)
+
+# Los POST que registran escaneos aceptan Idempotency-Key: un reintento con la
+# misma clave recibe la respuesta original en lugar de crear otro registro
+RUTAS_IDEMPOTENTES = {"/registro", "/analyze_dental_image", "/analyze_dental_images", "/jobs/analyze_dental_image"}
+# Se crea en crear_almacenes(), al arrancar
+idempotency_store = None
+
+@app.middleware("http")
+async def aplicar_idempotencia(request: Request, call_next):
+    key = request.headers.get("idempotency-key")
+    if key is None or request.method != "POST" or request.url.path not in RUTAS_IDEMPOTENTES:
+        return await call_next(request)
+    if not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        return JSONResponse(status_code=400, content={"detail": "Idempotency-Key inválida"})
+    estado, guardada = await run_disk(idempotency_store.begin, key, f"POST {request.url.path}")
+    if estado == "replay":
+        return Response(
+            guardada.body, status_code=guardada.status_code, media_type=guardada.media_type,
+            headers={"Idempotent-Replayed": "true"},
+        )
+    if estado == "in_progress":
+        return JSONResponse(
+            status_code=409, content={"detail": "Una petición con esta Idempotency-Key está en curso"},
+            headers={"Retry-After": "1"},
+        )
+    if estado == "conflict":
+        return JSONResponse(status_code=422, content={"detail": "La Idempotency-Key ya se usó en otra ruta"})
+
+    try:
+        response = await call_next(request)
+        # Los errores transitorios no se guardan: el reintento vuelve a procesar la petición
+        if response.status_code >= 500 or response.status_code == 429:
+            await run_disk(idempotency_store.abandon, key)
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+    except BaseException:
+        await run_disk(idempotency_store.abandon, key)
+        raise
+    await run_disk(idempotency_store.complete, key, response.status_code, body, response.headers.get("content-type"))
+    return Response(body, status_code=response.status_code, headers=dict(response.headers))
+
+# Peticiones más lentas que esto se registran con el desglose por etapa
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+@app.middleware("http")
+async def trazar_peticion(request: Request, call_next):
+    """Duración por ruta, peticiones en curso y tiempos por etapa en Server-Timing"""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    token = metrics.start_trace()
+    inicio = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        duracion = time.perf_counter() - inicio
+        spans = metrics.end_trace(token)
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        # La plantilla de la ruta (/jobs/{job_id}) y no la URL, para no crear una serie por id
+        route = request.scope.get("route")
+        metrics.REQUEST_SECONDS.observe(
+            duracion, method=request.method, route=getattr(route, "path", "unmatched"), status=status
+        )
+    if spans:
+        response.headers["Server-Timing"] = metrics.server_timing(spans)
+    response.headers["X-Request-ID"] = request_id
+    if duracion * 1000 >= SLOW_REQUEST_MS:
+        logger.warning(
+            f"🐢 {request.method} {request.url.path} {duracion * 1000:.0f} ms [{request_id}] "
+            + (metrics.server_timing(spans) or "sin etapas")
+        )
+    return response
 
+# MongoDB connection: cliente compartido y pool configurados en database_config
 client = None
 db = None
 dental_scans_collection = None
 
-def connect_to_mongodb():
+def connect_to_mongodb(timeout_s=None):
     global client, db, dental_scans_collection
     try:
         logger.info("Intentando conectar a MongoDB...")
-        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        # Verificar conexión
-        client.admin.command('ping')
-        db = client[MONGO_DB_NAME]
-        dental_scans_collection = db["imagenes"]
+        with span("mongo_connect"):
+            client = database_config.get_client()
+            # Verificar conexión
+            database_config.ping(timeout_s=timeout_s)
+            db = database_config.get_db()
+            dental_scans_collection = database_config.scans_collection(db)
+            ensure_indexes(dental_scans_collection)
+            ensure_cache_indexes(db[RESULT_CACHE_COLLECTION])
         logger.info("✅ Conectado exitosamente a MongoDB")
         return True
     except Exception as e:
@@ -55,18 +178,389 @@ def connect_to_mongodb():
         dental_scans_collection = None
         return False
 
-# Intentar conectar al inicio
-connect_to_mongodb()
+# Estado de MongoDB: un monitor hace ping en segundo plano y, mientras la base
+# no responde, el breaker hace que las operaciones fallen al instante. La
+# primera conexión también la hace el monitor, al arrancar la aplicación
+db_breaker = CircuitBreaker()
+
+def verificar_mongodb(timeout_s):
+    """Ping con timeout corto; si aún no hay conexión, intenta conectar"""
+    if dental_scans_collection is None:
+        return connect_to_mongodb(timeout_s)
+    database_config.ping(timeout_s=timeout_s)
+    return True
+
+db_monitor = MongoHealthMonitor(verificar_mongodb, db_breaker)
+
+def mongodb_disponible():
+    # No gasta la prueba de half_open: eso lo hace guarded() al lanzar la operación
+    return dental_scans_collection is not None and db_breaker.available()
+
+# Los escaneos se escriben primero en un diario local y se envían a MongoDB
+# por lotes en segundo plano: la petición no espera a la base de datos y una
+# caída de MongoDB no pierde registros. El flusher no reconecta por su cuenta:
+# espera a que el monitor cierre el breaker. Ambos se crean en crear_almacenes()
+scan_journal = None
+scan_flusher = None
+
+# Índice en memoria de hashes perceptuales para buscar escaneos parecidos. Se
+# carga desde MongoDB en segundo plano y los escaneos nuevos entran al registrarse
+similarity_index = HammingIndex()
+similarity_sync = SimilarityIndexSync(
+    similarity_index,
+    lambda: dental_scans_collection if mongodb_disponible() else None,
+    breaker=db_breaker,
+)
+
+def indexar_similitud(record, scan_id):
+    if record.phash:
+        similarity_index.add(scan_id, record.phash, record.dhash, record.email)
+
+async def insertar_documento(record):
+    """Registrar un ScanRecord en el diario; devuelve el _id que tendrá en MongoDB"""
+    with span("journal_write"):
+        scan_id = await run_disk(scan_journal.append, record.to_document())
+    scan_flusher.notify()
+    indexar_similitud(record, scan_id)
+    return scan_id
+
+async def insertar_documentos(records):
+    """Varios ScanRecord en una sola escritura del diario (un insert_many en MongoDB)"""
+    with span("journal_write"):
+        scan_ids = await run_disk(scan_journal.append_many, [r.to_document() for r in records])
+    scan_flusher.notify()
+    for record, scan_id in zip(records, scan_ids):
+        indexar_similitud(record, scan_id)
+    return scan_ids
+
+# Almacén de imágenes por hash de contenido (se crea en crear_almacenes())
+image_store = None
+
+QUALITY_REJECTIONS = metrics.Counter(
+    "dentiscan_quality_rejections_total", "Fotos rechazadas por el control de calidad", ("reason",)
+)
+
+async def revisar_calidad(tmp_path, stored):
+    """422 con los motivos si la foto no sirve para el análisis"""
+    if await run_disk(image_store.exists, stored.sha256):
+        # Los mismos bytes ya pasaron el control
+        return
+    with span("quality_gate"):
+        calidad = await run_disk(check_quality, tmp_path, stored.mime_type)
+    if calidad.ok:
+        return
+    codigos = [motivo["code"] for motivo in calidad.reasons]
+    for codigo in codigos:
+        QUALITY_REJECTIONS.inc(reason=codigo)
+    logger.info(f"🚫 Foto rechazada por calidad: {', '.join(codigos)} ({calidad.elapsed_ms} ms)")
+    raise HTTPException(
+        status_code=422,
+        detail={"message": "La foto no sirve para el análisis", "reasons": calidad.reasons, "metrics": calidad.metrics},
+    )
+
+async def guardar_imagen(upload):
+    """
+    Guardar la subida en el almacén; los bytes repetidos se guardan una sola vez.
+    Las fotos que no pasan el control de calidad se rechazan antes de guardarlas.
+    """
+    tmp_path = image_store.new_temp_path()
+    try:
+        with span("upload_write"):
+            stored = await stream_upload_to_disk(upload, tmp_path)
+        if QUALITY_GATE:
+            await revisar_calidad(tmp_path, stored)
+        with span("store_commit"):
+            blob = await run_disk(image_store.commit, tmp_path, stored.sha256, stored.size, stored.mime_type)
+    finally:
+        # commit consume el temporal; si no se llegó a hacer (rechazo o error) no queda en uploads/tmp
+        await run_disk(image_store.discard_temp, tmp_path)
+    if blob.is_new:
+        logger.info(f"💾 Imagen guardada en: {blob.path} ({blob.size} bytes, {blob.mime_type})")
+    else:
+        logger.info(f"♻️ Imagen ya existente, se reutiliza: {blob.path}")
+    return blob
+
+async def calcular_hashes(blob):
+    """pHash y dHash de la imagen guardada; si no se pueden calcular el escaneo se registra sin ellos"""
+    try:
+        with span("perceptual_hash"):
+            return await run_disk(compute_hashes, blob.path)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo calcular el hash perceptual de {blob.sha256}: {e}")
+        return {}
+
+async def liberar_imagen(blob):
+    """Quitar la referencia de una imagen guardada que no llegó a registrarse en ningún escaneo"""
+    try:
+        await run_disk(image_store.release, blob.sha256)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo liberar la imagen {blob.sha256}: {e}")
+
+# Miniaturas generadas bajo demanda y guardadas en disco
+thumbnail_cache = None
+
+# Las imágenes antiguas se recodifican a WebP y las miniaturas se liberan si el
+# disco pasa de la cuota; la nueva ubicación se anota en MongoDB
+compaction_job = None
+
+def crear_almacenes():
+    """
+    Abrir (o crear) los almacenes en disco y lo que depende de ellos. Se hace al
+    arrancar y no al importar main: importar no debe crear uploads/ ni los SQLite
+    """
+    global image_store, scan_journal, scan_flusher, idempotency_store, thumbnail_cache, compaction_job
+    image_store = ImageStore()
+    scan_journal = ScanJournal()
+    idempotency_store = IdempotencyStore()
+    scan_flusher = JournalFlusher(
+        scan_journal,
+        lambda: dental_scans_collection if mongodb_disponible() else None,
+        breaker=db_breaker,
+    )
+    thumbnail_cache = ThumbnailCache(image_store)
+    compaction_job = CompactionJob(
+        StorageCompactor(image_store, thumbnail_cache),
+        lambda: dental_scans_collection if mongodb_disponible() else None,
+        breaker=db_breaker,
+    )
+
+# Motor de IA con micro-lotes; con INFERENCE_WORKERS > 0 el modelo corre en
+# procesos aparte y el event loop queda libre para /health y /registro
+inference_pool = InferenceWorkerPool() if INFERENCE_WORKERS > 0 else None
+engine = InferenceEngine(pool=inference_pool)
+
+# eager: el modelo se carga al arrancar y /readyz espera a que esté listo
+# lazy: se carga con el primer análisis (la réplica entra en rotación antes)
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "eager")
+# Sin MongoDB los escaneos van al diario, así que por defecto no bloquea /readyz
+READY_REQUIRES_MONGODB = os.getenv("READY_REQUIRES_MONGODB", "0") == "1"
+
+estado_app = {"started": False, "draining": False}
+tareas_arranque = []
+
+async def iniciar_recursos():
+    """
+    Arrancar MongoDB, el diario y el modelo a la vez y sin esperar a ninguno:
+    el servidor acepta conexiones de inmediato y /readyz indica cuándo enviarle tráfico
+    """
+    crear_almacenes()
+    db_monitor.start()
+    scan_flusher.start()
+    compaction_job.start()
+    similarity_sync.start()
+    if MODEL_WARMUP != "lazy":
+        tareas_arranque.append(asyncio.create_task(precargar_modelo()))
+    estado_app["started"] = True
+
+async def precargar_modelo():
+    try:
+        await engine.warm_up()
+    except Exception as e:
+        # /readyz sigue en 503; la siguiente petición de análisis lo reintenta
+        logger.error(f"❌ Error cargando el modelo de IA: {e}")
+
+# Resultados por hash de imagen y versión del modelo: las imágenes repetidas no
+# vuelven a pasar por el modelo
+result_cache = ResultCache(
+    lambda: db[RESULT_CACHE_COLLECTION] if db is not None and db_breaker.available() else None,
+    breaker=db_breaker,
+)
+
+async def analizar_imagen(blob):
+    """
+    Ejecutar el modelo o reutilizar un resultado en caché. Devuelve (AnalysisResult, desde_cache).
+    Las imágenes que no se pueden decodificar devuelven 422.
+    """
+    async def calcular():
+        try:
+            with span("inference"):
+                return (await engine.analyze(blob.path)).to_dict()
+        except (UnidentifiedImageError, OSError) as e:
+            raise HTTPException(status_code=422, detail=f"No se pudo leer la imagen: {e}")
+
+    version = engine.model_version
+    if version is None:
+        # El modelo aún no terminó de cargar: sin caché para esta petición
+        return AnalysisResult(**await calcular()), False
+    with span("analysis"):
+        value, cached = await result_cache.get_or_compute(blob.sha256, version, calcular)
+    return AnalysisResult(**value), cached
+
+async def ejecutar_trabajo(job, report):
+    p = job.payload
+    return await procesar_analisis(p["blob"], p["name"], p["email"], p["birthDate"], p["filename"], report)
+
+async def descartar_trabajo(payload):
+    await liberar_imagen(payload["blob"])
+
+# Cola de análisis en segundo plano para el modo por trabajos
+job_manager = JobManager(ejecutar_trabajo, on_discard=descartar_trabajo)
+
+def respuesta_cola_llena(retry_after):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Hay demasiados análisis en cola, intenta más tarde", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+async def cerrar_recursos():
+    estado_app["draining"] = True
+    for tarea in tareas_arranque:
+        tarea.cancel()
+    await compaction_job.close()
+    await similarity_sync.close()
+    await job_manager.close()
+    await engine.close()
+    await scan_flusher.close()
+    await db_monitor.close()
+    shutdown_executors()
+    database_config.close_clients()
 
 @app.get("/health")
 async def health_check():
-    mongodb_status = "connected" if client else "disconnected"
+    mongodb = db_monitor.status()
+    # Hasta el primer ping correcto (estado "unknown") MongoDB no cuenta como disponible
+    disponible = db_monitor.healthy is True and mongodb["breaker"]["state"] == "closed"
     return {
-        "status": "ok", 
-        "mongodb": mongodb_status,
+        "status": "ok" if disponible else "degraded",
+        "mongodb": "connected" if db_monitor.healthy else "disconnected",
+        "mongodb_health": mongodb,
+        "inference": await engine.health(),
+        "journal": await scan_flusher.stats(),
+        "similarity_index": similarity_sync.status(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/livez")
+async def liveness_probe():
+    """El proceso responde: no consulta dependencias, un fallo aquí significa reiniciar"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness_probe():
+    """Lista para recibir tráfico: arranque terminado, modelo cargado y, si se pide, MongoDB"""
+    checks = {
+        "started": estado_app["started"] and not estado_app["draining"],
+        "model": engine.ready or MODEL_WARMUP == "lazy",
+        "mongodb": bool(db_monitor.healthy) or not READY_REQUIRES_MONGODB,
+    }
+    listo = all(checks.values())
+    return JSONResponse(
+        status_code=200 if listo else 503,
+        content={
+            "status": "ready" if listo else "not_ready",
+            "checks": checks,
+            "model_version": engine.model_version,
+            "mongodb": "connected" if db_monitor.healthy else "disconnected",
+        },
+    )
+
+def registro_analisis(blob, name, email, birthDate, filename, analysis, checkup_id=None, hashes=None):
+    """Documento de MongoDB para una imagen analizada"""
+    hashes = hashes or {}
+    return ScanRecord(
+        name=name,
+        email=email,
+        birth_date=birthDate,
+        image_filename=filename,
+        file_path=blob.path,
+        content_hash=blob.sha256,
+        mime_type=blob.mime_type,
+        size_bytes=blob.size,
+        diagnosis=analysis.diagnosis,
+        confidence=analysis.confidence,
+        recommendations=analysis.recommendations,
+        model_version=analysis.model_version,
+        checkup_id=checkup_id,
+        phash=hashes.get("phash"),
+        dhash=hashes.get("dhash"),
+        status="processed"
+    )
+
+def resultado_imagen(blob, analysis, cached):
+    return {
+        "diagnosis": analysis.diagnosis,
+        "confidence": analysis.confidence,
+        "recommendations": analysis.recommendations,
+        "model_version": analysis.model_version,
+        "cached": cached,
+        "image_url": f"/images/{blob.sha256}",
+        "thumbnail_url": f"/images/{blob.sha256}/thumb?w=256"
+    }
+
+async def procesar_analisis(blob, name, email, birthDate, filename, report=lambda stage, progress: None):
+    """
+    Analizar una imagen ya guardada, registrar el escaneo y armar la respuesta.
+    Si falla antes de registrarse, se libera la referencia a la imagen.
+    """
+    try:
+        # Analizar la imagen con el modelo; el hash perceptual se calcula mientras tanto
+        report("analyzing", 30)
+        (analysis, cached), hashes = await asyncio.gather(analizar_imagen(blob), calcular_hashes(blob))
+        origen = "caché" if cached else "modelo"
+        logger.info(f"🤖 Diagnóstico ({origen}): {analysis.diagnosis} ({analysis.confidence:.2f})")
+
+        # Crear documento para MongoDB
+        patient_data = registro_analisis(blob, name, email, birthDate, filename, analysis, hashes=hashes)
+
+        # Registrar en el diario; el envío a MongoDB ocurre en segundo plano
+        report("saving", 80)
+        mongo_result = await insertar_documento(patient_data)
+    except BaseException:
+        await liberar_imagen(blob)
+        raise
+    logger.info(f"📝 Escaneo registrado con ID: {mongo_result}")
+
+    # Respuesta con el resultado del modelo de IA
+    response_data = {
+        "status": "success",
+        "message": "Imagen procesada correctamente",
+        "data": {
+            "patient_name": name,
+            "analysis_id": mongo_result,
+            "mongodb_status": "connected" if db_monitor.healthy else "queued",
+            **resultado_imagen(blob, analysis, cached)
+        }
+    }
+    return response_data
+
+def error_imagen(filename, error):
+    if isinstance(error, HTTPException):
+        return {"filename": filename, "status_code": error.status_code, "error": error.detail}
+    return {"filename": filename, "status_code": 500, "error": str(error)}
+
+# Profundidad de colas y contadores que ya llevan los demás módulos
+metrics.Gauge("dentiscan_job_queue_depth", "Trabajos de análisis en cola", fn=lambda: job_manager.depth)
+metrics.Gauge("dentiscan_inference_queue_depth", "Imágenes esperando lote de inferencia", fn=lambda: engine.batcher.pending)
+JOURNAL_PENDING = metrics.Gauge("dentiscan_journal_pending", "Escaneos en el diario pendientes de MongoDB", ("state",))
+metrics.Gauge("dentiscan_db_up", "1 si el último ping a MongoDB respondió", fn=lambda: int(bool(db_monitor.healthy)))
+metrics.Gauge(
+    "dentiscan_db_breaker_state", "Estado del circuit breaker de MongoDB", ("state",),
+    fn=lambda: {st: int(db_breaker.state == st) for st in ("closed", "open", "half_open")}
+)
+metrics.Counter("dentiscan_journal_events_total", "Actividad del flusher del diario", ("event",),
+                fn=lambda: dict(scan_flusher.counters))
+metrics.Counter("dentiscan_result_cache_events_total", "Aciertos y fallos de la caché de resultados", ("event",),
+                fn=lambda: dict(result_cache.counters))
+metrics.Counter("dentiscan_inference_images_total", "Imágenes analizadas por el modelo", fn=lambda: engine.images)
+metrics.Counter("dentiscan_inference_batches_total", "Lotes ejecutados por el modelo", fn=lambda: engine.batches)
+metrics.Gauge("dentiscan_similarity_index_size", "Escaneos en el índice de hashes perceptuales",
+              fn=lambda: len(similarity_index))
+metrics.Counter("dentiscan_compaction_events_total", "Resultados de la compactación del almacén", ("event",),
+                fn=lambda: dict(compaction_job.counters))
+
+@app.get("/metrics")
+async def exponer_metricas():
+    """Métricas en formato de texto de Prometheus"""
+    depth = await run_disk(scan_journal.depth)
+    JOURNAL_PENDING.set(depth["pending"], state="pending")
+    JOURNAL_PENDING.set(depth["dead"], state="dead")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def estadisticas_cache():
+    return result_cache.stats()
+
 @app.post("/analyze_dental_image")
 async def analyze_dental_image(
     dentalImage: UploadFile = File(...),
@@ -81,74 +575,401 @@ async def analyze_dental_image(
         logger.info(f"📝 Recibiendo datos - Nombre: {name}, Email: {email}, Fecha de Nacimiento: {birthDate}")
         logger.info(f"📁 Archivo recibido: {dentalImage.filename}, tipo: {dentalImage.content_type}")
 
-        # Leer el contenido de la imagen
-        image_data = await dentalImage.read()
-        
-        # Crear un nombre único para el archivo
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{name.replace(' ', '_')}_{timestamp}_{dentalImage.filename}"
-        
-        # Guardar la imagen en el sistema de archivos
-        os.makedirs("uploads", exist_ok=True)
-        file_path = os.path.join("uploads", filename)
-        with open(file_path, "wb") as f:
-            f.write(image_data)
-        logger.info(f"💾 Imagen guardada en: {file_path}")
-
-        # Crear documento para MongoDB
-        patient_data = {
-            "name": name,
-            "email": email,
-            "birth_date": birthDate,
-            "image_filename": filename,
-            "file_path": file_path,
-            "upload_date": datetime.now(),
-            "status": "processed"
-        }
-
-        # Intentar insertar en MongoDB
-        mongo_result = None
-        if client is not None and dental_scans_collection is not None:
-            try:
-                result = dental_scans_collection.insert_one(patient_data)
-                mongo_result = str(result.inserted_id)
-                logger.info(f"✅ Datos guardados en MongoDB con ID: {mongo_result}")
-            except Exception as mongo_error:
-                logger.error(f"❌ Error al guardar en MongoDB: {mongo_error}")
-                # Intentar reconectar
-                if connect_to_mongodb():
-                    try:
-                        result = dental_scans_collection.insert_one(patient_data)
-                        mongo_result = str(result.inserted_id)
-                        logger.info(f"✅ Datos guardados en MongoDB después de reconectar: {mongo_result}")
-                    except Exception as retry_error:
-                        logger.error(f"❌ Error al guardar después de reconectar: {retry_error}")
-        else:
-            logger.warning("⚠️ No se pudo conectar a MongoDB - los datos no se guardaron")
-
-        # Simular respuesta del modelo de IA
-        response_data = {
-            "status": "success",
-            "message": "Imagen procesada correctamente",
-            "data": {
-                "patient_name": name,
-                "analysis_id": mongo_result if mongo_result else "none",
-                "mongodb_status": "connected" if mongo_result else "disconnected",
-                "diagnosis": "Caries detectada",
-                "confidence": 0.92,
-                "recommendations": [
-                    "Visita a un odontólogo en los próximos 7 días",
-                    "Realiza una limpieza dental profesional"
-                ]
-            }
-        }
+        # Guardar la imagen en el almacén por contenido
+        blob = await guardar_imagen(dentalImage)
 
+        response_data = await procesar_analisis(blob, name, email, birthDate, dentalImage.filename)
         return JSONResponse(content=response_data)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error al procesar la solicitud: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze_dental_images")
+async def analyze_dental_images(
+    dentalImages: List[UploadFile] = File(...),
+    name: str = Form(...),
+    email: str = Form(...),
+    birthDate: str = Form(...)
+):
+    """
+    Varias imágenes de un mismo control en una petición. Se guardan y analizan
+    en paralelo (el motor las agrupa en micro-lotes), se registran con una sola
+    escritura y se devuelve el resultado de cada una más un resumen del paciente.
+    """
+    if len(dentalImages) > MAX_IMAGES_PER_REQUEST:
+        raise HTTPException(
+            status_code=413, detail=f"Máximo {MAX_IMAGES_PER_REQUEST} imágenes por petición"
+        )
+    logger.info(f"📝 Control de {name} ({email}): {len(dentalImages)} imágenes")
+    checkup_id = uuid.uuid4().hex
+
+    blobs = await asyncio.gather(*(guardar_imagen(f) for f in dentalImages), return_exceptions=True)
+    guardados = [i for i, b in enumerate(blobs) if not isinstance(b, BaseException)]
+    # Imágenes guardadas que aún no pertenecen a ningún escaneo: se liberan si fallan
+    sin_registrar = set(guardados)
+    try:
+        analisis, hashes = await asyncio.gather(
+            asyncio.gather(*(analizar_imagen(blobs[i]) for i in guardados), return_exceptions=True),
+            asyncio.gather(*(calcular_hashes(blobs[i]) for i in guardados)),
+        )
+        hashes = dict(zip(guardados, hashes))
+
+        imagenes = [None] * len(dentalImages)
+        for i, b in enumerate(blobs):
+            if isinstance(b, BaseException):
+                imagenes[i] = error_imagen(dentalImages[i].filename, b)
+        exitosos = []
+        for i, a in zip(guardados, analisis):
+            if isinstance(a, BaseException):
+                imagenes[i] = error_imagen(dentalImages[i].filename, a)
+                sin_registrar.discard(i)
+                await liberar_imagen(blobs[i])
+            else:
+                exitosos.append((i, *a))
+
+        if not exitosos:
+            raise HTTPException(status_code=422, detail={"message": "No se pudo analizar ninguna imagen", "images": imagenes})
+
+        records = [
+            registro_analisis(blobs[i], name, email, birthDate, dentalImages[i].filename, analysis, checkup_id, hashes[i])
+            for i, analysis, _ in exitosos
+        ]
+        scan_ids = await insertar_documentos(records)
+    except BaseException:
+        await asyncio.gather(*(liberar_imagen(blobs[i]) for i in sin_registrar))
+        raise
+    for (i, analysis, cached), scan_id in zip(exitosos, scan_ids):
+        imagenes[i] = {
+            "filename": dentalImages[i].filename,
+            "analysis_id": scan_id,
+            **resultado_imagen(blobs[i], analysis, cached)
+        }
+
+    summary = summarize_results([analysis for _, analysis, _ in exitosos])
+    summary.update(images_total=len(dentalImages), images_analyzed=len(exitosos),
+                   images_failed=len(dentalImages) - len(exitosos))
+    logger.info(f"🤖 Control {checkup_id}: {summary['diagnosis']} ({summary['images_analyzed']}/{summary['images_total']} imágenes)")
+    return {
+        "status": "success",
+        "message": "Imágenes procesadas correctamente",
+        "data": {
+            "patient_name": name,
+            "checkup_id": checkup_id,
+            "mongodb_status": "connected" if db_monitor.healthy else "queued",
+            "images": imagenes,
+            "summary": summary
+        }
+    }
+
+@app.post("/jobs/analyze_dental_image", status_code=202)
+async def crear_trabajo_analisis(
+    dentalImage: UploadFile = File(...),
+    name: str = Form(...),
+    email: str = Form(...),
+    birthDate: str = Form(...)
+):
+    """
+    Guarda la imagen y encola el análisis; responde enseguida con el id del trabajo.
+    """
+    # Rechazar antes de escribir nada si la cola ya está llena
+    if job_manager.is_full():
+        return respuesta_cola_llena(job_manager.retry_after())
+
+    blob = await guardar_imagen(dentalImage)
+    try:
+        job = job_manager.submit({
+            "blob": blob,
+            "name": name,
+            "email": email,
+            "birthDate": birthDate,
+            "filename": dentalImage.filename
+        })
+    except JobQueueFull as e:
+        await liberar_imagen(blob)
+        return respuesta_cola_llena(e.retry_after)
+
+    logger.info(f"📥 Trabajo {job.id} encolado ({job_manager.depth} en cola)")
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+@app.get("/jobs/{job_id}")
+async def estado_trabajo(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job.snapshot()
+
+@app.get("/jobs/{job_id}/events")
+async def eventos_trabajo(job_id: str):
+    """Progreso del trabajo como Server-Sent Events"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    async def stream():
+        async for snapshot in job_manager.events(job):
+            yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+# El contenido de una URL por hash nunca cambia: el navegador puede guardarlo para siempre
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+def etag_coincide(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+
+async def buscar_blob(content_hash):
+    """(ruta, tipo MIME) de la imagen en el almacén: el original o su versión compactada"""
+    if not SHA256_RE.match(content_hash):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    ubicacion = await run_disk(image_store.locate, content_hash)
+    if ubicacion is None:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    return ubicacion
+
+@app.get("/images/{content_hash}")
+async def obtener_imagen(content_hash: str, request: Request):
+    """
+    Imagen original. FileResponse usa sendfile cuando el servidor lo soporta
+    y responde a cabeceras Range con 206.
+    """
+    path, mime_type = await buscar_blob(content_hash)
+    # Tras la compactación los bytes son otros (WebP): otro ETag
+    etag = f'"{content_hash}"' if path == image_store.blob_path(content_hash) else f'"{content_hash}-compact"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE}
+    if etag_coincide(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        path,
+        media_type=mime_type or "application/octet-stream",
+        headers=headers,
+    )
+
+@app.get("/images/{content_hash}/thumb")
+async def obtener_miniatura(content_hash: str, request: Request, w: int = Query(256, ge=16, le=4096)):
+    """Miniatura JPEG; el ancho se redondea a uno de THUMB_WIDTHS"""
+    await buscar_blob(content_hash)
+    width = pick_width(w)
+    etag = f'"{content_hash}-w{width}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE}
+    if etag_coincide(request, etag):
+        return Response(status_code=304, headers=headers)
+    try:
+        data = await thumbnail_cache.get(content_hash, width)
+    except (UnidentifiedImageError, OSError) as e:
+        raise HTTPException(status_code=422, detail=f"No se pudo generar la miniatura: {e}")
+    return Response(data, media_type="image/jpeg", headers=headers)
+
+def escaneo_a_json(documento):
+    documento["id"] = str(documento.pop("_id"))
+    documento["upload_date"] = documento["upload_date"].isoformat()
+    if documento.get("content_hash"):
+        documento["image_url"] = f"/images/{documento['content_hash']}"
+        documento["thumbnail_url"] = f"/images/{documento['content_hash']}/thumb?w=256"
+    return documento
+
+async def consultar_escaneos(**filtros):
+    if dental_scans_collection is None:
+        raise HTTPException(status_code=503, detail="MongoDB no está disponible")
+    try:
+        documentos, siguiente = await guarded(db_breaker, list_scans, dental_scans_collection, **filtros)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503, detail="MongoDB no está disponible", headers={"Retry-After": str(e.retry_after)}
+        )
+    except CONNECTION_ERRORS as e:
+        raise HTTPException(status_code=503, detail=f"MongoDB no respondió: {e}")
+    return {"items": [escaneo_a_json(d) for d in documentos], "next_cursor": siguiente}
+
+@app.get("/scans")
+async def listar_escaneos(
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=SCAN_LIST_MAX_LIMIT)
+):
+    """
+    Escaneos del más reciente al más antiguo. Para la página siguiente se pasa
+    el next_cursor de la respuesta anterior.
+    """
+    return await consultar_escaneos(
+        status=status, date_from=date_from, date_to=date_to, cursor=cursor, limit=limit
+    )
+
+@app.get("/patients/{email}/scans")
+async def listar_escaneos_paciente(
+    email: str,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=SCAN_LIST_MAX_LIMIT)
+):
+    return await consultar_escaneos(
+        email=email, status=status, date_from=date_from, date_to=date_to, cursor=cursor, limit=limit
+    )
+
+def escaneos_parecidos(phash, dhash, max_distance, email, limit, exclude=None):
+    inicio = time.perf_counter()
+    with span("similarity_search"):
+        encontrados = similarity_index.search(
+            phash, max_distance, email=email, limit=limit, exclude=exclude, dhash=dhash
+        )
+    return encontrados, round((time.perf_counter() - inicio) * 1000, 3)
+
+async def respuesta_similares(consulta, encontrados, elapsed_ms):
+    """Completar los resultados con los datos del escaneo; sin MongoDB se devuelven solo ids y distancias"""
+    documentos = {}
+    if encontrados and mongodb_disponible():
+        try:
+            documentos = await guarded(db_breaker, find_scans_by_ids, [e[0] for e in encontrados], dental_scans_collection)
+        except (CircuitOpenError, *CONNECTION_ERRORS) as e:
+            logger.warning(f"⚠️ Escaneos parecidos sin detalles: {e}")
+    items = []
+    for scan_id, distancia, distancia_dhash in encontrados:
+        documento = documentos.get(scan_id)
+        item = escaneo_a_json(documento) if documento is not None else {"id": scan_id}
+        item.update(distance=distancia, dhash_distance=distancia_dhash)
+        items.append(item)
+    return {
+        "query": consulta,
+        "index": similarity_sync.status(),
+        "items": items,
+        "search_ms": elapsed_ms,
+    }
+
+@app.get("/scans/{scan_id}/similar")
+async def escaneos_similares(
+    scan_id: str,
+    max_distance: int = Query(SIMILAR_DEFAULT_DISTANCE, ge=0, le=SIMILAR_MAX_DISTANCE),
+    email: Optional[str] = None,
+    same_patient: bool = False,
+    limit: int = Query(20, ge=1, le=SCAN_LIST_MAX_LIMIT)
+):
+    """
+    Escaneos cuya imagen se parece a la de scan_id: distancia de Hamming entre
+    pHash de 64 bits (0 = misma imagen, hasta ~10 = recompresión o recorte leve).
+    Con same_patient se buscan solo los escaneos anteriores del mismo paciente.
+    """
+    hashes = similarity_index.hashes_of(scan_id)
+    paciente = None
+    if hashes is None or same_patient:
+        if not mongodb_disponible():
+            raise HTTPException(status_code=503, detail="MongoDB no está disponible")
+        try:
+            documento = (await guarded(db_breaker, find_scans_by_ids, [scan_id], dental_scans_collection)).get(scan_id)
+        except (CircuitOpenError, *CONNECTION_ERRORS) as e:
+            raise HTTPException(status_code=503, detail=f"MongoDB no respondió: {e}")
+        if documento is None:
+            raise HTTPException(status_code=404, detail="Escaneo no encontrado")
+        paciente = documento.get("email")
+        if hashes is None:
+            if "phash" not in documento:
+                raise HTTPException(status_code=409, detail="El escaneo no tiene hash perceptual todavía")
+            hashes = (int(documento["phash"], 16), int(documento.get("dhash", "0"), 16))
+    if same_patient:
+        email = paciente
+    encontrados, elapsed_ms = escaneos_parecidos(*hashes, max_distance, email, limit, exclude=scan_id)
+    consulta = {"scan_id": scan_id, "phash": f"{hashes[0]:016x}", "max_distance": max_distance, "email": email}
+    return await respuesta_similares(consulta, encontrados, elapsed_ms)
+
+@app.post("/scans/similar")
+async def buscar_por_imagen(
+    image: UploadFile = File(...),
+    max_distance: int = Form(SIMILAR_DEFAULT_DISTANCE),
+    email: Optional[str] = Form(None),
+    limit: int = Form(20)
+):
+    """Escaneos parecidos a una imagen subida; la imagen no se guarda"""
+    if not 0 <= max_distance <= SIMILAR_MAX_DISTANCE:
+        raise HTTPException(status_code=400, detail=f"max_distance debe estar entre 0 y {SIMILAR_MAX_DISTANCE}")
+    contenido = await image.read(MAX_UPLOAD_BYTES + 1)
+    if len(contenido) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"La imagen supera {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    try:
+        with span("perceptual_hash"):
+            campos = await run_disk(compute_hashes, contenido)
+    except (UnidentifiedImageError, OSError) as e:
+        raise HTTPException(status_code=422, detail=f"No se pudo leer la imagen: {e}")
+    encontrados, elapsed_ms = escaneos_parecidos(
+        campos["phash"], campos["dhash"], max_distance, email, max(1, min(limit, SCAN_LIST_MAX_LIMIT))
+    )
+    consulta = {**campos, "max_distance": max_distance, "email": email}
+    return await respuesta_similares(consulta, encontrados, elapsed_ms)
+
+@app.get("/export/scans")
+async def exportar_escaneos(
+    format: str = Query("ndjson", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    email: Optional[str] = None,
+    status: Optional[str] = None,
+    gzip: bool = False,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=EXPORT_MAX_BATCH_SIZE)
+):
+    """
+    Escaneos y diagnósticos en NDJSON, CSV o Parquet, enviados por lotes desde
+    un cursor de MongoDB. Para exportaciones incrementales se pasa como since
+    el X-Export-Until de la exportación anterior.
+    """
+    if not mongodb_disponible():
+        raise HTTPException(status_code=503, detail="MongoDB no está disponible")
+    try:
+        writer = make_writer(format, gzip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    since, until = watermark(since), watermark(until) or default_until()
+    cursor = open_cursor(dental_scans_collection, export_filter(since, until, email, status), batch_size)
+
+    async def stream():
+        total = 0
+        inicio = time.perf_counter()
+        try:
+            yield writer.header()
+            while True:
+                n, datos = await guarded(db_breaker, next_chunk, cursor, writer, batch_size)
+                if not n:
+                    break
+                total += n
+                if datos:
+                    yield datos
+            yield await run_db(writer.close)
+            logger.info(f"📦 Exportación {format}: {total} escaneos en {time.perf_counter() - inicio:.1f}s")
+        except Exception as e:
+            # Los encabezados ya se enviaron: el cliente recibe un archivo cortado
+            logger.error(f"❌ Exportación interrumpida tras {total} escaneos: {e}")
+            raise
+        finally:
+            await run_db(cursor.close)
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename_for(format, gzip, until)}"',
+        "X-Export-Until": until.isoformat(),
+    }
+    if since is not None:
+        headers["X-Export-Since"] = since.isoformat()
+    return StreamingResponse(stream(), media_type=media_type_for(format, gzip), headers=headers)
+
 @app.get("/")
 def read_root():
     return {"message": "DentiScan IA Backend funcionando"}
@@ -164,69 +985,51 @@ async def registro(
     try:
         logger.info(f"📝 Registro - Nombre: {nombre} {apellido}, Email: {email}, Fecha: {fecha_nacimiento}")
         
-        image_bytes = await imagen.read()
-        image_filename = f"{nombre}{apellido}{datetime.now().strftime('%Y%m%d_%H%M%S')}_{imagen.filename}"
-        
-        # Guardar la imagen en el sistema de archivos
-        os.makedirs("uploads", exist_ok=True)
-        file_path = os.path.join("uploads", image_filename)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
-        logger.info(f"💾 Imagen guardada en: {file_path}")
+        image_filename = imagen.filename
 
-        # Crear documento para MongoDB
-        patient_data = {
-            "nombre": nombre,
-            "apellido": apellido,
-            "email": email,
-            "fecha_nacimiento": fecha_nacimiento,
-            "image_filename": image_filename,
-            "file_path": file_path,
-            "fecha": datetime.now(),
-            "status": "registered"
-        }
+        # Guardar la imagen en el almacén por contenido
+        blob = await guardar_imagen(imagen)
+        try:
+            hashes = await calcular_hashes(blob)
+
+            # Crear documento para MongoDB
+            patient_data = ScanRecord(
+                name=f"{nombre} {apellido}".strip(),
+                first_name=nombre,
+                last_name=apellido,
+                email=email,
+                birth_date=fecha_nacimiento,
+                image_filename=image_filename,
+                file_path=blob.path,
+                content_hash=blob.sha256,
+                mime_type=blob.mime_type,
+                size_bytes=blob.size,
+                phash=hashes.get("phash"),
+                dhash=hashes.get("dhash"),
+                status="registered"
+            )
 
-        # Intentar insertar en MongoDB
-        mongo_result = None
-        if client is not None and dental_scans_collection is not None:
-            try:
-                result = dental_scans_collection.insert_one(patient_data)
-                mongo_result = str(result.inserted_id)
-                logger.info(f"✅ Registro guardado en MongoDB con ID: {mongo_result}")
-            except Exception as mongo_error:
-                logger.error(f"❌ Error al guardar registro en MongoDB: {mongo_error}")
-                # Intentar reconectar
-                if connect_to_mongodb():
-                    try:
-                        result = dental_scans_collection.insert_one(patient_data)
-                        mongo_result = str(result.inserted_id)
-                        logger.info(f"✅ Registro guardado en MongoDB después de reconectar: {mongo_result}")
-                    except Exception as retry_error:
-                        logger.error(f"❌ Error al guardar registro después de reconectar: {retry_error}")
-        else:
-            logger.warning("⚠️ No se pudo conectar a MongoDB - el registro no se guardó")
-
-        if mongo_result:
-            return {
-                "status": "ok", 
-                "nombre": nombre, 
-                "apellido": apellido, 
-                "email": email, 
-                "fecha_nacimiento": fecha_nacimiento, 
-                "filename": image_filename,
-                "mongodb_id": mongo_result
-            }
-        else:
-            return {
-                "status": "error", 
-                "message": "No se pudo conectar a MongoDB",
-                "nombre": nombre, 
-                "apellido": apellido, 
-                "email": email, 
-                "fecha_nacimiento": fecha_nacimiento, 
-                "filename": image_filename
-            }
+            # Registrar en el diario; el envío a MongoDB ocurre en segundo plano
+            mongo_result = await insertar_documento(patient_data)
+        except BaseException:
+            await liberar_imagen(blob)
+            raise
+        logger.info(f"📝 Registro guardado con ID: {mongo_result}")
+
+        return {
+            "status": "ok", 
+            "nombre": nombre, 
+            "apellido": apellido, 
+            "email": email, 
+            "fecha_nacimiento": fecha_nacimiento, 
+            "filename": image_filename,
+            "content_hash": blob.sha256,
+            "mongodb_id": mongo_result,
+            "mongodb_status": "connected" if db_monitor.healthy else "queued"
+        }
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error en el registro: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
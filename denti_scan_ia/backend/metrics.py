@@ -0,0 +1,185 @@
+# metrics.py
+# Métricas en formato de texto de Prometheus y tiempos por etapa de cada petición
+#
+# Sin dependencias externas: contadores, gauges e histogramas acumulados en
+# memoria y renderizados en /metrics. Los percentiles p50/p95/p99 se calculan
+# en Prometheus con histogram_quantile() sobre los buckets.
+#
+# span("etapa") mide un bloque de código: siempre alimenta el histograma
+# dentiscan_stage_seconds y, si hay una petición en curso, también su traza
+# (que el middleware devuelve en la cabecera Server-Timing). Las tareas de
+# fondo se crean con untraced() para no heredar la traza de la petición que
+# las arrancó.
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    """
+    Base de contadores y gauges. Con fn el valor se lee en cada scrape:
+    fn devuelve un número o un dict {valor_de_etiqueta: número}, útil para
+    exponer contadores que ya llevan otros módulos.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        values = dict(self._values)
+        if self.fn is not None:
+            try:
+                result = self.fn()
+            except Exception:
+                result = None
+            if isinstance(result, dict):
+                values.update({k if isinstance(k, tuple) else (k,): v for k, v in result.items()})
+            elif result is not None:
+                values[()] = result
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if value <= limite:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1], v[2]) for k, v in self._values.items()}
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            acumulado = 0
+            for limite, c in zip(self.buckets, counts):
+                acumulado += c
+                lines.append(f"{self.name}_bucket{_label_str(self.labels + ('le',), key + (limite,))} {acumulado}")
+            lines.append(f"{self.name}_bucket{_label_str(self.labels + ('le',), key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {count}")
+        return lines
+
+
+def render():
+    """Todas las métricas en formato de exposición de texto"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "dentiscan_http_request_duration_seconds", "Duración de las peticiones HTTP", ("method", "route", "status")
+)
+REQUESTS_IN_FLIGHT = Gauge("dentiscan_http_requests_in_flight", "Peticiones HTTP en curso")
+STAGE_SECONDS = Histogram("dentiscan_stage_seconds", "Duración de cada etapa del procesamiento", ("stage",))
+DB_ERRORS = Counter("dentiscan_db_errors_total", "Errores de MongoDB por operación", ("operation",))
+
+
+class _Trace(list):
+    """Etapas de una petición; cerrada deja de aceptar etapas"""
+    ended = False
+
+
+def start_trace():
+    """Abrir la traza de la petición actual; devuelve el token para end_trace"""
+    return _trace.set(_Trace())
+
+
+def end_trace(token):
+    spans = _trace.get()
+    _trace.reset(token)
+    if spans is None:
+        return []
+    spans.ended = True
+    return list(spans)
+
+
+def untraced(fn, *args):
+    """Ejecutar fn(*args) en un contexto vacío: las tareas que cree no heredan la traza actual"""
+    return contextvars.Context().run(fn, *args)
+
+
+@contextmanager
+def span(stage):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        STAGE_SECONDS.observe(duracion, stage=stage)
+        spans = _trace.get()
+        if spans is not None and not spans.ended:
+            spans.append((stage, duracion))
+
+
+def server_timing(spans):
+    """Valor de la cabecera Server-Timing (milisegundos por etapa)"""
+    return ", ".join(f"{stage};dur={duracion * 1000:.1f}" for stage, duracion in spans)
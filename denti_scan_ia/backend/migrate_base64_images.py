@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Migra los documentos de 'imagenes' que guardan la imagen como texto base64
+al almacenamiento binario (BSON Binary o GridFS).
+
+Procesa por lotes ordenados por _id, así que se puede interrumpir y volver a
+lanzar: los documentos ya migrados no vuelven a aparecer en la consulta.
+
+Uso:
+    python migrate_base64_images.py --batch-size 200
+    python migrate_base64_images.py --dry-run
+"""
+
+import argparse
+import base64
+import contextlib
+import time
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from database_config import MONGO_DB_NAME, MONGO_URI, SCANS_COLLECTION, get_client
+from mongo_image_storage import MongoImageStorage
+
+PENDIENTES = {"imagen": {"$type": "string"}}
+
+
+def borrar_huerfanos(coleccion, storage, subidos):
+    """
+    Borrar de GridFS los archivos subidos para documentos cuya actualización no
+    se aplicó (otro proceso los migró antes). subidos: {_id: imagen_file_id}
+    """
+    usados = {
+        doc["_id"]: doc.get("imagen_file_id")
+        for doc in coleccion.find({"_id": {"$in": list(subidos)}}, {"imagen_file_id": 1})
+    }
+    huerfanos = [file_id for doc_id, file_id in subidos.items() if usados.get(doc_id) != file_id]
+    for file_id in huerfanos:
+        storage.bucket.delete(file_id)
+    return len(huerfanos)
+
+
+def migrar(coleccion, storage, batch_size=200, dry_run=False):
+    total = coleccion.count_documents(PENDIENTES)
+    print(f"🔍 Documentos con imagen en base64: {total}")
+    if dry_run or total == 0:
+        return 0
+
+    migrados = 0
+    ultimo_id = None
+    inicio = time.perf_counter()
+    while True:
+        filtro = dict(PENDIENTES)
+        if ultimo_id is not None:
+            filtro["_id"] = {"$gt": ultimo_id}
+        lote = list(
+            coleccion.find(filtro, {"_id": 1, "nombre": 1, "imagen": 1}).sort("_id", 1).limit(batch_size)
+        )
+        if not lote:
+            break
+
+        operaciones = []
+        subidos = {}
+        try:
+            for doc in lote:
+                try:
+                    data = base64.b64decode(doc["imagen"])
+                except (ValueError, TypeError) as e:
+                    print(f"⚠️ {doc['_id']}: base64 inválido, se omite ({e})")
+                    continue
+                campos = storage.put(data, doc.get("nombre") or str(doc["_id"]), {"documento_id": doc["_id"]})
+                if campos["imagen_storage"] == "gridfs":
+                    subidos[doc["_id"]] = campos["imagen_file_id"]
+                # La condición sobre 'imagen' evita pisar un documento migrado por otro proceso
+                operaciones.append(
+                    UpdateOne({"_id": doc["_id"], **PENDIENTES}, {"$set": campos, "$unset": {"imagen": ""}})
+                )
+
+            if operaciones:
+                try:
+                    result = coleccion.bulk_write(operaciones, ordered=False)
+                    migrados += result.modified_count
+                except BulkWriteError as e:
+                    migrados += e.details.get("nModified", 0)
+                    print(f"⚠️ {len(e.details.get('writeErrors', []))} documentos no se pudieron actualizar")
+        except BaseException:
+            # Interrumpida a mitad de lote: lo subido a GridFS sin documento que lo use se borra antes de salir
+            if subidos:
+                with contextlib.suppress(PyMongoError):
+                    borrar_huerfanos(coleccion, storage, subidos)
+            raise
+        if subidos:
+            huerfanos = borrar_huerfanos(coleccion, storage, subidos)
+            if huerfanos:
+                print(f"   {huerfanos} archivos de GridFS descartados: otro proceso ya había migrado esos documentos")
+        ultimo_id = lote[-1]["_id"]
+        ritmo = migrados / max(time.perf_counter() - inicio, 1e-6)
+        print(f"   {migrados}/{total} migrados ({ritmo:.0f} docs/s)")
+
+    print(f"✅ Migración terminada: {migrados} documentos")
+    return migrados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=MONGO_DB_NAME)
+    parser.add_argument("--collection", default=SCANS_COLLECTION)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="solo contar los documentos pendientes")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    try:
+        db = client[args.db]
+        migrar(db[args.collection], MongoImageStorage(db), args.batch_size, args.dry_run)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
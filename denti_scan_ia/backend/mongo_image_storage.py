@@ -0,0 +1,61 @@
+# mongo_image_storage.py
+# Imágenes en MongoDB como bytes, no como texto base64
+#
+# Las imágenes pequeñas van dentro del documento como BSON Binary; las grandes
+# se guardan en GridFS (trozos de 255 KB) y el documento solo lleva el id.
+# En ambos casos la lectura se hace por bloques.
+import base64
+import os
+from io import BytesIO
+
+from bson import Binary
+from gridfs import GridFSBucket
+
+IMAGE_INLINE_MAX_BYTES = int(os.getenv("IMAGE_INLINE_MAX_BYTES", str(256 * 1024)))
+IMAGE_BUCKET = os.getenv("IMAGE_BUCKET", "imagenes_fs")
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class MongoImageStorage:
+    def __init__(self, db, bucket_name=IMAGE_BUCKET, inline_max_bytes=IMAGE_INLINE_MAX_BYTES):
+        self.db = db
+        self.bucket = GridFSBucket(db, bucket_name=bucket_name)
+        self.inline_max_bytes = inline_max_bytes
+
+    def put(self, data, filename, metadata=None):
+        """
+        Guardar los bytes de una imagen. Devuelve los campos que hay que añadir
+        al documento de la colección 'imagenes'.
+        """
+        if len(data) <= self.inline_max_bytes:
+            return {"imagen_storage": "binary", "imagen_bin": Binary(bytes(data)), "imagen_size": len(data)}
+        file_id = self.bucket.upload_from_stream(filename, BytesIO(data), metadata=metadata or {})
+        return {"imagen_storage": "gridfs", "imagen_file_id": file_id, "imagen_size": len(data)}
+
+    def put_stream(self, stream, filename, metadata=None):
+        """Subir a GridFS desde un archivo abierto, sin cargarlo entero en memoria"""
+        inicio = stream.tell()
+        file_id = self.bucket.upload_from_stream(filename, stream, metadata=metadata or {})
+        return {"imagen_storage": "gridfs", "imagen_file_id": file_id, "imagen_size": stream.tell() - inicio}
+
+    def open(self, documento):
+        """Objeto tipo archivo para leer la imagen del documento (sirve para Image.open)"""
+        storage = documento.get("imagen_storage")
+        if storage == "gridfs":
+            return self.bucket.open_download_stream(documento["imagen_file_id"])
+        if storage == "binary":
+            return BytesIO(documento["imagen_bin"])
+        if isinstance(documento.get("imagen"), str):
+            # Documentos antiguos con base64, aún sin migrar
+            return BytesIO(base64.b64decode(documento["imagen"]))
+        raise KeyError("El documento no tiene imagen")
+
+    def iter_chunks(self, documento, chunk_size=READ_CHUNK_SIZE):
+        """Leer la imagen por bloques"""
+        with self.open(documento) as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def delete(self, documento):
+        if documento.get("imagen_storage") == "gridfs":
+            self.bucket.delete(documento["imagen_file_id"])
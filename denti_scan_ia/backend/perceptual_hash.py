@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Hashes perceptuales (pHash y dHash de 64 bits) e índice de Hamming en memoria
+para buscar escaneos parecidos: la misma foto recortada o recomprimida, o
+escaneos anteriores de un paciente para compararlos con el nuevo.
+
+Los hashes se calculan al guardar cada imagen y se guardan en el documento
+('phash' y 'dhash', en hexadecimal). La API mantiene un índice multi-tabla
+(multi-index hashing): el pHash se parte en 4 trozos de 16 bits y cada trozo
+tiene su tabla. Si dos hashes están a distancia <= k, algún trozo está a
+distancia <= k // 4, así que una búsqueda solo mira las entradas de las
+variantes de cada trozo y no recorre la colección.
+
+Ejecutado como script, calcula los hashes de los documentos que aún no los
+tienen (escaneos anteriores a este cambio):
+
+Uso:
+    python perceptual_hash.py --batch-size 500
+    python perceptual_hash.py --dry-run
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from array import array
+from datetime import timedelta
+from itertools import combinations
+
+import numpy as np
+from bson import ObjectId
+from PIL import Image
+from pymongo import UpdateOne
+
+from database_config import MONGO_DB_NAME, MONGO_URI, SCANS_COLLECTION, get_client
+from db_health import guarded
+from image_preprocessing import open_normalized
+from image_store import IMAGE_STORE_DIR, ImageStore
+
+logger = logging.getLogger(__name__)
+
+SIMILAR_DEFAULT_DISTANCE = int(os.getenv("SIMILAR_DEFAULT_DISTANCE", "10"))
+SIMILAR_MAX_DISTANCE = int(os.getenv("SIMILAR_MAX_DISTANCE", "16"))
+SIMILARITY_LOAD_BATCH = int(os.getenv("SIMILARITY_LOAD_BATCH", "2000"))
+# Cada cuánto se incorporan los escaneos que insertaron otros procesos
+SIMILARITY_REFRESH_S = float(os.getenv("SIMILARITY_REFRESH_S", "60"))
+# Margen hacia atrás al refrescar: documentos que pasaron un rato en el diario antes de llegar a MongoDB
+SIMILARITY_REFRESH_MARGIN_S = float(os.getenv("SIMILARITY_REFRESH_MARGIN_S", "300"))
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    return np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)).astype(np.float32)
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def hashes_from_image(im):
+    """(phash, dhash) de una imagen PIL ya decodificada, como enteros de 64 bits"""
+    gris = im.convert("L")
+    g32 = np.asarray(gris.resize((32, 32), Image.BOX), dtype=np.float32)
+    # pHash: frecuencias bajas de la DCT contra su mediana (sin la componente continua)
+    coef = (_DCT32 @ g32 @ _DCT32.T)[:8, :8].ravel()
+    phash = _bits_to_int(coef > np.median(coef[1:]))
+    # dHash: cada píxel contra su vecino de la derecha
+    g = np.asarray(gris.resize((9, 8), Image.BOX), dtype=np.int16)
+    dhash = _bits_to_int(g[:, 1:] > g[:, :-1])
+    return phash, dhash
+
+
+def compute_hashes(source):
+    """{'phash': hex, 'dhash': hex} de una ruta o bytes (decodificación reducida)"""
+    im, _, _ = open_normalized(source, min_size=(64, 64))
+    return to_fields(*hashes_from_image(im))
+
+
+def to_fields(phash, dhash):
+    return {"phash": f"{phash:016x}", "dhash": f"{dhash:016x}"}
+
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(values):
+        return np.bitwise_count(values)
+else:
+    _BITS_BYTE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _BITS_BYTE[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def _flip_masks(max_flips):
+    """Máscaras de 16 bits con hasta max_flips bits a 1, de menos a más bits"""
+    masks = [0]
+    for n in range(1, max_flips + 1):
+        for bits in combinations(range(CHUNK_BITS), n):
+            masks.append(sum(1 << b for b in bits))
+    return masks
+
+
+class HammingIndex:
+    """
+    Índice multi-tabla de pHash. Los hashes viven en arrays de numpy y cada
+    tabla es {valor del trozo: array de posiciones}, así que un millón de
+    escaneos ocupa decenas de MB. Solo se añade: los escaneos no se borran.
+    """
+
+    def __init__(self):
+        self._phash = np.zeros(1024, dtype=np.uint64)
+        self._dhash = np.zeros(1024, dtype=np.uint64)
+        self._n = 0
+        self.ids = []
+        self._pos = {}
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._by_email = {}
+        self._masks = {}
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, scan_id):
+        return str(scan_id) in self._pos
+
+    def add(self, scan_id, phash, dhash=None, email=None):
+        """Añadir un escaneo (hashes en hex o enteros); los ids repetidos se ignoran"""
+        scan_id = str(scan_id)
+        if scan_id in self._pos:
+            return False
+        phash = int(phash, 16) if isinstance(phash, str) else phash
+        dhash = int(dhash, 16) if isinstance(dhash, str) else (dhash or 0)
+        pos = self._n
+        if pos == len(self._phash):
+            # Se reemplaza el array entero: una búsqueda en curso sigue con el anterior
+            self._phash = np.concatenate([self._phash, np.zeros_like(self._phash)])
+            self._dhash = np.concatenate([self._dhash, np.zeros_like(self._dhash)])
+        self._phash[pos] = phash
+        self._dhash[pos] = dhash
+        self.ids.append(scan_id)
+        self._pos[scan_id] = pos
+        self._n += 1
+        for t, tabla in enumerate(self._tables):
+            trozo = (phash >> (t * CHUNK_BITS)) & CHUNK_MASK
+            bucket = tabla.get(trozo)
+            if bucket is None:
+                bucket = tabla[trozo] = array("I")
+            bucket.append(pos)
+        if email:
+            self._by_email.setdefault(email, array("I")).append(pos)
+        return True
+
+    def hashes_of(self, scan_id):
+        pos = self._pos.get(str(scan_id))
+        if pos is None:
+            return None
+        return int(self._phash[pos]), int(self._dhash[pos])
+
+    def _candidatos(self, phash, max_distance):
+        radio = max_distance // CHUNKS
+        masks = self._masks.get(radio)
+        if masks is None:
+            masks = self._masks[radio] = _flip_masks(radio)
+        encontrados = []
+        for t, tabla in enumerate(self._tables):
+            trozo = (phash >> (t * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                bucket = tabla.get(trozo ^ mask)
+                if bucket:
+                    encontrados.append(np.frombuffer(bucket, dtype=np.uint32))
+        if not encontrados:
+            return np.zeros(0, dtype=np.uint32)
+        return np.unique(np.concatenate(encontrados))
+
+    def search(self, phash, max_distance=SIMILAR_DEFAULT_DISTANCE, email=None, limit=20, exclude=None, dhash=None):
+        """
+        Escaneos con pHash a distancia de Hamming <= max_distance, del más
+        parecido al menos: [(scan_id, distancia_phash, distancia_dhash)].
+        Con email solo se buscan los escaneos de ese paciente.
+        """
+        phash = int(phash, 16) if isinstance(phash, str) else phash
+        dhash = int(dhash, 16) if isinstance(dhash, str) else dhash
+        n = self._n
+        hashes, dhashes = self._phash, self._dhash
+        if email is not None:
+            # Pocos escaneos por paciente: se comparan todos
+            posiciones = np.frombuffer(self._by_email.get(email, array("I")), dtype=np.uint32)
+        else:
+            posiciones = self._candidatos(phash, max_distance)
+        posiciones = posiciones[posiciones < n]
+        if not len(posiciones):
+            return []
+        distancias = _popcount(hashes[posiciones] ^ np.uint64(phash))
+        cerca = distancias <= max_distance
+        posiciones, distancias = posiciones[cerca], distancias[cerca]
+        orden = np.argsort(distancias, kind="stable")
+        resultados = []
+        for i in orden:
+            scan_id = self.ids[posiciones[i]]
+            if scan_id == exclude:
+                continue
+            d_dhash = None
+            if dhash is not None:
+                d_dhash = int(_popcount(np.array([dhashes[posiciones[i]] ^ np.uint64(dhash)], dtype=np.uint64))[0])
+            resultados.append((scan_id, int(distancias[i]), d_dhash))
+            if len(resultados) >= limit:
+                break
+        return resultados
+
+
+class SimilarityIndexSync:
+    """
+    Carga el índice desde MongoDB por lotes en segundo plano (las búsquedas
+    funcionan mientras tanto, sobre lo ya cargado) y cada refresh_s incorpora
+    los escaneos que insertaron otros procesos. Las consultas pasan por breaker
+    si se indicó.
+    """
+
+    def __init__(self, index, get_collection, batch_size=SIMILARITY_LOAD_BATCH, refresh_s=SIMILARITY_REFRESH_S,
+                 breaker=None):
+        self.index = index
+        self.get_collection = get_collection
+        self.breaker = breaker
+        self.batch_size = batch_size
+        self.refresh_s = refresh_s
+        self.state = "empty"
+        self.last_id = None
+        self.loaded = 0
+        self.load_seconds = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def _lote(self, coleccion, desde):
+        filtro = {"phash": {"$exists": True}}
+        if desde is not None:
+            filtro["_id"] = {"$gt": desde}
+        return list(
+            coleccion.find(filtro, {"phash": 1, "dhash": 1, "email": 1}).sort("_id", 1).limit(self.batch_size)
+        )
+
+    async def _cargar(self, desde):
+        """Recorrer por _id desde 'desde' hasta el final; devuelve cuántos se añadieron"""
+        añadidos = 0
+        while True:
+            coleccion = self.get_collection()
+            if coleccion is None:
+                raise ConnectionError("MongoDB no está disponible")
+            lote = await guarded(self.breaker, self._lote, coleccion, desde)
+            for doc in lote:
+                if self.index.add(doc["_id"], doc["phash"], doc.get("dhash"), doc.get("email")):
+                    añadidos += 1
+            if lote:
+                desde = lote[-1]["_id"]
+                if self.last_id is None or desde > self.last_id:
+                    self.last_id = desde
+            if len(lote) < self.batch_size:
+                return añadidos
+            # Ceder el event loop entre lotes
+            await asyncio.sleep(0)
+
+    async def _run(self):
+        inicio = time.perf_counter()
+        self.state = "loading"
+        while self.state == "loading":
+            try:
+                self.loaded += await self._cargar(self.last_id)
+                self.state = "ready"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Índice de similitud: carga pausada ({self.loaded} escaneos): {e}")
+                await asyncio.sleep(self.refresh_s / 4 or 5)
+        self.load_seconds = round(time.perf_counter() - inicio, 2)
+        logger.info(f"🔎 Índice de similitud listo: {len(self.index)} escaneos ({self.load_seconds}s)")
+
+        while True:
+            await asyncio.sleep(self.refresh_s)
+            if self.last_id is None:
+                desde = None
+            else:
+                # Los documentos que esperaron en el diario tienen un _id anterior a su inserción
+                desde = ObjectId.from_datetime(
+                    self.last_id.generation_time - timedelta(seconds=SIMILARITY_REFRESH_MARGIN_S)
+                )
+            try:
+                self.loaded += await self._cargar(desde)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Índice de similitud: no se pudo refrescar: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self):
+        return {"state": self.state, "size": len(self.index), "load_seconds": self.load_seconds}
+
+
+def backfill(coleccion, store, batch_size=500, dry_run=False):
+    """Calcular y guardar los hashes de los documentos con imagen en el almacén que aún no los tienen"""
+    pendientes = {"phash": {"$exists": False}, "content_hash": {"$exists": True}}
+    total = coleccion.count_documents(pendientes)
+    print(f"🔍 Documentos sin hash perceptual: {total}")
+    if dry_run or total == 0:
+        return 0
+
+    calculados = {}
+    hechos = errores = 0
+    ultimo_id = None
+    inicio = time.perf_counter()
+    while True:
+        filtro = dict(pendientes)
+        if ultimo_id is not None:
+            filtro["_id"] = {"$gt": ultimo_id}
+        lote = list(coleccion.find(filtro, {"content_hash": 1}).sort("_id", 1).limit(batch_size))
+        if not lote:
+            break
+        ultimo_id = lote[-1]["_id"]
+        operaciones = []
+        for doc in lote:
+            sha256 = doc["content_hash"]
+            if sha256 not in calculados:
+                ubicacion = store.locate(sha256)
+                try:
+                    calculados[sha256] = compute_hashes(ubicacion[0]) if ubicacion else None
+                except Exception as e:
+                    print(f"⚠️ {doc['_id']}: {e}")
+                    calculados[sha256] = None
+            if calculados[sha256] is None:
+                errores += 1
+                continue
+            operaciones.append(UpdateOne({"_id": doc["_id"]}, {"$set": calculados[sha256]}))
+        if operaciones:
+            hechos += coleccion.bulk_write(operaciones, ordered=False).modified_count
+        print(f"   {hechos}/{total}  {hechos / max(time.perf_counter() - inicio, 1e-6):.1f} doc/s")
+    print(f"✅ {hechos} documentos con hash, {errores} sin imagen en el almacén o ilegibles")
+    return hechos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=MONGO_DB_NAME)
+    parser.add_argument("--collection", default=SCANS_COLLECTION)
+    parser.add_argument("--store", default=IMAGE_STORE_DIR, help="raíz del almacén de imágenes")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    try:
+        backfill(client[args.db][args.collection], ImageStore(args.store), args.batch_size, args.dry_run)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# persistence.py
+# Ejecuta la E/S bloqueante (MongoDB y disco) fuera del event loop de FastAPI
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Tamaño de los pools: acotan cuántas operaciones bloqueantes corren a la vez
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "16"))
+DISK_MAX_WORKERS = int(os.getenv("DISK_MAX_WORKERS", "8"))
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="mongo-io")
+_disk_executor = ThreadPoolExecutor(max_workers=DISK_MAX_WORKERS, thread_name_prefix="disk-io")
+
+
+async def run_db(func, *args, **kwargs):
+    """Ejecutar una llamada de pymongo en el pool de base de datos"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, partial(func, *args, **kwargs))
+
+
+async def run_disk(func, *args, **kwargs):
+    """Ejecutar una operación de disco en el pool de archivos"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_disk_executor, partial(func, *args, **kwargs))
+
+
+def _write_bytes(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+async def write_file(path, data):
+    """Guardar bytes en disco sin bloquear el event loop"""
+    await run_disk(_write_bytes, path, data)
+
+
+def shutdown_executors():
+    """Cerrar los pools al apagar la aplicación"""
+    _db_executor.shutdown(wait=True)
+    _disk_executor.shutdown(wait=True)
@@ -0,0 +1,159 @@
+# quality_gate.py
+# Control de calidad de la foto antes de guardarla y analizarla
+#
+# Trabaja sobre una decodificación reducida (modo draft de Pillow: un JPEG de
+# 12 MP se decodifica a 1/8) y unas pocas operaciones vectorizadas de numpy.
+# Las medidas tardan pocos milisegundos; el resto es la lectura del JPEG, que
+# en una foto de teléfono ronda las decenas de ms. Las fotos borrosas, oscuras, diminutas o
+# sin boca visible se rechazan con motivos que el paciente puede corregir,
+# antes de gastar disco, MongoDB e inferencia en ellas.
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from upload_stream import ACCEPTED_MIME_TYPES
+
+QUALITY_GATE = os.getenv("QUALITY_GATE", "1") == "1"
+# Lado de la imagen reducida sobre la que se miden nitidez, exposición y color
+QUALITY_ANALYSIS_SIDE = int(os.getenv("QUALITY_ANALYSIS_SIDE", "384"))
+# Las fotos de caries de ejemplo en uploads/ miden 275x183: el mínimo por defecto las admite
+QUALITY_MIN_SIDE = int(os.getenv("QUALITY_MIN_SIDE", "160"))
+# Varianza del laplaciano (niveles de gris 0-255) por debajo de la cual la foto está movida o desenfocada
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "30"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "225"))
+# Fracción máxima de píxeles quemados (>= 250) o negros (<= 5)
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.5"))
+QUALITY_MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "12"))
+# Fracción mínima de píxeles con color de encía/labio o de diente para aceptar que hay una boca
+QUALITY_MIN_MOUTH_FRACTION = float(os.getenv("QUALITY_MIN_MOUTH_FRACTION", "0.02"))
+# Por debajo de esta saturación media la imagen se trata como radiografía (sin chequeo de color)
+QUALITY_GRAYSCALE_SATURATION = float(os.getenv("QUALITY_GRAYSCALE_SATURATION", "12"))
+
+MENSAJES = {
+    "file_type": "El formato {mime_type} no es una foto admitida: usa JPG, PNG, WebP, BMP o TIFF",
+    "unreadable": "No se pudo leer la imagen: el archivo está dañado o incompleto, vuelve a tomar la foto",
+    "low_resolution": "La imagen es muy pequeña ({width}x{height}); se necesitan al menos {min_side} px "
+                      "en el lado menor. Usa la cámara trasera y no recortes la foto",
+    "blurry": "La foto está movida o desenfocada: apoya los codos, toca la pantalla para enfocar y vuelve a intentarlo",
+    "too_dark": "La foto está demasiado oscura: acércate a una luz o activa el flash",
+    "overexposed": "La foto está sobreexpuesta: aléjate de la luz directa o desactiva el flash",
+    "low_contrast": "La foto casi no tiene contraste: comprueba que la lente esté limpia y que la boca ocupe la imagen",
+    "no_mouth": "No se ve la boca en la foto: encuadra los dientes y las encías, con los labios separados",
+}
+
+
+@dataclass
+class QualityReport:
+    ok: bool
+    reasons: list = field(default_factory=list)
+    metrics: dict = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _motivo(code, **datos):
+    return {"code": code, "message": MENSAJES[code].format(**datos)}
+
+
+def _abrir_reducida(source, side):
+    """(RGB reducida a side px como máximo, tamaño original)"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    with Image.open(source) as im:
+        original_size = im.size
+        # Por encima de MAX_IMAGE_PIXELS Pillow solo avisa (y lanza al doble): se trata como ilegible.
+        # No se usa warnings.catch_warnings porque cambia filtros globales y esto corre en varios hilos
+        if Image.MAX_IMAGE_PIXELS and original_size[0] * original_size[1] > Image.MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(f"{original_size[0]}x{original_size[1]} px")
+        # draft pide que ambos lados cubran el tamaño: se pasa la caja proporcional,
+        # si no una foto 4:3 de 12 MP se decodificaría a 1/4 en lugar de 1/8
+        escala = side / max(original_size)
+        im.draft("RGB", (max(1, round(original_size[0] * escala)), max(1, round(original_size[1] * escala))))
+        im = ImageOps.exif_transpose(im)
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        im.thumbnail((side, side), Image.BILINEAR)
+        return np.asarray(im), original_size
+
+
+def sharpness(gris):
+    """Varianza del laplaciano de 4 vecinos: baja si la imagen no tiene bordes nítidos"""
+    lap = gris[:-2, 1:-1] + gris[2:, 1:-1] + gris[1:-1, :-2] + gris[1:-1, 2:] - 4 * gris[1:-1, 1:-1]
+    return float(lap.var())
+
+
+def mouth_fraction(rgb):
+    """
+    Fracción de píxeles con color de encía/labio (rojo-rosado) y de diente
+    (claro y poco saturado). Heurística: no localiza la boca, solo comprueba
+    que sus colores estén presentes.
+    """
+    r, g, b = (rgb[..., i].astype(np.int16) for i in range(3))
+    encia = (r > 90) & (r - g > 30) & (r - b > 15)
+    maximo = np.maximum(np.maximum(r, g), b)
+    minimo = np.minimum(np.minimum(r, g), b)
+    diente = (minimo > 140) & (maximo - minimo < 60)
+    return float(encia.mean()), float(diente.mean())
+
+
+def check_quality(source, mime_type=None):
+    """
+    Evaluar una foto (ruta, bytes o archivo). Devuelve un QualityReport con
+    ok=False y los motivos si no sirve para el análisis.
+    """
+    inicio = time.perf_counter()
+    motivos = []
+    if mime_type is not None and mime_type not in ACCEPTED_MIME_TYPES:
+        motivos.append(_motivo("file_type", mime_type=mime_type))
+        return QualityReport(False, motivos, {}, round((time.perf_counter() - inicio) * 1000, 2))
+
+    try:
+        rgb, (ancho, alto) = _abrir_reducida(source, QUALITY_ANALYSIS_SIDE)
+    except Exception:
+        # UnidentifiedImageError, OSError y DecompressionBombError, pero Pillow también lanza
+        # ValueError, SyntaxError o EOFError con archivos corruptos
+        motivos.append(_motivo("unreadable"))
+        return QualityReport(False, motivos, {}, round((time.perf_counter() - inicio) * 1000, 2))
+    gris = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    maximo = rgb.max(axis=2).astype(np.int16)
+    saturacion = float((maximo - rgb.min(axis=2)).mean())
+    encia, diente = mouth_fraction(rgb)
+    metricas = {
+        "width": ancho,
+        "height": alto,
+        "sharpness": round(sharpness(gris), 1),
+        "brightness": round(float(gris.mean()), 1),
+        "contrast": round(float(gris.std()), 1),
+        "dark_fraction": round(float((gris <= 5).mean()), 3),
+        "bright_fraction": round(float((gris >= 250).mean()), 3),
+        "saturation": round(saturacion, 1),
+        "gum_fraction": round(encia, 3),
+        "tooth_fraction": round(diente, 3),
+    }
+
+    if min(ancho, alto) < QUALITY_MIN_SIDE:
+        motivos.append(_motivo("low_resolution", width=ancho, height=alto, min_side=QUALITY_MIN_SIDE))
+    exposicion = None
+    if metricas["brightness"] < QUALITY_MIN_BRIGHTNESS or metricas["dark_fraction"] > QUALITY_MAX_CLIPPED:
+        exposicion = "too_dark"
+    elif metricas["brightness"] > QUALITY_MAX_BRIGHTNESS or metricas["bright_fraction"] > QUALITY_MAX_CLIPPED:
+        exposicion = "overexposed"
+    elif metricas["contrast"] < QUALITY_MIN_CONTRAST:
+        exposicion = "low_contrast"
+    if exposicion:
+        motivos.append(_motivo(exposicion))
+    # Con mala exposición la nitidez no se puede medir bien: se informa solo la exposición
+    elif metricas["sharpness"] < QUALITY_MIN_SHARPNESS:
+        motivos.append(_motivo("blurry"))
+    # Las radiografías no tienen color: el chequeo de boca es solo para fotos
+    if saturacion >= QUALITY_GRAYSCALE_SATURATION and encia + diente < QUALITY_MIN_MOUTH_FRACTION:
+        motivos.append(_motivo("no_mouth"))
+
+    return QualityReport(not motivos, motivos, metricas, round((time.perf_counter() - inicio) * 1000, 2))
@@ -0,0 +1,186 @@
+# result_cache.py
+# Caché de resultados de análisis en dos niveles, por hash de imagen y versión del modelo
+#
+#   L1: LRU en memoria del proceso, con límite de entradas y TTL
+#   L2: colección de MongoDB compartida entre procesos, con índice TTL
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from db_health import guarded
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_TTL_S = int(os.getenv("RESULT_CACHE_TTL_S", str(7 * 24 * 3600)))
+RESULT_CACHE_COLLECTION = "analysis_cache"
+
+
+def ensure_cache_indexes(coleccion):
+    """Índice TTL de L2: MongoDB borra solo los resultados vencidos. Se crea al conectar"""
+    coleccion.create_index("expires_at", expireAfterSeconds=0)
+
+
+class ResultCache:
+    def __init__(self, get_collection=lambda: None, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_s=RESULT_CACHE_TTL_S,
+                 breaker=None):
+        """
+        get_collection devuelve la colección de MongoDB para L2, o None si no hay
+        conexión; las operaciones sobre L2 pasan por breaker si se indicó
+        """
+        self.get_collection = get_collection
+        self.breaker = breaker
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.model_version = None
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # Referencias a las purgas en curso: el event loop solo guarda referencias débiles a las tareas
+        self._tasks = set()
+        self.counters = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "evictions": 0, "l2_errors": 0, "coalesced": 0}
+
+    @staticmethod
+    def key(content_hash, model_version):
+        return f"{model_version}:{content_hash}"
+
+    def _check_version(self, model_version):
+        # Al cambiar de modelo, los resultados anteriores dejan de ser válidos
+        if model_version == self.model_version:
+            return
+        if self.model_version is not None:
+            logger.info(f"🧹 Modelo cambió a {model_version}: se invalida la caché de {self.model_version}")
+        self.model_version = model_version
+        self._entries.clear()
+        task = asyncio.get_running_loop().create_task(self._purge_l2(model_version))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _purge_l2(self, model_version):
+        coleccion = self.get_collection()
+        if coleccion is None:
+            return
+        try:
+            result = await guarded(self.breaker, coleccion.delete_many, {"model_version": {"$ne": model_version}})
+            if result.deleted_count:
+                logger.info(f"🧹 {result.deleted_count} resultados de modelos anteriores eliminados")
+        except Exception as e:
+            self.counters["l2_errors"] += 1
+            logger.warning(f"⚠️ No se pudo limpiar la caché en MongoDB: {e}")
+
+    def _get_l1(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_l1(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl_s, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def get(self, content_hash, model_version):
+        value = await self._lookup(content_hash, model_version)
+        if value is None:
+            self.counters["misses"] += 1
+        return value
+
+    async def _lookup(self, content_hash, model_version):
+        self._check_version(model_version)
+        key = self.key(content_hash, model_version)
+        value = self._get_l1(key)
+        if value is not None:
+            self.counters["l1_hits"] += 1
+            return value
+
+        coleccion = self.get_collection()
+        if coleccion is not None:
+            try:
+                doc = await guarded(self.breaker, coleccion.find_one, {"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+                if doc is not None:
+                    self.counters["l2_hits"] += 1
+                    self._set_l1(key, doc["result"])
+                    return doc["result"]
+            except Exception as e:
+                self.counters["l2_errors"] += 1
+                logger.warning(f"⚠️ Error leyendo la caché en MongoDB: {e}")
+        return None
+
+    async def set(self, content_hash, model_version, value):
+        self._check_version(model_version)
+        key = self.key(content_hash, model_version)
+        self._set_l1(key, value)
+        coleccion = self.get_collection()
+        if coleccion is None:
+            return
+        try:
+            await guarded(
+                self.breaker,
+                coleccion.replace_one,
+                {"_id": key},
+                {
+                    "_id": key,
+                    "content_hash": content_hash,
+                    "model_version": model_version,
+                    "result": value,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_s),
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            self.counters["l2_errors"] += 1
+            logger.warning(f"⚠️ Error guardando en la caché de MongoDB: {e}")
+
+    async def get_or_compute(self, content_hash, model_version, compute):
+        """
+        Devolver (resultado, desde_cache). Peticiones simultáneas con la misma
+        imagen comparten un único cálculo.
+        """
+        value = await self._lookup(content_hash, model_version)
+        if value is not None:
+            return value, True
+
+        key = self.key(content_hash, model_version)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(pending), True
+
+        self.counters["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            await self.set(content_hash, model_version, value)
+            future.set_result(value)
+            return value, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nadie más esperaba: evitar el aviso de excepción no recuperada
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        hits = self.counters["l1_hits"] + self.counters["l2_hits"] + self.counters["coalesced"]
+        total = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "model_version": self.model_version,
+        }
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Exportación de escaneos y diagnósticos de la colección 'imagenes' a NDJSON,
+CSV o Parquet, por lotes desde un cursor de MongoDB.
+
+Solo se piden los campos de EXPORT_FIELDS (nunca los bytes de la imagen) y
+se escribe lote a lote, así que la memoria no depende del tamaño de la
+colección. Las exportaciones incrementales usan una marca de agua sobre
+'ingested_at' (hora de llegada a MongoDB): cada exportación cubre
+(since, until] y el until de una es el since de la siguiente.
+
+Uso:
+    python scan_export.py --format csv --output escaneos.csv
+    python scan_export.py --format ndjson --gzip --watermark-file export.state --output incremental.ndjson.gz
+    python scan_export.py --format parquet --since 2024-01-01T00:00:00Z --output escaneos.parquet
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from database_config import MONGO_DB_NAME, MONGO_URI, SCANS_COLLECTION, get_client
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_MAX_BATCH_SIZE = 10000
+# until por defecto = ahora - este margen: un insert en curso no queda entre dos exportaciones
+EXPORT_SETTLE_S = float(os.getenv("EXPORT_SETTLE_S", "60"))
+# Filas por grupo de Parquet: cada grupo se escribe y se libera
+EXPORT_PARQUET_ROW_GROUP = int(os.getenv("EXPORT_PARQUET_ROW_GROUP", "10000"))
+
+# (campo, tipo) en el orden de las columnas
+EXPORT_FIELDS = [
+    ("id", "string"),
+    ("name", "string"),
+    ("email", "string"),
+    ("birth_date", "string"),
+    ("status", "string"),
+    ("diagnosis", "string"),
+    ("confidence", "float"),
+    ("recommendations", "list"),
+    ("model_version", "string"),
+    ("checkup_id", "string"),
+    ("image_filename", "string"),
+    ("content_hash", "string"),
+    ("mime_type", "string"),
+    ("size_bytes", "int"),
+    ("phash", "string"),
+    ("source", "string"),
+    ("upload_date", "timestamp"),
+    ("ingested_at", "timestamp"),
+]
+EXPORT_PROJECTION = {campo: 1 for campo, _ in EXPORT_FIELDS if campo != "id"}
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "csv": ("text/csv; charset=utf-8", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+
+def watermark(fecha):
+    """
+    Marca en UTC truncada al milisegundo, la precisión con que MongoDB guarda
+    las fechas: si no, un escaneo del mismo milisegundo que until podría
+    quedar fuera de las dos exportaciones
+    """
+    if fecha is None:
+        return None
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    fecha = fecha.astimezone(timezone.utc)
+    return fecha.replace(microsecond=fecha.microsecond // 1000 * 1000)
+
+
+def default_until():
+    return watermark(datetime.now(timezone.utc) - timedelta(seconds=EXPORT_SETTLE_S))
+
+
+def export_filter(since=None, until=None, email=None, status=None):
+    """
+    Filtro de MongoDB para la ventana (since, until] de ingested_at (índice
+    ingested_at). Sin since también entran los documentos anteriores a
+    ingested_at, que no tienen el campo.
+    """
+    filtro = {}
+    ventana = {}
+    if since is not None:
+        ventana["$gt"] = since
+    if until is not None:
+        ventana["$lte"] = until
+    if since is not None:
+        filtro["ingested_at"] = ventana
+    elif until is not None:
+        filtro["$or"] = [{"ingested_at": ventana}, {"ingested_at": None}]
+    if email is not None:
+        filtro["email"] = email
+    if status is not None:
+        filtro["status"] = status
+    return filtro
+
+
+def open_cursor(coleccion, filtro, batch_size=EXPORT_BATCH_SIZE):
+    """Cursor del servidor con la proyección de exportación; MongoDB entrega batch_size documentos por viaje"""
+    return coleccion.find(filtro, EXPORT_PROJECTION, batch_size=batch_size)
+
+
+def next_chunk(cursor, writer, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Leer el siguiente lote del cursor y serializarlo: (documentos, bytes).
+    Bloqueante (red y CPU), para run_db; 0 documentos al terminar.
+    """
+    lote = list(itertools.islice(cursor, batch_size))
+    return len(lote), writer.write(lote) if lote else b""
+
+
+def _utc(fecha):
+    if isinstance(fecha, datetime) and fecha.tzinfo is None:
+        return fecha.replace(tzinfo=timezone.utc)
+    return fecha
+
+
+def _fila(documento):
+    fila = {"id": str(documento["_id"])}
+    for campo, tipo in EXPORT_FIELDS[1:]:
+        valor = documento.get(campo)
+        if tipo == "timestamp":
+            valor = _utc(valor) if isinstance(valor, datetime) else None
+        elif tipo == "list" and valor is not None and not isinstance(valor, list):
+            valor = [valor]
+        elif isinstance(valor, ObjectId):
+            valor = str(valor)
+        fila[campo] = valor
+    return fila
+
+
+def _json_default(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+class NDJSONWriter:
+    def header(self):
+        return b""
+
+    def write(self, documentos):
+        return "".join(
+            json.dumps(_fila(d), ensure_ascii=False, default=_json_default) + "\n" for d in documentos
+        ).encode()
+
+    def close(self):
+        return b""
+
+
+class CSVWriter:
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer)
+
+    def _drain(self):
+        datos = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return datos
+
+    def header(self):
+        self._csv.writerow([campo for campo, _ in EXPORT_FIELDS])
+        return self._drain()
+
+    def write(self, documentos):
+        for documento in documentos:
+            fila = _fila(documento)
+            self._csv.writerow([
+                " | ".join(map(str, v)) if isinstance(v, list)
+                else v.isoformat() if isinstance(v, datetime)
+                else "" if v is None else v
+                for v in fila.values()
+            ])
+        return self._drain()
+
+    def close(self):
+        return b""
+
+
+class _Sumidero(io.RawIOBase):
+    """Archivo de solo escritura que acumula lo que escribe ParquetWriter hasta que se recoge"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def drain(self):
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+class ParquetWriter:
+    """Parquet por grupos de filas; requiere pyarrow (opcional)"""
+
+    def __init__(self, row_group=EXPORT_PARQUET_ROW_GROUP):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("La exportación a Parquet necesita pyarrow: pip install pyarrow") from e
+        self._pa = pa
+        tipos = {
+            "string": pa.string(),
+            "float": pa.float64(),
+            "int": pa.int64(),
+            "list": pa.list_(pa.string()),
+            "timestamp": pa.timestamp("ms", tz="UTC"),
+        }
+        self.schema = pa.schema([(campo, tipos[tipo]) for campo, tipo in EXPORT_FIELDS])
+        self.row_group = row_group
+        self._columnas = {campo: [] for campo, _ in EXPORT_FIELDS}
+        self._filas = 0
+        self._sumidero = _Sumidero()
+        self._writer = pq.ParquetWriter(self._sumidero, self.schema, compression="zstd")
+
+    def header(self):
+        return b""
+
+    def _escribir_grupo(self):
+        if self._filas:
+            tabla = self._pa.Table.from_pydict(self._columnas, schema=self.schema)
+            self._writer.write_table(tabla, row_group_size=self.row_group)
+            for valores in self._columnas.values():
+                valores.clear()
+            self._filas = 0
+        return self._sumidero.drain()
+
+    def write(self, documentos):
+        for documento in documentos:
+            for campo, valor in _fila(documento).items():
+                self._columnas[campo].append(valor)
+        self._filas += len(documentos)
+        if self._filas < self.row_group:
+            return b""
+        return self._escribir_grupo()
+
+    def close(self):
+        datos = self._escribir_grupo()
+        self._writer.close()
+        return datos + self._sumidero.drain()
+
+
+def make_writer(fmt, gzip=False):
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt} (usa {', '.join(FORMATS)})")
+    if fmt == "parquet":
+        if gzip:
+            raise ValueError("Parquet ya va comprimido por columnas: no se puede combinar con gzip")
+        return ParquetWriter()
+    writer = NDJSONWriter() if fmt == "ndjson" else CSVWriter()
+    return GzipWriter(writer) if gzip else writer
+
+
+class GzipWriter:
+    """Comprime al vuelo la salida de otro writer (formato .gz)"""
+
+    def __init__(self, writer, level=6):
+        self.writer = writer
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def header(self):
+        return self._zlib.compress(self.writer.header())
+
+    def write(self, documentos):
+        return self._zlib.compress(self.writer.write(documentos))
+
+    def close(self):
+        return self._zlib.compress(self.writer.close()) + self._zlib.flush()
+
+
+def filename_for(fmt, gzip, until):
+    _, extension = FORMATS[fmt]
+    return f"scans-{until:%Y%m%dT%H%M%SZ}{extension}{'.gz' if gzip else ''}"
+
+
+def media_type_for(fmt, gzip):
+    return "application/gzip" if gzip else FORMATS[fmt][0]
+
+
+def export(coleccion, salida, fmt="ndjson", gzip=False, filtro=None, batch_size=EXPORT_BATCH_SIZE, progreso=None):
+    """Escribir la exportación en un archivo binario; devuelve (documentos, bytes)"""
+    writer = make_writer(fmt, gzip)
+    cursor = open_cursor(coleccion, filtro or {}, batch_size)
+    total = escritos = 0
+    try:
+        escritos += salida.write(writer.header())
+        while True:
+            n, datos = next_chunk(cursor, writer, batch_size)
+            if not n:
+                break
+            total += n
+            escritos += salida.write(datos)
+            if progreso is not None:
+                progreso(total)
+        escritos += salida.write(writer.close())
+    finally:
+        cursor.close()
+    return total, escritos
+
+
+def parse_timestamp(valor):
+    return watermark(datetime.fromisoformat(valor.replace("Z", "+00:00")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=MONGO_DB_NAME)
+    parser.add_argument("--collection", default=SCANS_COLLECTION)
+    parser.add_argument("--format", choices=list(FORMATS), default="ndjson")
+    parser.add_argument("--output", default="-", help="archivo de salida ('-' = stdout)")
+    parser.add_argument("--gzip", action="store_true", help="comprimir NDJSON/CSV con gzip")
+    parser.add_argument("--since", type=parse_timestamp, help="solo escaneos llegados después (ISO 8601)")
+    parser.add_argument("--until", type=parse_timestamp, help=f"hasta (por defecto, ahora - {EXPORT_SETTLE_S:.0f}s)")
+    parser.add_argument("--watermark-file", help="guarda el until de cada exportación y lo usa como since de la siguiente")
+    parser.add_argument("--email")
+    parser.add_argument("--status")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    since = args.since
+    if since is None and args.watermark_file and os.path.exists(args.watermark_file):
+        with open(args.watermark_file) as f:
+            since = parse_timestamp(json.load(f)["until"])
+    until = args.until or default_until()
+    filtro = export_filter(since, until, args.email, args.status)
+
+    client = get_client(args.uri)
+    coleccion = client[args.db][args.collection]
+    log = sys.stderr
+    print(f"📦 Exportando {args.format}{' (gzip)' if args.gzip else ''}: "
+          f"{since.isoformat() if since else 'inicio'} → {until.isoformat()}", file=log)
+    inicio = time.perf_counter()
+    ultimo_aviso = [inicio]
+
+    def progreso(total):
+        ahora = time.perf_counter()
+        if ahora - ultimo_aviso[0] >= 2:
+            ultimo_aviso[0] = ahora
+            print(f"   {total} documentos  {total / (ahora - inicio):.0f} doc/s", file=log)
+
+    # Se escribe a un temporal y se renombra al terminar: un fallo no deja un archivo a medias
+    destino = None if args.output == "-" else args.output
+    temporal = f"{destino}.tmp" if destino else None
+    salida = open(temporal, "wb") if temporal else sys.stdout.buffer
+    try:
+        total, escritos = export(coleccion, salida, args.format, args.gzip, filtro, args.batch_size, progreso)
+    except BaseException:
+        if temporal:
+            salida.close()
+            os.remove(temporal)
+        raise
+    finally:
+        client.close()
+    if temporal:
+        salida.close()
+        os.replace(temporal, destino)
+    else:
+        salida.flush()
+
+    if args.watermark_file:
+        with open(args.watermark_file, "w") as f:
+            json.dump({"until": until.isoformat(), "documents": total}, f)
+    print(f"✅ {total} documentos, {escritos / 1e6:.1f} MB en {time.perf_counter() - inicio:.1f}s", file=log)
+
+
+if __name__ == "__main__":
+    main()
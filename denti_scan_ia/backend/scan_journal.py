@@ -0,0 +1,240 @@
+# scan_journal.py
+# Diario local de escaneos (write-behind): cada documento se guarda primero en
+# SQLite y una tarea en segundo plano lo pasa a MongoDB por lotes
+#
+# La petición solo espera el INSERT local. Si MongoDB está lento o caído, los
+# documentos se acumulan en el diario y se envían cuando vuelve. El _id se
+# asigna al escribir en el diario, así que reenviar un lote ya insertado solo
+# produce errores de clave duplicada, que se cuentan como enviados.
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import bson
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from database_config import stamp_ingested
+from db_health import guarded
+from metrics import DB_ERRORS, span
+from persistence import run_db, run_disk
+
+logger = logging.getLogger(__name__)
+
+SCAN_JOURNAL_PATH = os.getenv("SCAN_JOURNAL_PATH", os.path.join("uploads", "scan_journal.sqlite3"))
+# NORMAL en modo WAL sobrevive a la caída del proceso; FULL también a un corte de luz
+SCAN_JOURNAL_SYNCHRONOUS = os.getenv("SCAN_JOURNAL_SYNCHRONOUS", "NORMAL")
+JOURNAL_FLUSH_BATCH = int(os.getenv("JOURNAL_FLUSH_BATCH", "500"))
+JOURNAL_FLUSH_INTERVAL_S = float(os.getenv("JOURNAL_FLUSH_INTERVAL_S", "0.5"))
+JOURNAL_MAX_BACKOFF_S = float(os.getenv("JOURNAL_MAX_BACKOFF_S", "30"))
+# Un documento que MongoDB rechaza tantas veces se aparta para revisión
+JOURNAL_MAX_ATTEMPTS = int(os.getenv("JOURNAL_MAX_ATTEMPTS", "10"))
+
+DUPLICATE_KEY = 11000
+
+
+class ScanJournal:
+    def __init__(self, path=SCAN_JOURNAL_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS journal (
+                       seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                       doc_id TEXT NOT NULL UNIQUE,
+                       payload BLOB NOT NULL,
+                       attempts INTEGER NOT NULL DEFAULT 0,
+                       dead INTEGER NOT NULL DEFAULT 0,
+                       last_error TEXT,
+                       created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                   )"""
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SCAN_JOURNAL_SYNCHRONOUS}")
+            self._local.conn = conn
+        return conn
+
+    def append(self, documento):
+        """Guardar el documento en el diario y devolver su _id"""
+        if "_id" not in documento:
+            documento["_id"] = ObjectId()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO journal (doc_id, payload) VALUES (?, ?)",
+                (str(documento["_id"]), bson.encode(documento)),
+            )
+        return str(documento["_id"])
+
+    def append_many(self, documentos):
+        """Varios documentos en una sola transacción; devuelve sus _id"""
+        for documento in documentos:
+            documento.setdefault("_id", ObjectId())
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO journal (doc_id, payload) VALUES (?, ?)",
+                [(str(d["_id"]), bson.encode(d)) for d in documentos],
+            )
+        return [str(d["_id"]) for d in documentos]
+
+    def pending(self, limit=JOURNAL_FLUSH_BATCH):
+        """Los documentos más antiguos aún sin enviar: [(seq, documento)]"""
+        rows = self._conn().execute(
+            "SELECT seq, payload FROM journal WHERE dead = 0 ORDER BY seq LIMIT ?", (limit,)
+        ).fetchall()
+        return [(seq, bson.decode(payload)) for seq, payload in rows]
+
+    def ack(self, seqs):
+        with self._conn() as conn:
+            conn.executemany("DELETE FROM journal WHERE seq = ?", [(s,) for s in seqs])
+
+    def reject(self, errores, max_attempts=JOURNAL_MAX_ATTEMPTS):
+        """Anotar un rechazo de MongoDB por documento: {seq: mensaje}"""
+        with self._conn() as conn:
+            conn.executemany(
+                """UPDATE journal SET attempts = attempts + 1, last_error = ?,
+                          dead = CASE WHEN attempts + 1 >= ? THEN 1 ELSE 0 END
+                   WHERE seq = ?""",
+                [(mensaje, max_attempts, seq) for seq, mensaje in errores.items()],
+            )
+
+    def depth(self):
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(dead), 0) FROM journal").fetchone()
+        return {"pending": row[0] - row[1], "dead": row[1]}
+
+
+class JournalFlusher:
+    """
+    Vacía el diario hacia MongoDB con insert_many por lotes.
+
+    get_collection devuelve la colección o None si no hay conexión; los envíos
+    pasan por breaker si se indicó. Ante un
+    fallo espera con backoff exponencial (con jitter) hasta
+    JOURNAL_MAX_BACKOFF_S, llama a reconnect (bloqueante, va al pool de E/S)
+    si se indicó, y reintenta el mismo lote.
+    """
+
+    def __init__(self, journal, get_collection, reconnect=None, batch_size=JOURNAL_FLUSH_BATCH,
+                 interval_s=JOURNAL_FLUSH_INTERVAL_S, max_backoff_s=JOURNAL_MAX_BACKOFF_S, breaker=None):
+        self.journal = journal
+        self.get_collection = get_collection
+        self.breaker = breaker
+        self.reconnect = reconnect
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.max_backoff_s = max_backoff_s
+        self.backoff_s = 0.0
+        self.last_error = None
+        self.last_flush_at = None
+        self.counters = {"flushed": 0, "duplicates": 0, "rejected": 0, "batches": 0, "failures": 0}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        """Avisar que hay documentos nuevos (no espera a que se envíen)"""
+        self._wakeup.set()
+
+    async def _sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            # Se limpia antes de leer el diario: un notify() durante el envío no se pierde
+            self._wakeup.clear()
+            try:
+                enviados = await self.flush_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["failures"] += 1
+                DB_ERRORS.inc(operation="insert_many")
+                self.last_error = str(e)
+                self.backoff_s = min(self.max_backoff_s, max(self.interval_s, self.backoff_s * 2))
+                logger.warning(f"⚠️ MongoDB no aceptó el lote del diario, reintento en {self.backoff_s:.1f}s: {e}")
+                # Durante el backoff no se despierta con notify(): solo el tiempo
+                await asyncio.sleep(self.backoff_s * random.uniform(0.8, 1.2))
+                if self.reconnect is not None:
+                    await run_db(self.reconnect)
+                continue
+            self.backoff_s = 0.0
+            if enviados < self.batch_size:
+                await self._sleep(self.interval_s)
+
+    async def flush_once(self):
+        """Enviar un lote; devuelve cuántos documentos salieron del diario"""
+        lote = await run_disk(self.journal.pending, self.batch_size)
+        if not lote:
+            return 0
+        coleccion = self.get_collection()
+        if coleccion is None:
+            raise ConnectionError("MongoDB no está disponible")
+
+        seqs = [seq for seq, _ in lote]
+        rechazados = {}
+        try:
+            with span("mongo_insert_many"):
+                await guarded(self.breaker, coleccion.insert_many, stamp_ingested([doc for _, doc in lote]), ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == DUPLICATE_KEY:
+                    # Ya estaba en MongoDB (un envío anterior sin confirmar)
+                    self.counters["duplicates"] += 1
+                else:
+                    rechazados[seqs[error["index"]]] = error.get("errmsg", str(error))
+
+        if rechazados:
+            self.counters["rejected"] += len(rechazados)
+            await run_disk(self.journal.reject, rechazados)
+        confirmados = [seq for seq in seqs if seq not in rechazados]
+        await run_disk(self.journal.ack, confirmados)
+        self.counters["flushed"] += len(confirmados)
+        self.counters["batches"] += 1
+        self.last_flush_at = time.time()
+        self.last_error = None
+        return len(lote)
+
+    async def drain(self, timeout_s=5.0):
+        """Intentar vaciar el diario antes de apagar; lo que quede se envía al arrancar"""
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            try:
+                if await self.flush_once() == 0:
+                    return True
+            except Exception:
+                return False
+        return False
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.drain()
+
+    async def stats(self):
+        return {
+            **await run_disk(self.journal.depth),
+            **self.counters,
+            "backoff_s": self.backoff_s,
+            "last_error": self.last_error,
+            "last_flush_at": self.last_flush_at,
+        }
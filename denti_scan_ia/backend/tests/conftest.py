@@ -0,0 +1,86 @@
+# conftest.py
+# Fixtures compartidas: un mongod real y desechable para las pruebas de almacenamiento
+#
+# mongomock no implementa bien bulk_write ni GridFS con pymongo 4.x, así que
+# estas pruebas necesitan un servidor de verdad. Se usa TEST_MONGO_URI si está
+# definida; si no, se arranca el binario de MONGOD_BIN (o el 'mongod' del PATH)
+# en un puerto libre con un dbpath temporal y, como último recurso,
+# pymongo_inmemory (requirements-dev.txt), que descarga un mongod la primera
+# vez. Sin ninguna de estas opciones, se omiten.
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _cliente_inmemory():
+    """MongoClient con un mongod descargado por pymongo_inmemory, o None si no se puede"""
+    try:
+        import pymongo_inmemory
+    except ImportError:
+        return None
+    try:
+        return pymongo_inmemory.MongoClient()
+    except Exception:
+        return None
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def mongo_client(tmp_path_factory):
+    uri = os.getenv("TEST_MONGO_URI")
+    proceso = None
+    mongod = None if uri else os.getenv("MONGOD_BIN") or shutil.which("mongod")
+    if not uri and not mongod:
+        client = _cliente_inmemory()
+        if client is None:
+            pytest.skip("se necesita un mongod: define TEST_MONGO_URI o MONGOD_BIN, añade mongod al PATH "
+                        "o instala requirements-dev.txt")
+        try:
+            yield client
+        finally:
+            client.close()
+        return
+    if not uri:
+        puerto = _puerto_libre()
+        proceso = subprocess.Popen(
+            [mongod, "--dbpath", str(tmp_path_factory.mktemp("mongod")), "--port", str(puerto),
+             "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        uri = f"mongodb://127.0.0.1:{puerto}/"
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=30000)
+    try:
+        try:
+            client.admin.command("ping")
+        except PyMongoError as e:
+            pytest.skip(f"mongod no responde en {uri}: {e}")
+        yield client
+    finally:
+        client.close()
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+
+
+@pytest.fixture
+def mongo_db(mongo_client):
+    """Base de datos con nombre único, borrada al terminar cada prueba"""
+    nombre = f"dentiscan_test_{uuid.uuid4().hex[:12]}"
+    yield mongo_client[nombre]
+    mongo_client.drop_database(nombre)
@@ -0,0 +1,137 @@
+# test_circuit_breaker.py
+# CircuitBreaker y guarded(): closed -> open -> half_open -> closed/open
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+
+import db_health
+from db_health import CircuitBreaker, CircuitOpenError, guarded
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    # Solo el reloj del breaker: el event loop sigue con el real
+    monkeypatch.setattr(db_health, "time", SimpleNamespace(monotonic=reloj))
+    return reloj
+
+
+@pytest.fixture
+def breaker(reloj):
+    return CircuitBreaker(failure_threshold=3, reset_timeout_s=10)
+
+
+def _abrir(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_se_abre_tras_fallos_seguidos(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.counters == {"opened": 1, "rejected": 1}
+
+
+def test_half_open_deja_pasar_una_sola_prueba(breaker, reloj):
+    _abrir(breaker)
+    reloj.ahora += 10
+
+    assert breaker.available()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.available()
+    assert not breaker.allow()
+
+
+def test_prueba_correcta_cierra(breaker, reloj):
+    _abrir(breaker)
+    reloj.ahora += 10
+    breaker.allow()
+
+    breaker.record_success()
+
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_prueba_fallida_reabre(breaker, reloj):
+    _abrir(breaker)
+    reloj.ahora += 10
+    breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.counters["opened"] == 2
+    assert breaker.retry_after() == 11
+
+
+def test_prueba_sin_resultado_se_repite_tras_el_timeout(breaker, reloj):
+    _abrir(breaker)
+    reloj.ahora += 10
+    breaker.allow()
+
+    reloj.ahora += 10
+
+    assert breaker.allow()
+
+
+def test_available_no_gasta_la_prueba_ni_cuenta_rechazos(breaker, reloj):
+    _abrir(breaker)
+    assert not breaker.available()
+    reloj.ahora += 10
+
+    for _ in range(5):
+        assert breaker.available()
+
+    assert breaker.state == "open"
+    assert breaker.counters["rejected"] == 0
+    assert breaker.allow()
+
+
+def test_guarded_alimenta_el_breaker(breaker, reloj):
+    def caida():
+        raise AutoReconnect("sin conexión")
+
+    def duplicado():
+        raise DuplicateKeyError("E11000")
+
+    async def escenario():
+        for _ in range(3):
+            with pytest.raises(AutoReconnect):
+                await guarded(breaker, caida)
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await guarded(breaker, lambda: "no se llama")
+
+        reloj.ahora += 10
+        # Un error del servidor demuestra que MongoDB responde: cierra el breaker
+        with pytest.raises(DuplicateKeyError):
+            await guarded(breaker, duplicado)
+        assert breaker.state == "closed"
+        return await guarded(breaker, lambda: "ok")
+
+    assert asyncio.run(escenario()) == "ok"
+
+
+def test_guarded_sin_breaker():
+    assert asyncio.run(guarded(None, lambda x: x * 2, 21)) == 42
@@ -0,0 +1,105 @@
+# test_hamming_index.py
+# HammingIndex frente a la búsqueda por fuerza bruta sobre los mismos hashes
+import random
+
+import pytest
+
+from perceptual_hash import SIMILAR_MAX_DISTANCE, HammingIndex
+
+N_BASE = 1500
+N_VARIANTES = 8
+
+
+def _voltear(valor, bits, rng):
+    for bit in rng.sample(range(64), bits):
+        valor ^= 1 << bit
+    return valor
+
+
+def _distancia(a, b):
+    return bin(a ^ b).count("1")
+
+
+@pytest.fixture(scope="module")
+def escaneos():
+    """Hashes aleatorios y, para algunos, variantes a 1..16 bits (recompresiones, recortes)"""
+    rng = random.Random(7)
+    datos = []
+    for i in range(N_BASE):
+        phash = rng.getrandbits(64)
+        datos.append((f"scan-{i}", phash, rng.getrandbits(64), f"p{i % 50}@correo.com"))
+        if i % 10 == 0:
+            for v in range(N_VARIANTES):
+                datos.append((f"scan-{i}-v{v}", _voltear(phash, 1 + 2 * v, rng), rng.getrandbits(64),
+                              f"p{i % 50}@correo.com"))
+    return datos
+
+
+@pytest.fixture(scope="module")
+def indice(escaneos):
+    indice = HammingIndex()
+    for scan_id, phash, dhash, email in escaneos:
+        indice.add(scan_id, phash, dhash, email)
+    return indice
+
+
+def _fuerza_bruta(escaneos, phash, max_distance, email=None, exclude=None):
+    return sorted(
+        (_distancia(h, phash), scan_id)
+        for scan_id, h, _, correo in escaneos
+        if _distancia(h, phash) <= max_distance and scan_id != exclude and (email is None or correo == email)
+    )
+
+
+def _como_fuerza_bruta(resultados):
+    return sorted((distancia, scan_id) for scan_id, distancia, _ in resultados)
+
+
+@pytest.mark.parametrize("max_distance", range(0, SIMILAR_MAX_DISTANCE + 1))
+def test_igual_que_fuerza_bruta(escaneos, indice, max_distance):
+    rng = random.Random(max_distance)
+    consultas = [h for _, h, _, _ in rng.sample(escaneos, 40)]
+    consultas += [_voltear(h, rng.randint(0, max_distance), rng) for h in consultas[:20]]
+
+    for phash in consultas:
+        resultados = indice.search(phash, max_distance, limit=len(escaneos))
+        assert _como_fuerza_bruta(resultados) == _fuerza_bruta(escaneos, phash, max_distance)
+        distancias = [d for _, d, _ in resultados]
+        assert distancias == sorted(distancias)
+
+
+def test_filtro_por_paciente_y_exclusion(escaneos, indice):
+    scan_id, phash, _, email = escaneos[0]
+
+    resultados = indice.search(phash, SIMILAR_MAX_DISTANCE, email=email, exclude=scan_id, limit=len(escaneos))
+
+    assert _como_fuerza_bruta(resultados) == _fuerza_bruta(escaneos, phash, SIMILAR_MAX_DISTANCE, email, scan_id)
+    assert scan_id not in {r[0] for r in resultados}
+
+
+def test_limit_devuelve_los_mas_cercanos(escaneos, indice):
+    _, phash, _, _ = escaneos[0]
+
+    resultados = indice.search(phash, SIMILAR_MAX_DISTANCE, limit=3)
+
+    assert _como_fuerza_bruta(resultados) == _fuerza_bruta(escaneos, phash, SIMILAR_MAX_DISTANCE)[:3]
+
+
+def test_distancia_dhash(escaneos, indice):
+    scan_id, phash, dhash, _ = escaneos[5]
+
+    resultados = indice.search(phash, 0, dhash=dhash ^ 0b111)
+
+    assert (scan_id, 0, 3) in resultados
+
+
+def test_add_ignora_repetidos_y_acepta_hex():
+    indice = HammingIndex()
+
+    assert indice.add("a", "00000000000000ff", "0000000000000001")
+    assert not indice.add("a", 0)
+
+    assert len(indice) == 1
+    assert "a" in indice
+    assert indice.hashes_of("a") == (0xFF, 1)
+    assert indice.search("00000000000000fe", 1) == [("a", 1, None)]
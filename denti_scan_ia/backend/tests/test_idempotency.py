@@ -0,0 +1,129 @@
+# test_idempotency.py
+# Idempotency-Key: reserva, repetición de la respuesta guardada, conflictos y claves abandonadas
+import asyncio
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import idempotency
+from idempotency import IdempotencyStore
+
+REGISTRO = "POST /registro"
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1_700_000_000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(idempotency, "time", SimpleNamespace(time=reloj))
+    return reloj
+
+
+@pytest.fixture
+def store(tmp_path, reloj):
+    return IdempotencyStore(str(tmp_path / "idempotency.sqlite3"), ttl_s=3600, lock_s=60)
+
+
+def test_clave_nueva_en_curso_y_repetida(store):
+    assert store.begin("k1", REGISTRO) == ("new", None)
+    assert store.begin("k1", REGISTRO) == ("in_progress", None)
+
+    store.complete("k1", 200, b'{"id": "1"}', "application/json")
+    estado, guardada = store.begin("k1", REGISTRO)
+
+    assert estado == "replay"
+    assert (guardada.status_code, guardada.body, guardada.media_type) == (200, b'{"id": "1"}', "application/json")
+
+
+def test_misma_clave_en_otra_ruta_es_conflicto(store):
+    store.begin("k1", REGISTRO)
+    assert store.begin("k1", "POST /analyze_dental_image") == ("conflict", None)
+
+    store.complete("k1", 200, b"{}", "application/json")
+    assert store.begin("k1", "POST /analyze_dental_image") == ("conflict", None)
+
+
+def test_abandon_libera_la_clave_pero_no_una_respuesta_guardada(store):
+    store.begin("k1", REGISTRO)
+    store.abandon("k1")
+    assert store.begin("k1", REGISTRO) == ("new", None)
+
+    store.complete("k1", 201, b"{}", "application/json")
+    store.abandon("k1")
+    assert store.begin("k1", REGISTRO)[0] == "replay"
+
+
+def test_reserva_de_un_proceso_muerto_caduca(store, reloj):
+    store.begin("k1", REGISTRO)
+
+    reloj.ahora += 61
+
+    assert store.begin("k1", REGISTRO) == ("new", None)
+
+
+def test_respuesta_guardada_caduca_con_el_ttl(store, reloj):
+    store.begin("k1", REGISTRO)
+    store.complete("k1", 200, b"{}", "application/json")
+
+    reloj.ahora += 3601
+
+    assert store.begin("k1", REGISTRO) == ("new", None)
+
+
+def _foto():
+    buf = BytesIO()
+    Image.effect_noise((320, 240), 60).convert("RGB").save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_api_repite_la_respuesta_y_rechaza_la_clave_en_otra_ruta(tmp_path, monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    # Sin modelo ni MongoDB: /registro solo escribe en el diario local
+    monkeypatch.setattr(main, "MODEL_WARMUP", "lazy")
+    monkeypatch.setattr(main.db_monitor, "check", lambda timeout_s: True)
+    # Los pools de E/S son del proceso y los usan las demás pruebas
+    monkeypatch.setattr(main, "shutdown_executors", lambda: None)
+    datos = {"nombre": "Ana", "apellido": "Pérez", "email": "ana@correo.com", "fecha_nacimiento": "1990-05-01"}
+    foto = _foto()
+
+    async def escenario():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+                async def registrar(ruta="/registro", clave="clave-1"):
+                    return await api.post(ruta, data=datos, files={"imagen": ("foto.jpg", foto, "image/jpeg")},
+                                          headers={"Idempotency-Key": clave})
+
+                primera = await registrar()
+                repetida = await registrar()
+                otra_ruta = await registrar(ruta="/jobs/analyze_dental_image")
+                otra_clave = await registrar(clave="clave-2")
+                invalida = await registrar(clave="x" * 256)
+                pendientes = await asyncio.to_thread(main.scan_journal.depth)
+        return primera, repetida, otra_ruta, otra_clave, invalida, pendientes
+
+    primera, repetida, otra_ruta, otra_clave, invalida, pendientes = asyncio.run(escenario())
+
+    assert primera.status_code == 200
+    assert "Idempotent-Replayed" not in primera.headers
+    assert repetida.status_code == 200
+    assert repetida.headers["Idempotent-Replayed"] == "true"
+    assert repetida.content == primera.content
+    assert otra_ruta.status_code == 422
+    assert otra_clave.status_code == 200
+    assert otra_clave.json() != primera.json()
+    assert invalida.status_code == 400
+    # Dos registros, no tres: la repetición no llegó al endpoint
+    assert pendientes["pending"] == 2
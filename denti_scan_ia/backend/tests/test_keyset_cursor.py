@@ -0,0 +1,83 @@
+# test_keyset_cursor.py
+# Paginación por clave de list_scans: ida y vuelta del cursor, empates de fecha y filtros
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+from database_config import decode_cursor, encode_cursor, list_scans
+
+INICIO = datetime(2024, 5, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def coleccion():
+    coleccion = mongomock.MongoClient().db.imagenes
+    documentos = []
+    for i in range(25):
+        # Grupos de 3 con la misma fecha: el _id decide el orden dentro del empate
+        documentos.append({
+            "_id": ObjectId(),
+            "upload_date": INICIO + timedelta(minutes=i // 3),
+            "email": "ana@correo.com" if i % 2 else "luis@correo.com",
+            "status": "analyzed",
+        })
+    # Documento anterior al esquema, sin upload_date: nunca se lista
+    documentos.append({"_id": ObjectId(), "email": "ana@correo.com"})
+    coleccion.insert_many(documentos)
+    return coleccion
+
+
+def _orden_esperado(coleccion, **filtro):
+    documentos = [d for d in coleccion.find({"upload_date": {"$exists": True}, **filtro})]
+    return [d["_id"] for d in sorted(documentos, key=lambda d: (d["upload_date"], d["_id"]), reverse=True)]
+
+
+def _recorrer(coleccion, limit, **filtros):
+    vistos, cursor, paginas = [], None, 0
+    while True:
+        documentos, cursor = list_scans(coleccion, cursor=cursor, limit=limit, **filtros)
+        vistos.extend(d["_id"] for d in documentos)
+        paginas += 1
+        if cursor is None:
+            return vistos, paginas
+
+
+def test_cursor_ida_y_vuelta():
+    documento = {"_id": ObjectId(), "upload_date": datetime(2024, 5, 1, 12, 0, 0, 123000)}
+
+    fecha, ultimo_id = decode_cursor(encode_cursor(documento))
+
+    assert fecha == documento["upload_date"].replace(tzinfo=timezone.utc)
+    assert ultimo_id == documento["_id"]
+
+
+@pytest.mark.parametrize("invalido", ["", "no-es-un-cursor", "eyJkIjogMX0"])
+def test_cursor_invalido(invalido):
+    with pytest.raises(ValueError):
+        decode_cursor(invalido)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 7, 25, 100])
+def test_recorre_todo_sin_repetir_ni_saltar(coleccion, limit):
+    vistos, paginas = _recorrer(coleccion, limit)
+
+    assert vistos == _orden_esperado(coleccion)
+    assert paginas == max(1, -(-25 // limit))
+
+
+def test_desempata_por_id_cuando_la_fecha_coincide(coleccion):
+    # Cada página de 2 corta un grupo de 3 escaneos con la misma fecha
+    primera, cursor = list_scans(coleccion, limit=2)
+    segunda, _ = list_scans(coleccion, cursor=cursor, limit=2)
+
+    assert primera[1]["upload_date"] == segunda[0]["upload_date"]
+    assert primera[1]["_id"] > segunda[0]["_id"]
+
+
+def test_filtros_y_cursor_juntos(coleccion):
+    vistos, _ = _recorrer(coleccion, 4, email="ana@correo.com")
+
+    assert vistos == _orden_esperado(coleccion, email="ana@correo.com")
+    assert len(vistos) == 12
@@ -0,0 +1,109 @@
+# test_micro_batcher.py
+# MicroBatcher: cierre del lote por tamaño y por plazo, errores por elemento y cancelación
+import asyncio
+import time
+
+import pytest
+
+from ia_integration import DentalModel, MicroBatcher
+
+
+class Registro:
+    """run_batch que anota cada lote y devuelve el doble de cada elemento"""
+
+    def __init__(self, espera_s=0.0):
+        self.lotes = []
+        self.espera_s = espera_s
+
+    async def __call__(self, items):
+        self.lotes.append(list(items))
+        await asyncio.sleep(self.espera_s)
+        return [item * 2 for item in items]
+
+
+def test_el_lote_se_cierra_al_llenarse():
+    registro = Registro()
+
+    async def escenario():
+        # Con un plazo larguísimo, solo el tamaño puede cerrar los lotes
+        batcher = MicroBatcher(registro, max_batch_size=4, max_wait_ms=60_000)
+        try:
+            inicio = time.perf_counter()
+            resultados = await asyncio.gather(*(batcher.submit(i) for i in range(8)))
+            return resultados, time.perf_counter() - inicio
+        finally:
+            await batcher.close()
+
+    resultados, duracion = asyncio.run(escenario())
+
+    assert resultados == [i * 2 for i in range(8)]
+    assert registro.lotes == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert duracion < 5
+
+
+def test_el_lote_se_cierra_al_vencer_el_plazo():
+    registro = Registro()
+
+    async def escenario():
+        batcher = MicroBatcher(registro, max_batch_size=100, max_wait_ms=50)
+        try:
+            inicio = time.perf_counter()
+            resultados = await asyncio.gather(*(batcher.submit(i) for i in range(3)))
+            return resultados, time.perf_counter() - inicio
+        finally:
+            await batcher.close()
+
+    resultados, duracion = asyncio.run(escenario())
+
+    assert resultados == [0, 2, 4]
+    assert registro.lotes == [[0, 1, 2]]
+    assert 0.04 <= duracion < 5
+
+
+def test_una_excepcion_solo_afecta_a_su_elemento():
+    async def run_batch(items):
+        return [ValueError(f"mal {i}") if i == 1 else i for i in items]
+
+    async def escenario():
+        batcher = MicroBatcher(run_batch, max_batch_size=3, max_wait_ms=60_000)
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        finally:
+            await batcher.close()
+
+    primero, segundo, tercero = asyncio.run(escenario())
+
+    assert (primero, tercero) == (0, 2)
+    assert isinstance(segundo, ValueError)
+
+
+def test_un_lote_que_falla_entero_propaga_el_error_a_todos():
+    async def run_batch(items):
+        raise RuntimeError("modelo caído")
+
+    async def escenario():
+        batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=60_000)
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(2)), return_exceptions=True)
+        finally:
+            await batcher.close()
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(escenario()))
+
+
+def test_close_cancela_a_quien_espera_un_lote_a_medias():
+    async def escenario():
+        batcher = MicroBatcher(Registro(espera_s=60), max_batch_size=2, max_wait_ms=1)
+        pendientes = [asyncio.ensure_future(batcher.submit(i)) for i in range(5)]
+        await asyncio.sleep(0.05)
+        await batcher.close()
+        return await asyncio.wait_for(asyncio.gather(*pendientes, return_exceptions=True), 5)
+
+    resultados = asyncio.run(escenario())
+
+    assert all(isinstance(r, asyncio.CancelledError) for r in resultados)
+
+
+def test_dental_model_es_abstracto():
+    with pytest.raises(TypeError):
+        DentalModel()
@@ -0,0 +1,135 @@
+# test_migrate_base64_images.py
+# Migración de base64 a Binary/GridFS: resultado, reanudación y archivos huérfanos
+import base64
+import os
+
+import pytest
+
+from migrate_base64_images import migrar
+from mongo_image_storage import MongoImageStorage
+
+INLINE_MAX = 32 * 1024
+
+
+class Interrumpida(Exception):
+    pass
+
+
+class ColeccionQueFalla:
+    """Envuelve la colección y corta la migración en el bulk_write número 'fallar_en'"""
+
+    def __init__(self, coleccion, fallar_en):
+        self._coleccion = coleccion
+        self._fallar_en = fallar_en
+        self.escrituras = 0
+
+    def bulk_write(self, *args, **kwargs):
+        self.escrituras += 1
+        if self.escrituras == self._fallar_en:
+            raise Interrumpida()
+        return self._coleccion.bulk_write(*args, **kwargs)
+
+    def __getattr__(self, nombre):
+        return getattr(self._coleccion, nombre)
+
+
+class StorageConCompetencia(MongoImageStorage):
+    """Simula otro proceso que migra el documento justo antes de nuestra actualización"""
+
+    def __init__(self, db, coleccion, otro, **kwargs):
+        super().__init__(db, **kwargs)
+        self.coleccion = coleccion
+        self.otro = otro
+
+    def put(self, data, filename, metadata=None):
+        campos = super().put(data, filename, metadata)
+        documento_id = metadata["documento_id"]
+        if documento_id in self.otro:
+            ajenos = self.otro[documento_id]
+            self.coleccion.update_one({"_id": documento_id}, {"$set": ajenos, "$unset": {"imagen": ""}})
+        return campos
+
+
+@pytest.fixture
+def imagenes(mongo_db):
+    """30 documentos antiguos: la mitad con imágenes que caben en línea y la otra mitad para GridFS"""
+    coleccion = mongo_db["imagenes"]
+    datos = {}
+    for i in range(30):
+        contenido = os.urandom(4 * 1024 if i % 2 else 48 * 1024)
+        doc_id = coleccion.insert_one({
+            "nombre": f"foto_{i}.jpg",
+            "imagen": base64.b64encode(contenido).decode("ascii"),
+        }).inserted_id
+        datos[doc_id] = contenido
+    return coleccion, datos
+
+
+def _storage(mongo_db):
+    return MongoImageStorage(mongo_db, bucket_name="imagenes_test", inline_max_bytes=INLINE_MAX)
+
+
+def _comprobar_migrados(coleccion, storage, datos):
+    assert coleccion.count_documents({"imagen": {"$exists": True}}) == 0
+    for doc in coleccion.find():
+        assert doc["imagen_size"] == len(datos[doc["_id"]])
+        assert storage.open(doc).read() == datos[doc["_id"]]
+
+
+def _comprobar_sin_huerfanos(mongo_db, coleccion):
+    referenciados = {doc["imagen_file_id"] for doc in coleccion.find({"imagen_storage": "gridfs"})}
+    archivos = {f["_id"] for f in mongo_db["imagenes_test.files"].find({}, {"_id": 1})}
+    assert archivos == referenciados
+
+
+def test_migra_todo(mongo_db, imagenes):
+    coleccion, datos = imagenes
+    storage = _storage(mongo_db)
+
+    assert migrar(coleccion, storage, batch_size=7) == len(datos)
+
+    _comprobar_migrados(coleccion, storage, datos)
+    assert coleccion.count_documents({"imagen_storage": "binary"}) == 15
+    assert coleccion.count_documents({"imagen_storage": "gridfs"}) == 15
+    assert mongo_db["imagenes_test.files"].count_documents({}) == 15
+
+
+def test_dry_run_no_cambia_nada(mongo_db, imagenes):
+    coleccion, datos = imagenes
+
+    assert migrar(coleccion, _storage(mongo_db), dry_run=True) == 0
+
+    assert coleccion.count_documents({"imagen": {"$type": "string"}}) == len(datos)
+
+
+def test_reanuda_tras_una_interrupcion(mongo_db, imagenes):
+    coleccion, datos = imagenes
+    storage = _storage(mongo_db)
+
+    with pytest.raises(Interrumpida):
+        migrar(ColeccionQueFalla(coleccion, fallar_en=3), storage, batch_size=5)
+    assert coleccion.count_documents({"imagen": {"$type": "string"}}) == len(datos) - 10
+    _comprobar_sin_huerfanos(mongo_db, coleccion)
+
+    assert migrar(coleccion, storage, batch_size=5) == len(datos) - 10
+    assert migrar(coleccion, storage, batch_size=5) == 0
+
+    _comprobar_migrados(coleccion, storage, datos)
+    _comprobar_sin_huerfanos(mongo_db, coleccion)
+
+
+def test_no_deja_archivos_huerfanos_si_otro_proceso_migro_antes(mongo_db, imagenes):
+    coleccion, datos = imagenes
+    grandes = [doc_id for doc_id, contenido in datos.items() if len(contenido) > INLINE_MAX]
+    otro_storage = _storage(mongo_db)
+    otro = {doc_id: otro_storage.put(datos[doc_id], "otro.jpg") for doc_id in grandes[:4]}
+    storage = StorageConCompetencia(
+        mongo_db, coleccion, otro, bucket_name="imagenes_test", inline_max_bytes=INLINE_MAX
+    )
+
+    assert migrar(coleccion, storage, batch_size=7) == len(datos) - 4
+
+    _comprobar_migrados(coleccion, storage, datos)
+    _comprobar_sin_huerfanos(mongo_db, coleccion)
+    for doc_id, campos in otro.items():
+        assert coleccion.find_one({"_id": doc_id})["imagen_file_id"] == campos["imagen_file_id"]
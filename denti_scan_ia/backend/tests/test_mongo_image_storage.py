@@ -0,0 +1,94 @@
+# test_mongo_image_storage.py
+# put/open/iter_chunks con imagen en línea (Binary), en GridFS y en base64 antiguo
+import base64
+import os
+from io import BytesIO
+
+import pytest
+from bson import Binary
+
+from mongo_image_storage import MongoImageStorage
+
+PEQUENA = os.urandom(10 * 1024)
+GRANDE = os.urandom(600 * 1024)
+
+
+@pytest.fixture
+def storage(mongo_db):
+    return MongoImageStorage(mongo_db, bucket_name="imagenes_test", inline_max_bytes=64 * 1024)
+
+
+def _guardar(mongo_db, campos):
+    coleccion = mongo_db["imagenes"]
+    doc_id = coleccion.insert_one({"nombre": "foto.jpg", **campos}).inserted_id
+    return coleccion.find_one({"_id": doc_id})
+
+
+def test_put_inline_guarda_binary(storage, mongo_db):
+    campos = storage.put(PEQUENA, "foto.jpg")
+
+    assert campos["imagen_storage"] == "binary"
+    assert campos["imagen_size"] == len(PEQUENA)
+    documento = _guardar(mongo_db, campos)
+    assert isinstance(documento["imagen_bin"], bytes)
+    assert storage.open(documento).read() == PEQUENA
+    assert mongo_db["imagenes_test.files"].count_documents({}) == 0
+
+
+def test_put_grande_va_a_gridfs(storage, mongo_db):
+    campos = storage.put(GRANDE, "foto.jpg", {"email": "paciente@correo.com"})
+
+    assert campos["imagen_storage"] == "gridfs"
+    assert campos["imagen_size"] == len(GRANDE)
+    assert "imagen_bin" not in campos
+    archivo = mongo_db["imagenes_test.files"].find_one({"_id": campos["imagen_file_id"]})
+    assert archivo["length"] == len(GRANDE)
+    assert archivo["metadata"] == {"email": "paciente@correo.com"}
+
+    documento = _guardar(mongo_db, campos)
+    with storage.open(documento) as f:
+        assert f.read() == GRANDE
+
+
+def test_put_stream_sube_desde_la_posicion_actual(storage, mongo_db):
+    stream = BytesIO(b"cabecera" + GRANDE)
+    stream.seek(len(b"cabecera"))
+
+    campos = storage.put_stream(stream, "foto.jpg")
+
+    assert campos["imagen_size"] == len(GRANDE)
+    assert b"".join(storage.iter_chunks(_guardar(mongo_db, campos))) == GRANDE
+
+
+@pytest.mark.parametrize("datos", [PEQUENA, GRANDE], ids=["binary", "gridfs"])
+def test_iter_chunks_respeta_el_tamano_de_bloque(storage, mongo_db, datos):
+    documento = _guardar(mongo_db, storage.put(datos, "foto.jpg"))
+
+    bloques = list(storage.iter_chunks(documento, chunk_size=4096))
+
+    assert b"".join(bloques) == datos
+    assert all(len(b) <= 4096 for b in bloques)
+    assert len(bloques) == -(-len(datos) // 4096)
+
+
+def test_documento_antiguo_en_base64(storage, mongo_db):
+    documento = _guardar(mongo_db, {"imagen": base64.b64encode(PEQUENA).decode("ascii")})
+
+    assert storage.open(documento).read() == PEQUENA
+    assert b"".join(storage.iter_chunks(documento, chunk_size=1000)) == PEQUENA
+
+
+def test_documento_sin_imagen(storage):
+    with pytest.raises(KeyError):
+        storage.open({"nombre": "foto.jpg"})
+
+
+def test_delete_borra_gridfs(storage, mongo_db):
+    grande = _guardar(mongo_db, storage.put(GRANDE, "foto.jpg"))
+    pequena = _guardar(mongo_db, {"imagen_storage": "binary", "imagen_bin": Binary(PEQUENA)})
+
+    storage.delete(grande)
+    storage.delete(pequena)
+
+    assert mongo_db["imagenes_test.files"].count_documents({}) == 0
+    assert mongo_db["imagenes_test.chunks"].count_documents({}) == 0
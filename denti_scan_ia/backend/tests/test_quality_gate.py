@@ -0,0 +1,113 @@
+# test_quality_gate.py
+# Umbrales del control de calidad con imágenes sintéticas: cada defecto da su motivo
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+import quality_gate
+from quality_gate import check_quality
+
+ENCIA = (190, 80, 90)
+DIENTE = (225, 220, 205)
+
+
+def boca(ancho=480, alto=360, semilla=0):
+    """Mitad encía y mitad dientes, con grano: nítida, bien expuesta y con colores de boca"""
+    pixeles = np.empty((alto, ancho, 3), np.float32)
+    pixeles[: alto // 2] = ENCIA
+    pixeles[alto // 2:] = DIENTE
+    pixeles += np.random.default_rng(semilla).normal(0, 25, (alto, ancho, 1))
+    return Image.fromarray(np.clip(pixeles, 0, 255).astype(np.uint8))
+
+
+def png(im):
+    buf = BytesIO()
+    im.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def motivos(source, mime_type="image/png"):
+    return [m["code"] for m in check_quality(source, mime_type).reasons]
+
+
+def test_foto_correcta():
+    reporte = check_quality(png(boca()), "image/png")
+
+    assert reporte.ok
+    assert reporte.reasons == []
+    assert reporte.metrics["width"] == 480
+    assert reporte.metrics["sharpness"] >= quality_gate.QUALITY_MIN_SHARPNESS
+
+
+def test_jpeg_desde_ruta(tmp_path):
+    ruta = tmp_path / "boca.jpg"
+    boca(2400, 1800).save(ruta, format="JPEG", quality=92)
+
+    reporte = check_quality(str(ruta), "image/jpeg")
+
+    assert reporte.ok
+    assert (reporte.metrics["width"], reporte.metrics["height"]) == (2400, 1800)
+
+
+@pytest.mark.parametrize("imagen, motivo", [
+    (lambda: boca().filter(ImageFilter.GaussianBlur(8)), "blurry"),
+    (lambda: Image.eval(boca(), lambda v: v // 8), "too_dark"),
+    (lambda: Image.eval(boca(), lambda v: min(255, v + 120)), "overexposed"),
+    (lambda: Image.new("RGB", (400, 300), (150, 150, 150)), "low_contrast"),
+], ids=["borrosa", "oscura", "sobreexpuesta", "plana"])
+def test_cada_defecto_da_un_solo_motivo(imagen, motivo):
+    assert motivos(png(imagen())) == [motivo]
+
+
+def test_sin_boca():
+    rng = np.random.default_rng(1)
+    verde = np.clip(np.full((300, 400, 3), (40, 160, 60), np.float32) + rng.normal(0, 25, (300, 400, 1)), 0, 255)
+
+    assert motivos(png(Image.fromarray(verde.astype(np.uint8)))) == ["no_mouth"]
+
+
+def test_radiografia_sin_color_no_pasa_el_chequeo_de_boca():
+    rng = np.random.default_rng(2)
+    gris = Image.fromarray(np.clip(rng.normal(120, 40, (300, 400)), 0, 255).astype(np.uint8))
+
+    assert motivos(png(gris.convert("RGB"))) == []
+
+
+def test_lado_minimo_justo_en_el_umbral(monkeypatch):
+    monkeypatch.setattr(quality_gate, "QUALITY_MIN_SIDE", 160)
+
+    assert motivos(png(boca(240, 160))) == []
+    assert motivos(png(boca(240, 159))) == ["low_resolution"]
+
+
+def test_nitidez_justo_en_el_umbral(monkeypatch):
+    nitidez = check_quality(png(boca()), "image/png").metrics["sharpness"]
+
+    monkeypatch.setattr(quality_gate, "QUALITY_MIN_SHARPNESS", nitidez)
+    assert motivos(png(boca())) == []
+    monkeypatch.setattr(quality_gate, "QUALITY_MIN_SHARPNESS", nitidez + 1)
+    assert motivos(png(boca())) == ["blurry"]
+
+
+def test_formato_no_admitido():
+    reporte = check_quality(png(boca()), "image/gif")
+
+    assert [m["code"] for m in reporte.reasons] == ["file_type"]
+    assert "image/gif" in reporte.reasons[0]["message"]
+
+
+@pytest.mark.parametrize("datos", [
+    b"",
+    b"esto no es una imagen",
+    png(boca())[:2000],
+], ids=["vacio", "texto", "truncado"])
+def test_ilegible(datos):
+    assert motivos(datos) == ["unreadable"]
+
+
+def test_bomba_de_descompresion_es_ilegible(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100 * 100)
+
+    assert motivos(png(boca(200, 200))) == ["unreadable"]
@@ -0,0 +1,109 @@
+# test_result_cache.py
+# ResultCache: aciertos en L1 y L2, fallos, cambio de versión del modelo y cálculos compartidos
+import asyncio
+
+import mongomock
+import pytest
+
+from result_cache import ResultCache, ensure_cache_indexes
+
+RESULTADO = {"diagnosis": "Caries", "confidence": 0.9}
+
+
+@pytest.fixture
+def coleccion():
+    coleccion = mongomock.MongoClient().db.analysis_cache
+    ensure_cache_indexes(coleccion)
+    return coleccion
+
+
+def _cache(coleccion=None, **kwargs):
+    return ResultCache(lambda: coleccion, **kwargs)
+
+
+async def _esperar_purgas(cache):
+    await asyncio.gather(*cache._tasks)
+
+
+def test_fallo_y_luego_acierto_en_l1():
+    cache = _cache()
+
+    async def escenario():
+        antes = await cache.get("abc", "v1")
+        await cache.set("abc", "v1", RESULTADO)
+        return antes, await cache.get("abc", "v1")
+
+    assert asyncio.run(escenario()) == (None, RESULTADO)
+    assert cache.counters["misses"] == 1
+    assert cache.counters["l1_hits"] == 1
+
+
+def test_otro_proceso_acierta_en_l2(coleccion):
+    async def escenario():
+        await _cache(coleccion).set("abc", "v1", RESULTADO)
+        otro = _cache(coleccion)
+        return otro, await otro.get("abc", "v1"), await otro.get("abc", "v1")
+
+    otro, primero, segundo = asyncio.run(escenario())
+
+    assert primero == segundo == RESULTADO
+    # El acierto en L2 se copia a L1
+    assert otro.counters["l2_hits"] == 1
+    assert otro.counters["l1_hits"] == 1
+    assert coleccion.find_one({"_id": ResultCache.key("abc", "v1")})["expires_at"] is not None
+
+
+def test_cambiar_de_modelo_invalida_los_resultados_anteriores(coleccion):
+    cache = _cache(coleccion)
+
+    async def escenario():
+        await cache.set("abc", "v1", RESULTADO)
+        await _esperar_purgas(cache)
+        resultado = await cache.get("abc", "v2")
+        await _esperar_purgas(cache)
+        return resultado
+
+    assert asyncio.run(escenario()) is None
+    assert cache.model_version == "v2"
+    assert coleccion.count_documents({}) == 0
+
+
+def test_vencidos_en_l1_se_recalculan():
+    cache = _cache(ttl_s=-1)
+
+    async def escenario():
+        await cache.set("abc", "v1", RESULTADO)
+        return await cache.get("abc", "v1")
+
+    assert asyncio.run(escenario()) is None
+
+
+def test_l1_respeta_el_limite_de_entradas():
+    cache = _cache(max_entries=2)
+
+    async def escenario():
+        for clave in ("a", "b", "c"):
+            await cache.set(clave, "v1", RESULTADO)
+        return [await cache.get(clave, "v1") for clave in ("a", "b", "c")]
+
+    assert asyncio.run(escenario()) == [None, RESULTADO, RESULTADO]
+    assert cache.counters["evictions"] == 1
+
+
+def test_peticiones_simultaneas_comparten_un_calculo():
+    cache = _cache()
+    llamadas = []
+
+    async def calcular():
+        llamadas.append(1)
+        await asyncio.sleep(0.01)
+        return RESULTADO
+
+    async def escenario():
+        return await asyncio.gather(*(cache.get_or_compute("abc", "v1", calcular) for _ in range(5)))
+
+    resultados = asyncio.run(escenario())
+
+    assert len(llamadas) == 1
+    assert [r for r, _ in resultados] == [RESULTADO] * 5
+    assert sorted(desde_cache for _, desde_cache in resultados) == [False, True, True, True, True]
@@ -0,0 +1,144 @@
+# test_scan_export.py
+# Writers de exportación: filas NDJSON/CSV, gzip por trozos como un único .gz y la ventana (since, until]
+import csv
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+import scan_export
+from scan_export import EXPORT_FIELDS, CSVWriter, GzipWriter, NDJSONWriter, export, export_filter, make_writer
+
+COLUMNAS = [campo for campo, _ in EXPORT_FIELDS]
+
+
+def _escaneo(i, **campos):
+    documento = {
+        "_id": ObjectId(),
+        "name": f"Paciente {i}, «ñandú»",
+        "email": f"p{i}@correo.com",
+        "status": "analyzed",
+        "diagnosis": "caries",
+        "confidence": 0.5 + i / 1000,
+        "recommendations": ["Cepillado", 'Revisión "anual"'],
+        "size_bytes": 1000 + i,
+        "upload_date": datetime(2024, 3, 1, 12, 0, i % 60),
+        "image_data": b"\xff\xd8 nunca se exporta",
+    }
+    documento.update(campos)
+    return documento
+
+
+def _volcar(writer, lotes):
+    return writer.header() + b"".join(writer.write(lote) for lote in lotes) + writer.close()
+
+
+def test_ndjson_una_fila_por_documento():
+    documento = _escaneo(1, checkup_id=ObjectId(), recommendations="Limpieza",
+                         ingested_at=datetime(2024, 3, 1, 12, 0, 5, tzinfo=timezone.utc))
+
+    lineas = NDJSONWriter().write([documento]).decode().splitlines()
+
+    fila = json.loads(lineas[0])
+    assert len(lineas) == 1
+    assert list(fila) == COLUMNAS
+    assert fila["id"] == str(documento["_id"])
+    assert fila["checkup_id"] == str(documento["checkup_id"])
+    assert fila["name"] == "Paciente 1, «ñandú»"
+    assert fila["recommendations"] == ["Limpieza"]
+    # Fechas sin zona = UTC, como las devuelve pymongo
+    assert fila["upload_date"] == "2024-03-01T12:00:01+00:00"
+    assert fila["ingested_at"] == "2024-03-01T12:00:05+00:00"
+    assert fila["model_version"] is None
+    assert "image_data" not in fila
+
+
+def test_csv_cabecera_listas_y_vacios():
+    writer = CSVWriter()
+
+    filas = list(csv.reader(io.StringIO(_volcar(writer, [[_escaneo(1)], [_escaneo(2, diagnosis=None)]]).decode())))
+
+    assert filas[0] == COLUMNAS
+    assert len(filas) == 3
+    primera = dict(zip(COLUMNAS, filas[1]))
+    assert primera["name"] == "Paciente 1, «ñandú»"
+    assert primera["recommendations"] == 'Cepillado | Revisión "anual"'
+    assert primera["upload_date"] == "2024-03-01T12:00:01+00:00"
+    assert primera["ingested_at"] == ""
+    assert primera["size_bytes"] == "1001"
+    assert dict(zip(COLUMNAS, filas[2]))["diagnosis"] == ""
+
+
+@pytest.mark.parametrize("formato, writer", [("ndjson", NDJSONWriter), ("csv", CSVWriter)])
+def test_gzip_por_trozos_es_un_solo_archivo(formato, writer):
+    lotes = [[_escaneo(i) for i in range(j, j + 7)] for j in range(0, 70, 7)]
+    comprimido = GzipWriter(writer())
+
+    trozos = [comprimido.header()] + [comprimido.write(lote) for lote in lotes] + [comprimido.close()]
+
+    datos = b"".join(trozos)
+    assert datos[:2] == b"\x1f\x8b"
+    assert gzip.decompress(datos) == _volcar(writer(), lotes)
+    # Un único miembro gzip (no uno por lote) que termina justo en el último byte
+    d = zlib.decompressobj(31)
+    d.decompress(datos)
+    assert d.eof and d.unused_data == b""
+
+
+def test_make_writer():
+    assert isinstance(make_writer("ndjson"), NDJSONWriter)
+    assert isinstance(make_writer("csv", gzip=True).writer, CSVWriter)
+    with pytest.raises(ValueError):
+        make_writer("xlsx")
+    with pytest.raises(ValueError):
+        make_writer("parquet", gzip=True)
+
+
+def test_export_desde_mongodb_por_lotes():
+    coleccion = mongomock.MongoClient().db.imagenes
+    coleccion.insert_many([_escaneo(i) for i in range(25)])
+    salida = io.BytesIO()
+    avisos = []
+
+    total, escritos = export(coleccion, salida, "ndjson", gzip=True, batch_size=10, progreso=avisos.append)
+
+    filas = [json.loads(l) for l in gzip.decompress(salida.getvalue()).splitlines()]
+    assert (total, escritos) == (25, len(salida.getvalue()))
+    assert avisos == [10, 20, 25]
+    assert sorted(f["email"] for f in filas) == sorted(f"p{i}@correo.com" for i in range(25))
+
+
+def test_ventana_since_until():
+    coleccion = mongomock.MongoClient().db.imagenes
+    corte = datetime(2024, 3, 1, 12, 0, 0)
+    coleccion.insert_many([
+        _escaneo(0, email="antiguo@correo.com"),
+        _escaneo(1, email="antes@correo.com", ingested_at=datetime(2024, 3, 1, 11, 59, 59)),
+        _escaneo(2, email="justo@correo.com", ingested_at=corte),
+        _escaneo(3, email="despues@correo.com", ingested_at=datetime(2024, 3, 1, 12, 0, 1)),
+    ])
+
+    def emails(filtro):
+        return sorted(d["email"] for d in coleccion.find(filtro))
+
+    # Sin since entran también los documentos sin ingested_at; until es inclusivo y since exclusivo
+    assert emails(export_filter(until=corte)) == ["antes@correo.com", "antiguo@correo.com", "justo@correo.com"]
+    assert emails(export_filter(since=corte)) == ["despues@correo.com"]
+    assert export_filter(since=corte, until=corte, status="analyzed") == {
+        "ingested_at": {"$gt": corte, "$lte": corte}, "status": "analyzed"}
+
+
+def test_watermark_trunca_al_milisegundo_en_utc():
+    marca = scan_export.watermark(datetime(2024, 3, 1, 12, 0, 0, 123999))
+
+    assert marca == datetime(2024, 3, 1, 12, 0, 0, 123000, tzinfo=timezone.utc)
+    assert scan_export.parse_timestamp("2024-03-01T13:00:00.5+01:00") == datetime(2024, 3, 1, 12, 0, 0, 500000,
+                                                                                  tzinfo=timezone.utc)
+    assert scan_export.filename_for("csv", True, marca) == "scans-20240301T120000Z.csv.gz"
+    assert scan_export.media_type_for("csv", True) == "application/gzip"
+    assert scan_export.media_type_for("ndjson", False) == "application/x-ndjson"
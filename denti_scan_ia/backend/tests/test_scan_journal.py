@@ -0,0 +1,105 @@
+# test_scan_journal.py
+# Diario de escaneos: reenvíos con _id duplicado, rechazos de MongoDB y confirmación (ack)
+import asyncio
+
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError
+
+from scan_journal import JournalFlusher, ScanJournal
+
+VALIDACION_FALLIDA = 121
+
+
+class ColeccionQueRechaza:
+    """Inserta como mongomock salvo los documentos marcados, que rechaza como haría un validador"""
+
+    def __init__(self, coleccion):
+        self._coleccion = coleccion
+
+    def insert_many(self, documentos, ordered=True):
+        errores = []
+        for i, documento in enumerate(documentos):
+            if documento.get("invalido"):
+                errores.append({"index": i, "code": VALIDACION_FALLIDA, "errmsg": "Document failed validation"})
+            else:
+                self._coleccion.insert_one(documento)
+        if errores:
+            raise BulkWriteError({"writeErrors": errores, "nInserted": len(documentos) - len(errores)})
+
+    def __getattr__(self, nombre):
+        return getattr(self._coleccion, nombre)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return ScanJournal(str(tmp_path / "scan_journal.sqlite3"))
+
+
+@pytest.fixture
+def coleccion():
+    return mongomock.MongoClient().db.imagenes
+
+
+def _flush(flusher):
+    return asyncio.run(flusher.flush_once())
+
+
+def test_append_asigna_el_id_y_no_duplica(journal):
+    scan_id = journal.append({"email": "ana@correo.com"})
+    journal.append({"_id": journal.pending()[0][1]["_id"], "email": "ana@correo.com"})
+
+    assert len(scan_id) == 24
+    assert journal.depth() == {"pending": 1, "dead": 0}
+
+
+def test_flush_envia_y_confirma(journal, coleccion):
+    ids = journal.append_many([{"email": f"p{i}@correo.com"} for i in range(5)])
+    flusher = JournalFlusher(journal, lambda: coleccion)
+
+    assert _flush(flusher) == 5
+
+    assert journal.depth() == {"pending": 0, "dead": 0}
+    assert sorted(str(d["_id"]) for d in coleccion.find()) == sorted(ids)
+    assert flusher.counters["flushed"] == 5
+
+
+def test_reenvio_de_un_lote_ya_insertado_cuenta_como_enviado(journal, coleccion):
+    # Un envío anterior llegó a MongoDB pero el proceso cayó antes del ack
+    journal.append_many([{"email": f"p{i}@correo.com"} for i in range(3)])
+    coleccion.insert_one(journal.pending()[1][1])
+    flusher = JournalFlusher(journal, lambda: coleccion)
+
+    assert _flush(flusher) == 3
+
+    assert journal.depth() == {"pending": 0, "dead": 0}
+    assert coleccion.count_documents({}) == 3
+    assert flusher.counters["duplicates"] == 1
+    assert flusher.counters["rejected"] == 0
+
+
+def test_rechazado_se_reintenta_y_se_aparta_tras_max_intentos(journal, coleccion, monkeypatch):
+    journal.append_many([{"email": "bien@correo.com"}, {"email": "mal@correo.com", "invalido": True}])
+    flusher = JournalFlusher(journal, lambda: ColeccionQueRechaza(coleccion))
+    reject = journal.reject
+    monkeypatch.setattr(journal, "reject", lambda errores: reject(errores, max_attempts=2))
+
+    _flush(flusher)
+    assert journal.depth() == {"pending": 1, "dead": 0}
+    assert coleccion.count_documents({}) == 1
+
+    _flush(flusher)
+    assert journal.depth() == {"pending": 0, "dead": 1}
+    assert flusher.counters["rejected"] == 2
+    fila = journal._conn().execute("SELECT attempts, last_error FROM journal").fetchone()
+    assert fila == (2, "Document failed validation")
+
+
+def test_sin_conexion_no_confirma_nada(journal):
+    journal.append({"email": "ana@correo.com"})
+    flusher = JournalFlusher(journal, lambda: None)
+
+    with pytest.raises(ConnectionError):
+        _flush(flusher)
+
+    assert journal.depth() == {"pending": 1, "dead": 0}
@@ -0,0 +1,124 @@
+# thumbnails.py
+# Miniaturas bajo demanda con caché en disco
+#
+#   uploads/thumbs/<ancho>/ab/cd/<hash>.jpg
+#
+# Los anchos se redondean a una lista fija para que la caché no crezca con
+# cada valor distinto de ?w= que pida un cliente; el alto es proporcional. Son
+# artefactos derivados: si el disco llega a su cuota se borran las menos usadas
+# (evict_lru) y se vuelven a generar cuando alguien las pida, y ImageStore las
+# borra junto con la imagen.
+import asyncio
+import os
+import time
+import uuid
+
+from image_preprocessing import make_width_thumbnail, open_normalized
+from persistence import run_disk
+
+THUMB_WIDTHS = tuple(int(w) for w in os.getenv("THUMB_WIDTHS", "64,128,256,512,1024").split(","))
+# El mtime de una miniatura marca su último uso (LRU); se actualiza como mucho una vez por intervalo
+THUMB_TOUCH_INTERVAL_S = float(os.getenv("THUMB_TOUCH_INTERVAL_S", "3600"))
+
+
+def pick_width(requested):
+    """El menor ancho permitido que cubra el pedido"""
+    for width in THUMB_WIDTHS:
+        if width >= requested:
+            return width
+    return THUMB_WIDTHS[-1]
+
+
+class ThumbnailCache:
+    def __init__(self, image_store):
+        self.image_store = image_store
+        self.root = image_store.thumbs_dir
+        self._pending = {}
+
+    def path(self, sha256, width):
+        return self.image_store.thumb_path(sha256, width)
+
+    def _render(self, sha256, width, im=None):
+        """Crear la miniatura y devolver (ruta, bytes); im permite reutilizar una imagen ya decodificada"""
+        destino = self.path(sha256, width)
+        if im is None:
+            ubicacion = self.image_store.locate(sha256)
+            if ubicacion is None:
+                raise FileNotFoundError(f"La imagen {sha256} no está en el almacén")
+            # Basta con cubrir el ancho, pero la rotación EXIF puede intercambiar los lados
+            im, _, _ = open_normalized(ubicacion[0], min_size=(width, width))
+        data = make_width_thumbnail(im, width)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Escritura atómica: nunca se sirve una miniatura a medio escribir
+        tmp = f"{destino}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, destino)
+        return destino, data
+
+    def generate(self, sha256, width, im=None):
+        """Crear la miniatura y devolver su ruta"""
+        return self._render(sha256, width, im)[0]
+
+    def cached(self, sha256, width):
+        """Bytes de la miniatura si ya está en disco (marcando su uso), o None"""
+        destino = self.path(sha256, width)
+        try:
+            with open(destino, "rb") as f:
+                data = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            # No existe o la acaba de borrar evict_lru
+            return None
+        if time.time() - mtime > THUMB_TOUCH_INTERVAL_S:
+            try:
+                os.utime(destino)
+            except FileNotFoundError:
+                pass
+        return data
+
+    async def get(self, sha256, width):
+        """
+        Bytes de la miniatura, generándola si aún no existe. Se devuelven los
+        bytes y no la ruta: evict_lru puede borrar el archivo en cualquier momento.
+        """
+        data = await run_disk(self.cached, sha256, width)
+        if data is not None:
+            return data
+        key = (sha256, width)
+        pending = self._pending.get(key)
+        if pending is None:
+            # Peticiones simultáneas de la misma miniatura comparten la generación
+            pending = asyncio.ensure_future(run_disk(self._render, sha256, width))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return (await asyncio.shield(pending))[1]
+
+    def disk_usage(self):
+        """[(mtime, tamaño, ruta)] de todas las miniaturas en disco"""
+        archivos = []
+        for actual, _, nombres in os.walk(self.root):
+            for nombre in nombres:
+                if nombre.endswith(".tmp"):
+                    continue
+                ruta = os.path.join(actual, nombre)
+                try:
+                    st = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                archivos.append((st.st_mtime, st.st_size, ruta))
+        return archivos
+
+    def evict_lru(self, bytes_to_free, archivos=None):
+        """Borrar las miniaturas usadas hace más tiempo hasta liberar bytes_to_free; devuelve (archivos, bytes)"""
+        borrados = liberados = 0
+        for _, size, ruta in sorted(archivos if archivos is not None else self.disk_usage()):
+            if liberados >= bytes_to_free:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                continue
+            borrados += 1
+            liberados += size
+        return borrados, liberados
@@ -0,0 +1,168 @@
+# upload_stream.py
+# Guardado de imágenes por bloques: memoria constante sin importar el tamaño del archivo
+import hashlib
+import os
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from persistence import run_disk
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+
+# Firmas de los formatos de imagen que aceptamos
+_FIRMAS = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"BM", "image/bmp"),
+)
+# Única lista de tipos admitidos: la usan la subida y el control de calidad
+ACCEPTED_MIME_TYPES = frozenset(mime for _, mime in _FIRMAS) | {"image/webp"}
+
+
+@dataclass
+class StoredUpload:
+    path: str
+    size: int
+    sha256: str
+    mime_type: str
+
+
+def sniff_mime(head):
+    """Detectar el tipo de imagen a partir de los primeros bytes"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for firma, mime in _FIRMAS:
+        if head.startswith(firma):
+            return mime
+    return None
+
+
+def content_length_exceeded(headers, max_bytes=MAX_UPLOAD_BYTES):
+    """Rechazar antes de leer el cuerpo si el cliente declara un tamaño excesivo"""
+    try:
+        return int(headers.get("content-length", 0)) > max_bytes
+    except ValueError:
+        return False
+
+
+def _too_large_detail(max_bytes):
+    return f"La petición supera el tamaño máximo de {max_bytes // (1024 * 1024)} MB"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Limitar el cuerpo de los POST contando los bytes que llegan por 'receive'.
+    Content-Length solo sirve para rechazar pronto: las subidas chunked no lo
+    envían y Starlette vuelca el formulario entero antes de llamar al endpoint,
+    así que el límite se comprueba mientras se lee el cuerpo.
+    """
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES, limits_by_path=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits_by_path = limits_by_path or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.limits_by_path.get(scope["path"], self.max_bytes)
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        if content_length_exceeded(headers, max_bytes):
+            response = JSONResponse(status_code=413, content={"detail": _too_large_detail(max_bytes)})
+            await response(scope, receive, send)
+            return
+
+        recibidos = 0
+        excedido = False
+        iniciada = False
+
+        async def receive_limitado():
+            nonlocal recibidos, excedido
+            message = await receive()
+            if message["type"] == "http.request":
+                recibidos += len(message.get("body", b""))
+                if recibidos > max_bytes:
+                    excedido = True
+                    raise HTTPException(status_code=413, detail=_too_large_detail(max_bytes))
+            return message
+
+        async def send_vigilado(message):
+            nonlocal iniciada
+            # El error con el que la app responda al cuerpo cortado se sustituye por el 413
+            if excedido and not iniciada:
+                return
+            if message["type"] == "http.response.start":
+                iniciada = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limitado, send_vigilado)
+        except Exception:
+            if not excedido or iniciada:
+                raise
+        if excedido and not iniciada:
+            response = JSONResponse(status_code=413, content={"detail": _too_large_detail(max_bytes)})
+            await response(scope, receive, send)
+
+
+def _write_and_hash(f, hasher, chunk):
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+def _close_file(f, tmp_path, final_path, keep):
+    f.close()
+    if keep:
+        os.replace(tmp_path, final_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+def _open_for_write(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return open(path, "wb")
+
+
+async def stream_upload_to_disk(upload, dest_path, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Copiar un UploadFile a disco por bloques, calculando SHA-256 y tipo MIME.
+    Lanza 413 si el archivo supera max_bytes y 415 si no es una imagen conocida.
+    Starlette ya ha volcado el formulario al llegar aquí: el límite del cuerpo
+    mientras se recibe lo pone UploadSizeLimitMiddleware.
+    """
+    tmp_path = dest_path + ".part"
+    hasher = hashlib.sha256()
+    size = 0
+    mime_type = None
+    f = await run_disk(_open_for_write, tmp_path)
+    ok = False
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            if mime_type is None:
+                mime_type = sniff_mime(chunk[:16])
+                if mime_type is None:
+                    raise HTTPException(status_code=415, detail="El archivo no es una imagen soportada")
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"La imagen supera el tamaño máximo de {max_bytes // (1024 * 1024)} MB",
+                )
+            # El hash y la escritura se hacen en el pool de disco
+            await run_disk(_write_and_hash, f, hasher, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="El archivo está vacío")
+        ok = True
+    finally:
+        await run_disk(_close_file, f, tmp_path, dest_path, ok)
+
+    return StoredUpload(path=dest_path, size=size, sha256=hasher.hexdigest(), mime_type=mime_type)
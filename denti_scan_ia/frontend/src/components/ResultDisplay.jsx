@@ -5,7 +5,7 @@ function ResultDisplay({ result }) {
     return null;
   }
 
-  const { diagnosis_result, confidence_score, recommendations, highlighted_image_url, warning_message } = result;
+  const { diagnosis_result, confidence_score, recommendations, highlighted_image_url, image_url, thumbnail_url, warning_message } = result;
 
   return (
     <div className="mt-6 p-4 border rounded-lg shadow-sm bg-white">
@@ -22,6 +22,19 @@ function ResultDisplay({ result }) {
         </div>
       )}
 
+      {!highlighted_image_url && thumbnail_url && (
+        <div className="mb-4 text-center">
+          <a href={`http://localhost:8000${image_url}`} target="_blank" rel="noreferrer">
+            <img
+              src={`http://localhost:8000${thumbnail_url}`}
+              alt="Imagen analizada"
+              loading="lazy"
+              className="max-w-full h-auto rounded-lg shadow-md mx-auto"
+            />
+          </a>
+        </div>
+      )}
+
       <div className="mb-3">
         <p className="text-lg font-medium text-gray-700">Diagnóstico:</p>
         <p className="text-xl font-bold text-blue-600">{diagnosis_result}</p>
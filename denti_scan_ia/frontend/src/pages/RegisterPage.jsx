@@ -1,6 +1,30 @@
 import React, { useState } from 'react';
 import InteractiveBackground from '../components/InteractiveBackground';
 
+const API_URL = 'http://localhost:8000';
+
+// Escucha el progreso del trabajo por SSE hasta que termina
+const waitForJob = (eventsUrl, onProgress) =>
+  new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_URL}${eventsUrl}`);
+    source.addEventListener('running', (e) => {
+      const job = JSON.parse(e.data);
+      if (onProgress) onProgress(job);
+    });
+    source.addEventListener('done', (e) => {
+      source.close();
+      resolve(JSON.parse(e.data).result);
+    });
+    source.addEventListener('failed', (e) => {
+      source.close();
+      reject(new Error(JSON.parse(e.data).error || 'El análisis falló'));
+    });
+    source.onerror = () => {
+      source.close();
+      reject(new Error('Se perdió la conexión con el servidor'));
+    };
+  });
+
 const RegisterPage = () => {
   const [formData, setFormData] = useState({
     name: '',
@@ -10,6 +34,7 @@ const RegisterPage = () => {
   const [image, setImage] = useState(null);
   const [imagePreview, setImagePreview] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [progress, setProgress] = useState(0);
 
   const handleInputChange = (e) => {
     const { name, value } = e.target;
@@ -49,6 +74,7 @@ const RegisterPage = () => {
     }
     
     setIsLoading(true);
+    setProgress(0);
 
     const data = new FormData();
     data.append('name', formData.name.trim());
@@ -64,17 +90,32 @@ const RegisterPage = () => {
         imageName: image.name
       });
       
-      // Aquí va la llamada a tu backend FastAPI
-      const response = await fetch('http://localhost:8000/analyze_dental_image', {
+      // Encolar el análisis; el backend responde enseguida con el id del trabajo
+      const response = await fetch(`${API_URL}/jobs/analyze_dental_image`, {
         method: 'POST',
         body: data,
       });
       
+      if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After') || '10';
+        throw new Error(`El servidor está ocupado, intenta de nuevo en ${retryAfter} segundos`);
+      }
+
+      if (response.status === 422) {
+        // Control de calidad: la foto se rechaza con motivos que el paciente puede corregir
+        const body = await response.json();
+        const reasons = (body.detail?.reasons || []).map((reason) => `• ${reason.message}`).join('\n');
+        throw new Error(reasons ? `La foto no sirve para el análisis:\n${reasons}` : 'No se pudo leer la imagen');
+      }
+
       if (!response.ok) {
         throw new Error(`Error del servidor: ${response.status}`);
       }
       
-      const result = await response.json();
+      const job = await response.json();
+      console.log('Trabajo encolado:', job);
+
+      const result = await waitForJob(job.events_url, (update) => setProgress(update.progress));
       console.log('Análisis recibido:', result);
       
       if (result.status === 'success') {
@@ -163,7 +204,7 @@ const RegisterPage = () => {
           {/* Botón de envío */}
           <div className="md:col-span-2 text-center mt-4">
             <button type="submit" disabled={isLoading} className="w-full md:w-auto bg-[#3A86FF] hover:bg-[#2a75e8] disabled:bg-gray-500 disabled:cursor-not-allowed font-bold py-3 px-12 rounded-full text-lg transition-all duration-300">
-              {isLoading ? 'Analizando...' : 'Enviar para Análisis'}
+              {isLoading ? `Analizando... ${progress}%` : 'Enviar para Análisis'}
             </button>
           </div>
         </form>